@@ -0,0 +1,9 @@
+"""Benchmarks for psrun's own overhead.
+
+Run them all, and print the results as JSON, with::
+
+    make bench
+
+or ``python -m benchmarks --help`` for the options.
+
+"""
@@ -0,0 +1,70 @@
+"""Run the benchmarks, and print the results as JSON."""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+
+from . import monitoring
+from . import overhead
+from . import throughput
+
+
+def parse_args(args):
+    """Parse the command line arguments."""
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks",
+        description="Measure psrun's own overhead.")
+
+    repeat_help = "Num times to repeat each measurement. Default: %(default)s"
+    parser.add_argument("--repeat", type=int, help=repeat_help, default=10)
+
+    num_bytes_help = "Num bytes of output to forward. Default: %(default)s"
+    parser.add_argument(
+        "--num-bytes", type=int, help=num_bytes_help, default=20000000)
+
+    output_help = "Where to write the results. Default: stdout"
+    parser.add_argument("--output", help=output_help, default=None)
+
+    return parser.parse_args(args)
+
+
+def run(args):
+    """Run the benchmarks.
+
+    Args:
+
+        args
+            The parsed command line arguments.
+
+    Returns:
+        A dict of results.
+
+    """
+    results = {}
+    results["time"] = datetime.datetime.now().isoformat()
+    results["python"] = platform.python_version()
+    results["platform"] = platform.platform()
+    results["cpu_count"] = os.cpu_count()
+    results["overhead"] = overhead.run(args.repeat)
+    results["throughput"] = throughput.run(args.num_bytes)
+    results["monitoring"] = monitoring.run(args.repeat * 10)
+    results["memory"] = monitoring.rss()
+    return results
+
+
+def main():
+    """Run the benchmarks, and write out the results."""
+    args = parse_args(sys.argv[1:])
+    data = json.dumps(run(args), indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(data + "\n")
+    else:
+        print(data)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""How much it costs to monitor a process."""
+
+import resource
+import subprocess
+
+import psutil
+
+from psrun.lib import monitor
+from psrun.lib import procfs
+
+from . import util
+
+
+def collect(sampler, repeat):
+    """Time ``monitor.collect()`` on a running process.
+
+    Args:
+
+        sampler
+            The ``monitor.Sampler`` to collect system stats with.
+
+        repeat
+            The number of samples to take.
+
+    Returns:
+        A dict of results, in seconds per sample.
+
+    """
+    p = subprocess.Popen("sleep 60", shell=True)
+    try:
+        procs = {}
+        samples = util.measure(
+            lambda: monitor.collect(
+                util.null_log, p.pid, procs, None, sampler),
+            repeat)
+    finally:
+        p.kill()
+        p.wait()
+    return util.summarize(samples)
+
+
+def sample(backend, repeat):
+    """Time collecting the system stats with a backend.
+
+    Args:
+
+        backend
+            The backend to collect them with, e.g., "psutil" or "procfs".
+
+        repeat
+            The number of samples to take.
+
+    Returns:
+        A dict of results, in seconds per sample.
+
+    """
+    sampler = monitor.Sampler(backend=backend)
+    return util.summarize(util.measure(sampler.sample, repeat))
+
+
+def run(repeat):
+    """Run the benchmarks in this module.
+
+    A sample with a plain ``Sampler`` collects the system stats each
+    time, while one with a subscribed ``SharedSampler`` only collects the
+    per-process stats, as each run in a batch does. Where /proc can be
+    read directly, the system stats are also collected with each backend.
+
+    Args:
+
+        repeat
+            The number of samples to take each way.
+
+    Returns:
+        A dict of results.
+
+    """
+    results = {}
+    results["collect_secs"] = collect(monitor.Sampler(), repeat)
+    with monitor.SharedSampler() as sampler:
+        results["collect_shared_secs"] = collect(sampler, repeat)
+    results["sample_psutil_secs"] = sample("psutil", repeat)
+    if procfs.is_supported():
+        results["sample_procfs_secs"] = sample("procfs", repeat)
+    return results
+
+
+def rss():
+    """Get the memory used by this (the psrun) process.
+
+    Returns:
+        A dict of the current and max RSS, in bytes.
+
+    """
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return {
+        "rss_bytes": psutil.Process().memory_info().rss,
+        "max_rss_bytes": usage.ru_maxrss * 1024}
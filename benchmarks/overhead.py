@@ -0,0 +1,98 @@
+"""How much time psrun adds to running a command."""
+
+import subprocess
+import sys
+import time
+
+from psrun.lib import proc
+
+from . import util
+
+EXIT_CMD = (
+    "{} -c 'import os, time; print(time.monotonic(), flush=True); "
+    "os._exit(0)'".format(sys.executable))
+"""A command that prints the (monotonic) time it exits at."""
+
+
+def execute(cmd):
+    """Execute a command with psrun, discarding everything it logs.
+
+    Returns:
+        The lines of the command's stdout.
+
+    """
+    lines = []
+    proc.execute(cmd, lines.append, util.null_log, util.null_log, None, None)
+    return lines
+
+
+def wall_clock(cmd, repeat):
+    """Compare the time it takes to run a command bare, and with psrun.
+
+    Args:
+
+        cmd
+            The command to run, e.g., "true".
+
+        repeat
+            The number of times to run it each way.
+
+    Returns:
+        A dict of results, in seconds. The overhead is the difference
+        between the medians.
+
+    """
+    bare = util.measure(
+        lambda: subprocess.run(
+            cmd, shell=True, stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL),
+        repeat)
+    supervised = util.measure(lambda: execute(cmd), repeat)
+    return {
+        "cmd": cmd,
+        "bare_secs": util.summarize(bare),
+        "psrun_secs": util.summarize(supervised),
+        "overhead_secs": (
+            util.summarize(supervised)["median"] -
+            util.summarize(bare)["median"])}
+
+
+def exit_latency(repeat):
+    """Measure how long psrun takes to notice that a command has exited.
+
+    The command prints the time just before it exits, so the latency is
+    the time from then until ``proc.execute()`` returns. That includes
+    waiting for the command's output to be read, and the final sample.
+
+    Args:
+
+        repeat
+            The number of times to run the command.
+
+    Returns:
+        A dict of results, in seconds.
+
+    """
+    samples = []
+    for _ in range(repeat):
+        lines = execute(EXIT_CMD)
+        samples.append(time.monotonic() - float(lines[-1]))
+    return {"exit_latency_secs": util.summarize(samples)}
+
+
+def run(repeat):
+    """Run the benchmarks in this module.
+
+    Args:
+
+        repeat
+            The number of times to repeat each measurement.
+
+    Returns:
+        A dict of results.
+
+    """
+    return {
+        "true": wall_clock("true", repeat),
+        "sleep": wall_clock("sleep 0.5", repeat),
+        "exit": exit_latency(repeat)}
@@ -0,0 +1,83 @@
+"""How fast psrun forwards a command's output."""
+
+import os
+import tempfile
+import time
+
+from psrun.cli import log as cli_log
+from psrun.lib import proc
+
+from . import util
+
+LINE = "x" * 99
+"""A line of output (plus a newline, 100 bytes)."""
+
+
+def get_cmd(num_bytes):
+    """Get a command that writes ``num_bytes`` of lines to stdout."""
+    return "yes {} | head -c {}".format(LINE, num_bytes)
+
+
+def forward(num_bytes, out, close=None):
+    """Time how long psrun takes to forward a command's output.
+
+    Args:
+
+        num_bytes
+            The number of bytes the command writes.
+
+        out
+            Where to forward them to: a callable for each line, or a file
+            descriptor to copy raw bytes to.
+
+        close
+            An optional callable to finish writing the output, e.g., to
+            flush the log sinks. It is included in the time.
+
+    Returns:
+        A dict of results.
+
+    """
+    start = time.perf_counter()
+    proc.execute(
+        get_cmd(num_bytes), out, util.null_log, util.null_log, None, None)
+    if close:
+        close()
+    secs = time.perf_counter() - start
+    num_lines = num_bytes // (len(LINE) + 1)
+    return {
+        "secs": secs,
+        "mb_per_sec": num_bytes / secs / 1e6,
+        "lines_per_sec": num_lines / secs}
+
+
+def run(num_bytes):
+    """Run the benchmarks in this module.
+
+    Output is forwarded line by line to a callable that discards it (the
+    cost of the streams and buffers alone), line by line to a file
+    through a ``cli.log`` sink, and as raw bytes to a file.
+
+    Args:
+
+        num_bytes
+            The number of bytes of output to forward each time.
+
+    Returns:
+        A dict of results.
+
+    """
+    results = {"num_bytes": num_bytes}
+    results["lines"] = forward(num_bytes, util.null_log)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "lines.log")
+        log = cli_log.get_log("benchmarks.throughput", path)
+        results["lines_to_file"] = forward(
+            num_bytes, log, cli_log.close_sinks)
+
+        fd = cli_log.get_fd(os.path.join(tmp, "raw.log"))
+        try:
+            results["raw_to_file"] = forward(num_bytes, fd)
+        finally:
+            cli_log.close_fds()
+    return results
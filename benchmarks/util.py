@@ -0,0 +1,49 @@
+"""Helpers for the benchmarks."""
+
+import statistics
+import time
+
+
+def null_log(msg):
+    """A log that discards its messages."""
+
+
+def summarize(samples):
+    """Summarize a list of measurements.
+
+    Args:
+
+        samples
+            A list of numbers.
+
+    Returns:
+        A dict with the ``median``, ``min`` and ``max`` of the samples.
+
+    """
+    return {
+        "median": statistics.median(samples),
+        "min": min(samples),
+        "max": max(samples)}
+
+
+def measure(func, repeat):
+    """Time a function.
+
+    Args:
+
+        func
+            A callable that takes no arguments.
+
+        repeat
+            The number of times to call it.
+
+    Returns:
+        A list of the number of seconds each call took.
+
+    """
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
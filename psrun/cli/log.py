@@ -1,15 +1,175 @@
 """Log utilities for the CLI."""
 
+import atexit
+import fcntl
 import logging
 import logging.handlers
 
+import os
 import sys
 
 from collections import OrderedDict
+from threading import Condition, Lock, Thread
+
+from psrun.lib import columnar
+from psrun.lib import constants
+from psrun.lib import stream
 
 fmt = "%(message)s"
 """A format for log messages."""
 
+SINKS = {}
+"""The open sinks, by output."""
+
+FDS = {}
+"""The file descriptors opened for raw output, by output."""
+
+WRITERS = {}
+"""The columnar writers, by output."""
+
+LOGGERS = {}
+"""The loggers that write out the sinks, by output."""
+
+REFS = {}
+"""The num of logs got for each output that are not released yet."""
+
+
+class Sink(object):
+    """Collects log messages, and writes them out in batches, in a thread.
+
+    Sending a message to a sink only appends it to a list. A thread joins
+    the messages up, and writes them out with a single call, once there
+    are ``batch_size`` bytes of them, or ``flush_interval`` secs have
+    passed, or the sink is closed. So the cost of formatting and writing
+    a log record is paid once per batch, rather than once per line.
+
+    If the writes cannot keep up, senders wait once there are 16 batches'
+    worth of messages waiting. Messages sent after the sink is closed are
+    written straight away.
+
+    A sink that does not ``join`` its batches still collects messages the
+    same way, but writes each one with a call of its own. Use it for a
+    log that rotates, so that the log rotates between messages (and stays
+    under its max size), not in the middle of a batch.
+
+    Args:
+
+        write_batch
+            A callable to write a batch of messages to, as one string with
+            a message per line, e.g., ``logger.info``.
+
+        batch_size
+            Num bytes of messages to collect before writing them out.
+            Default: ``constants.LOG_BATCH_SIZE``.
+
+        flush_interval
+            Max num secs to hold a message before writing it out.
+            Default: ``constants.LOG_FLUSH_INTERVAL``.
+
+        join
+            Whether to write each batch with a single call. Default: True.
+
+    """
+
+    def __init__(
+            self, write_batch, batch_size=None, flush_interval=None,
+            join=True):
+        """Initialize the sink, and start its thread."""
+        self.write_batch = write_batch
+        self.join = join
+        self.batch_size = batch_size or constants.LOG_BATCH_SIZE
+        self.flush_interval = flush_interval or constants.LOG_FLUSH_INTERVAL
+        self.max_pending = self.batch_size * 16
+        self.messages = []
+        self.size = 0
+        self.stopping = False
+        self.closed = False
+        self.ready = Condition()
+        self.writing = Lock()
+        self.thread = Thread(target=self.loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write(self, msg):
+        """Send a message to the sink."""
+        with self.ready:
+            while self.size >= self.max_pending and not self.closed:
+                self.ready.wait()
+            if not self.closed:
+                self.messages.append(msg)
+                self.size += len(msg) + 1
+                if self.size >= self.batch_size:
+                    self.ready.notify_all()
+                return
+        with self.writing:
+            self.write_batch(msg)
+
+    def loop(self):
+        """Write out batches of messages, until the sink is closed."""
+        closed = False
+        while not closed:
+            with self.ready:
+                if not self.stopping and self.size < self.batch_size:
+                    self.ready.wait(self.flush_interval)
+                messages, self.messages = self.messages, []
+                self.size = 0
+                closed = self.closed = self.stopping
+                self.writing.acquire()
+                self.ready.notify_all()
+            try:
+                if messages and self.join:
+                    self.write_batch("\n".join(messages))
+                elif messages:
+                    for msg in messages:
+                        self.write_batch(msg)
+            finally:
+                self.writing.release()
+
+    def close(self):
+        """Write out the messages in the sink, and stop its thread."""
+        with self.ready:
+            self.stopping = True
+            self.ready.notify_all()
+        self.thread.join()
+
+
+def get_sink(output, write_batch, join=True):
+    """Get the sink for an output, or create one.
+
+    Logs that share an output share its sink, so their messages stay in
+    the order they were sent.
+
+    Args:
+
+        output
+            Where the sink writes to, e.g., "stdout" or "/dummy/path".
+
+        write_batch
+            A callable to write batches of messages to, if the sink has to
+            be created.
+
+        join
+            Whether the sink, if it has to be created, writes each batch
+            with a single call. See ``Sink``.
+
+    Returns:
+        A ``Sink``.
+
+    """
+    if output not in SINKS:
+        SINKS[output] = Sink(write_batch, join=join)
+    return SINKS[output]
+
+
+def close_sinks():
+    """Write out the messages in all of the sinks, and close them."""
+    while SINKS:
+        _, sink = SINKS.popitem()
+        sink.close()
+
+
+atexit.register(close_sinks)
+
 
 def get_writer(func):
     """Return a function that applies a func to an arg."""
@@ -116,16 +276,173 @@ def get_log(name, output, num_bytes=None, num_files=None):
             Number of files to keep.
 
     Returns:
-        A function you can send messages to.
+        A function you can send messages to. Messages are written out in
+        batches, by the output's ``Sink``. If the log rotates, each batch
+        is written a message at a time, so it rotates between messages.
 
     """
     logger = None
+    join = True
     if output == "/dev/null":
         logger = get_null_logger(name)
+        hold(output)
+        return get_writer(logger.info)
+    elif output in SINKS:
+        hold(output)
+        return get_writer(SINKS[output].write)
     elif output == "stdout":
         logger = get_stream_logger(name, sys.stdout)
     elif output == "stderr":
         logger = get_stream_logger(name, sys.stderr)
     else:
         logger = get_file_logger(name, output, num_bytes, num_files)
-    return get_writer(logger.info)
+        join = not num_bytes
+    LOGGERS[output] = logger
+    hold(output)
+    return get_writer(get_sink(output, logger.info, join).write)
+
+
+def get_fd(output):
+    """Get a file descriptor to write raw bytes to.
+
+    Files that already exist are opened in append mode. A file that
+    psrun creates is opened for writing, but not in append mode, so the
+    kernel can splice output straight into it (see ``stream.SPLICE_FDS``)
+    while nothing else writes to it. Outputs that share a file share one
+    file descriptor, which is then switched to append mode, and written
+    to normally. Use ``close_fds()`` to close them.
+
+    Args:
+
+        output
+            Where to write to. The value should be a string:
+            "/dev/null", "stdout", "stderr", or a path like "/dummy/path".
+
+    Returns:
+        A file descriptor.
+
+    """
+    if output == "stdout":
+        hold(output)
+        return sys.stdout.fileno()
+    elif output == "stderr":
+        hold(output)
+        return sys.stderr.fileno()
+    if output in FDS:
+        fd = FDS[output]
+        stream.SPLICE_FDS.discard(fd)
+        flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+        fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_APPEND)
+        hold(output)
+        return fd
+    try:
+        fd = os.open(output, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+    except FileExistsError:
+        fd = os.open(output, os.O_WRONLY | os.O_APPEND)
+    else:
+        stream.SPLICE_FDS.add(fd)
+    FDS[output] = fd
+    hold(output)
+    return fd
+
+
+def close_fd(fd):
+    """Close a file descriptor opened by ``get_fd()``."""
+    stream.SPLICE_FDS.discard(fd)
+    os.close(fd)
+
+
+def close_fds():
+    """Close the file descriptors opened by ``get_fd()``."""
+    while FDS:
+        _, fd = FDS.popitem()
+        close_fd(fd)
+
+
+def get_columnar_log(output):
+    """Get a log that writes records to a file in the columnar format.
+
+    Logs that share a file share its ``columnar.Writer``. Send the log
+    records encoded with ``columnar.encode()``. Use
+    ``close_columnar_logs()`` to write out what they hold.
+
+    Args:
+
+        output
+            A path like "/dummy/path".
+
+    Returns:
+        A function you can send records to.
+
+    """
+    if output not in WRITERS:
+        WRITERS[output] = columnar.Writer(open(output, "ab"))
+    hold(output)
+    return WRITERS[output].write
+
+
+def close_columnar_logs():
+    """Write out the records in all of the columnar logs, and close them."""
+    while WRITERS:
+        _, writer = WRITERS.popitem()
+        writer.close()
+
+
+atexit.register(close_columnar_logs)
+
+
+def close_logger(logger):
+    """Close the handlers of a logger that wrote out a sink."""
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+
+
+def close_loggers():
+    """Close the handlers of all of the loggers that wrote out sinks."""
+    while LOGGERS:
+        _, logger = LOGGERS.popitem()
+        close_logger(logger)
+
+
+def hold(output):
+    """Count a log got for an output, until it is ``release()``-d."""
+    REFS[output] = REFS.get(output, 0) + 1
+
+
+def release(output):
+    """Let go of a log, file descriptor, or columnar log got for an output.
+
+    Once every one got for the output has been let go of, whatever psrun
+    opened for it (its sink and logger, file descriptor, or columnar
+    writer) is written out and closed. It is opened again if another log
+    is got for the output. This lets a long batch close each job's files
+    when the job is done, rather than keeping them all open.
+
+    Args:
+
+        output
+            The output the log was got for, e.g., "/dummy/path".
+
+    """
+    REFS[output] -= 1
+    if REFS[output]:
+        return
+    del REFS[output]
+    if output in SINKS:
+        SINKS.pop(output).close()
+    if output in LOGGERS:
+        close_logger(LOGGERS.pop(output))
+    if output in FDS:
+        close_fd(FDS.pop(output))
+    if output in WRITERS:
+        WRITERS.pop(output).close()
+
+
+def close():
+    """Write out everything sent to the logs, and close them."""
+    close_sinks()
+    close_loggers()
+    close_fds()
+    close_columnar_logs()
+    REFS.clear()
@@ -1,10 +1,59 @@
 """A CLI for the package."""
 
 import argparse
+import asyncio
+import cProfile
+import functools
+import math
+import os
 import sys
 
+from contextlib import contextmanager
+
 from . import log as cli_log
+from ..lib import batch
+from ..lib import cgroup as cgroup_lib
+from ..lib import columnar
+from ..lib import compact
+from ..lib import constants
+from ..lib import exceptions
+from ..lib import history as history_lib
 from ..lib import main
+from ..lib import monitor
+from ..lib import stream
+from ..lib import summary as summary_lib
+
+
+def parse_collectors(spec):
+    """Parse a ``--collectors`` spec, or complain to argparse about it."""
+    try:
+        return monitor.get_collectors(spec)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def parse_positive_int(value):
+    """Parse a count of at least 1, or complain to argparse."""
+    try:
+        count = int(value)
+    except ValueError:
+        count = 0
+    if count < 1:
+        msg = "Must be a whole number above 0: {}".format(value)
+        raise argparse.ArgumentTypeError(msg)
+    return count
+
+
+def parse_positive_float(value):
+    """Parse a number of seconds above 0, or complain to argparse."""
+    try:
+        secs = float(value)
+    except ValueError:
+        secs = 0
+    if not (math.isfinite(secs) and secs > 0):
+        msg = "Must be a number above 0: {}".format(value)
+        raise argparse.ArgumentTypeError(msg)
+    return secs
 
 
 def parse_args(args):
@@ -13,15 +62,48 @@ def parse_args(args):
     parser = argparse.ArgumentParser(description=desc)
 
     cmd_help = "A cmd, e.g., (ls -la). NB: no shell expansion."
-    parser.add_argument("CMD", help=cmd_help)
+    parser.add_argument("CMD", nargs="?", help=cmd_help)
+
+    batch_help = "Run the cmds in a FILE (- for stdin) instead of CMD. " + \
+                 "One cmd per line, or JSON objects with a cmd and " + \
+                 "any of: " + ", ".join(batch.JOB_KEYS[1:]) + ". " + \
+                 "Log paths can include {name}."
+    parser.add_argument("--batch", metavar="FILE", help=batch_help)
+
+    concurrency_help = "Max num of batch cmds to run at once. " + \
+                       "Default: num CPUs."
+    parser.add_argument(
+        "--concurrency", type=parse_positive_int, help=concurrency_help,
+        default=os.cpu_count() or 1)
 
     timeout_help = "Num seconds before SIGTERM. Default: None"
     parser.add_argument(
-        "--timeout", type=int, help=timeout_help, default=None)
+        "--timeout", type=float, help=timeout_help, default=None)
 
     shutdown_help = "Num seconds from SIGTERM to SIGKILL. Default: 30"
     parser.add_argument(
-        "--shutdown", type=int, help=shutdown_help, default=30)
+        "--shutdown", type=float, help=shutdown_help, default=30)
+
+    cpu_timeout_help = "Stop CMD (SIGTERM, then SIGKILL after " + \
+                       "--shutdown) once its process tree has used " + \
+                       "more than SECS of CPU time. Default: None"
+    parser.add_argument(
+        "--cpu-timeout", metavar="SECS", type=parse_positive_float,
+        help=cpu_timeout_help, default=None)
+
+    idle_timeout_help = "Stop CMD if its process tree uses no CPU, " + \
+                        "writes nothing, and has no output for SECS. " + \
+                        "Default: None"
+    parser.add_argument(
+        "--idle-timeout", metavar="SECS", type=parse_positive_float,
+        help=idle_timeout_help, default=None)
+
+    max_rss_help = "Stop CMD (SIGTERM, then SIGKILL after --shutdown) " + \
+                   "if its process tree uses more than BYTES of RSS " + \
+                   "in any sample. Default: None"
+    parser.add_argument(
+        "--max-rss", metavar="BYTES", type=parse_positive_int,
+        help=max_rss_help, default=None)
 
     runner_log_help = "Where to send running info. Default: stdout. " + \
                       "Can also be stderr, /path/to/file.log, or /dev/null."
@@ -53,6 +135,108 @@ def parse_args(args):
         "--ps-log-max-files", type=int,
         help=ps_max_files_help, default=None)
 
+    ps_format_help = "Format of process info. Default: json. " + \
+                     "Can also be compact (see psrun.lib.compact), " + \
+                     "or columnar (binary, to a file, with no " + \
+                     "rotation; see psrun.lib.columnar)."
+    parser.add_argument(
+        "--ps-log-format", choices=["json", "compact", "columnar"],
+        help=ps_format_help, default="json")
+
+    ps_summary_help = "Write a summary of the process info (min, max, " + \
+                      "mean, p50, p95, p99 of each stat) to the ps log " + \
+                      "when CMD is done. Default: none. Can also be " + \
+                      "append (after the samples), or only (instead of them)."
+    parser.add_argument(
+        "--ps-summary", choices=["none", "append", "only"],
+        help=ps_summary_help, default="none")
+
+    ps_summary_interval_help = "With --ps-summary, also write a summary " + \
+                               "every SECS. Default: None"
+    parser.add_argument(
+        "--ps-summary-interval", metavar="SECS", type=parse_positive_float,
+        help=ps_summary_interval_help, default=None)
+
+    ps_history_help = "Keep the last N samples of process info in " + \
+                      "memory, and write them to the ps log as one " + \
+                      "record of columns when CMD is done or times " + \
+                      "out. Default: None (off)."
+    parser.add_argument(
+        "--ps-history", metavar="N", type=parse_positive_int,
+        help=ps_history_help, default=None)
+
+    sample_interval_help = "Num seconds between samples of process " + \
+                           "info. Default: {}".format(
+                               constants.SAMPLE_INTERVAL)
+    parser.add_argument(
+        "--sample-interval", type=parse_positive_float,
+        help=sample_interval_help,
+        default=constants.SAMPLE_INTERVAL)
+
+    max_sample_interval_help = "Sample less and less often while " + \
+                               "CMD's RSS and CPU%% are steady, up to " + \
+                               "every SECS, and every --sample-interval " + \
+                               "again when they change. Default: None " + \
+                               "(always every --sample-interval)."
+    parser.add_argument(
+        "--max-sample-interval", metavar="SECS", type=parse_positive_float,
+        help=max_sample_interval_help, default=None)
+
+    collectors_help = "System stats to collect. Comma separated: NAME " + \
+                      "to add, NAME=SECS to collect every SECS, -NAME " + \
+                      "to skip. Choose from: " + \
+                      ", ".join(monitor.COLLECTORS.keys())
+    parser.add_argument(
+        "--collectors", type=parse_collectors,
+        help=collectors_help, default=None)
+
+    collector_backend_help = "How to collect system stats: with psutil, " + \
+                             "or by reading /proc and /sys directly " + \
+                             "(procfs, Linux only). Default: auto " + \
+                             "(procfs where supported)."
+    parser.add_argument(
+        "--collector-backend", choices=monitor.BACKENDS,
+        help=collector_backend_help, default="auto")
+
+    cgroup_help = "Start CMD in a cgroup v2 of its own, and report " + \
+                  "its CPU, memory, I/O and pids stats, for the whole " + \
+                  "process tree. Exits if the host does not allow it."
+    parser.add_argument(
+        "--cgroup", action="store_true", help=cgroup_help)
+
+    cgroup_cpus_help = "Limit CMD's cgroup to CPUS CPUs (e.g., 1.5). " + \
+                       "Implies --cgroup. Default: None"
+    parser.add_argument(
+        "--cgroup-cpus", metavar="CPUS", type=float,
+        help=cgroup_cpus_help, default=None)
+
+    cgroup_memory_max_help = "Limit CMD's cgroup to BYTES of memory. " + \
+                             "Implies --cgroup. Default: None"
+    parser.add_argument(
+        "--cgroup-memory-max", metavar="BYTES", type=int,
+        help=cgroup_memory_max_help, default=None)
+
+    output_mode_help = "How to forward CMD's stdout and stderr. " + \
+                       "Default: line (line by line, through a logger). " + \
+                       "Can also be raw (as raw bytes, with no rotation), " + \
+                       "or direct (CMD writes to the log itself, falling " + \
+                       "back to line when rotating)."
+    parser.add_argument(
+        "--output-mode", choices=["line", "raw", "direct"],
+        help=output_mode_help, default="line")
+
+    buffer_size_help = "Max lines of CMD's stdout/stderr to hold in " + \
+                       "memory (per stream). Default: 0 (no limit)."
+    parser.add_argument(
+        "--buffer-size", type=int, help=buffer_size_help, default=0)
+
+    buffer_policy_help = "What to do when a buffer is full. Default: " + \
+                         "block (make CMD wait). Can also be " + \
+                         "drop-oldest or drop-newest."
+    parser.add_argument(
+        "--buffer-policy", choices=stream.POLICIES,
+        help=buffer_policy_help, default=stream.BLOCK)
+
     stdout_log_help = "Where to send CMD's stdout. Default: /dev/null. " + \
                       "Can also be stdout, stderr, or /path/to/file.log."
     parser.add_argument(
@@ -83,50 +267,386 @@ def parse_args(args):
         "--stderr-log-max-files", type=int,
         help=stderr_max_files_help, default=None)
 
-    return parser.parse_args(args)
+    profile_help = "Profile psrun itself (its main thread), and save " + \
+                   "the stats to FILE, for pstats. Default: None"
+    parser.add_argument(
+        "--profile", metavar="FILE", help=profile_help, default=None)
+
+    result = parser.parse_args(args)
+    if (result.CMD is None) == (result.batch is None):
+        parser.error("Give a CMD, or --batch, but not both.")
+    buffered = result.buffer_size or result.buffer_policy != stream.BLOCK
+    if result.batch is not None and buffered:
+        parser.error(
+            "--buffer-size and --buffer-policy do not apply to --batch.")
+    max_sample_interval = result.max_sample_interval
+    if max_sample_interval and max_sample_interval < result.sample_interval:
+        parser.error("--max-sample-interval is below --sample-interval.")
+    return result
+
+
+def or_exit(func, *args):
+    """Call a func to get a log. Exit with a message if that fails."""
+    try:
+        return func(*args)
+    except (OSError, ValueError) as e:
+        sys.exit(str(e))
 
 
 def get_log_or_exit(name, output, max_bytes, max_files):
     """Try to get a logger. Exit with a message if that fails."""
+    return or_exit(cli_log.get_log, name, output, max_bytes, max_files)
+
+
+def get_raw_fd(output, max_bytes, max_files):
+    """Get a file descriptor for raw output.
+
+    Raises:
+
+        ValueError
+            If the output is meant to rotate.
+
+        OSError
+            If the output cannot be opened.
+
+    """
+    if max_bytes or max_files:
+        raise ValueError(
+            "Log rotation is not supported with --output-mode raw.")
+    return cli_log.get_fd(output)
+
+
+def get_fd_or_exit(output, max_bytes, max_files):
+    """Try to get a file descriptor. Exit with a message if that fails."""
+    return or_exit(get_raw_fd, output, max_bytes, max_files)
+
+
+def get_ps_log(fmt, name, output, max_bytes, max_files):
+    """Get somewhere to send process info in the given format.
+
+    Raises:
+
+        ValueError
+            If the format cannot be sent to the output.
+
+        OSError
+            If the output cannot be opened.
+
+    """
+    if fmt != "columnar":
+        return cli_log.get_log(name, output, max_bytes, max_files)
+    if output in ["stdout", "stderr"]:
+        raise ValueError("--ps-log-format columnar needs a --ps-log file.")
+    if max_bytes or max_files:
+        raise ValueError(
+            "Log rotation is not supported with --ps-log-format columnar.")
+    return cli_log.get_columnar_log(output)
+
+
+def get_ps_log_or_exit(fmt, name, output, max_bytes, max_files):
+    """Get somewhere to send process info in the given format, or exit."""
+    return or_exit(get_ps_log, fmt, name, output, max_bytes, max_files)
+
+
+def get_ps_encoder(fmt):
+    """Get a function to encode process info in the given format."""
+    if fmt == "compact":
+        return compact.get_encoder()
+    elif fmt == "columnar":
+        return columnar.encode
+    return None
+
+
+def get_output(mode, name, output, max_bytes, max_files):
+    """Get somewhere to send a CMD's output in the given mode.
+
+    Raises:
+
+        ValueError
+            If the mode cannot be sent to the output.
+
+        OSError
+            If the output cannot be opened.
+
+    """
+    if mode == "raw":
+        return get_raw_fd(output, max_bytes, max_files)
+    elif mode == "direct" and not (max_bytes or max_files):
+        return stream.Redirect(cli_log.get_fd(output))
+    return cli_log.get_log(name, output, max_bytes, max_files)
+
+
+def get_output_or_exit(mode, name, output, max_bytes, max_files):
+    """Get somewhere to send a CMD's output in the given mode, or exit."""
+    return or_exit(get_output, mode, name, output, max_bytes, max_files)
+
+
+def get_summary(args, ps_log, ps_encode=None):
+    """Get a summary for the ps log, if the command line asks for one."""
+    if args.ps_summary == "none":
+        return None
+    return summary_lib.Summary(
+        ps_log, ps_encode, args.ps_summary_interval,
+        samples=args.ps_summary == "append")
+
+
+def get_history(args, ps_log, ps_encode=None):
+    """Get a history for the ps log, if the command line asks for one."""
+    if not args.ps_history:
+        return None
+    return history_lib.History(args.ps_history, ps_log, ps_encode)
+
+
+def get_cgroup_limits(args):
+    """Get the ``cpus, memory_max`` to create cgroups with, if any.
+
+    Returns:
+        A tuple of args for ``cgroup.create()``, or ``None`` if the
+        command line does not ask for cgroups.
+
+    """
+    limits = (args.cgroup_cpus, args.cgroup_memory_max)
+    if not args.cgroup and limits == (None, None):
+        return None
+    return limits
+
+
+def get_cgroup_or_exit(args):
+    """Create a cgroup for a command, if the command line asks for one."""
+    limits = get_cgroup_limits(args)
+    if limits is None:
+        return None
     try:
-        log = cli_log.get_log(name, output, max_bytes, max_files)
-    except OSError as e:
+        return cgroup_lib.create(*limits)
+    except exceptions.CgroupUnavailable as e:
         sys.exit(str(e))
-    return log
 
 
-def cli():
-    """Execute/run the CLI."""
-    args = parse_args(sys.argv[1:])
+def label(log, output, name):
+    """Prefix a batch job's messages with its name, if they are shared."""
+    if output not in ["stdout", "stderr"]:
+        return log
+
+    def wrapper(msg):
+        log("[{}] {}".format(name, msg))
+    return wrapper
+
+
+def get_job_params(args, job, num, outputs):
+    """Get the params to run a batch job with, and open its logs.
+
+    Args:
+
+        args
+            The parsed command line arguments, which give the defaults.
+
+        job
+            A job, as returned by ``batch.read_jobs()``.
+
+        num
+            The number of the job in the batch.
+
+        outputs
+            A list to add the outputs of the logs to, as they are opened,
+            so they can be released with ``cli_log.release()``.
+
+    Raises:
+
+        ValueError
+            If a log cannot be sent to its output.
+
+        OSError
+            If an output cannot be opened.
+
+    Returns:
+        A dict of keyword arguments for ``aio.run()``.
+
+    """
+    name = job["name"]
+    params = {}
+    params["cmd"] = job["cmd"]
+    params["timeout"] = job.get("timeout", args.timeout)
+    params["shutdown"] = job.get("shutdown", args.shutdown)
+    params["cpu_timeout"] = job.get("cpu_timeout", args.cpu_timeout)
+    params["idle_timeout"] = job.get("idle_timeout", args.idle_timeout)
+    params["max_rss"] = job.get("max_rss", args.max_rss)
+    params["max_sample_interval"] = args.max_sample_interval
+
+    for key in batch.LOG_KEYS:
+        output = job.get(key, getattr(args, key)).format(name=name)
+        max_bytes = getattr(args, key + "_max_bytes")
+        max_files = getattr(args, key + "_max_files")
+        logger_name = "job-{}.{}".format(num, key)
+        if key in ["stdout_log", "stderr_log"]:
+            log = get_output(
+                args.output_mode, logger_name, output, max_bytes, max_files)
+        elif key == "ps_log":
+            log = get_ps_log(
+                args.ps_log_format, logger_name, output, max_bytes,
+                max_files)
+        else:
+            log = cli_log.get_log(logger_name, output, max_bytes, max_files)
+        outputs.append(output)
+        if callable(log):
+            log = label(log, output, name)
+        params[key] = log
+
+    ps_encode = get_ps_encoder(args.ps_log_format)
+    if ps_encode:
+        params["ps_encode"] = ps_encode
+    params["summary"] = get_summary(
+        args, params["ps_log"], params.get("ps_encode"))
+    params["history"] = get_history(
+        args, params["ps_log"], params.get("ps_encode"))
+    return params
+
 
+@contextmanager
+def open_job(args, job, num):
+    """Open a batch job's logs, and close them when the job is done.
+
+    This is the ``open_job`` for ``batch.run()``. It only opens the logs
+    when the job starts, so a batch keeps only its running jobs' files
+    open, however many jobs it has.
+
+    Args:
+
+        args
+            The parsed command line arguments, which give the defaults.
+
+        job
+            A job, as returned by ``batch.read_jobs()``.
+
+        num
+            The number of the job in the batch.
+
+    Raises:
+
+        ValueError
+            If a log cannot be sent to its output.
+
+        OSError
+            If an output cannot be opened.
+
+    Yields:
+        A dict of keyword arguments for ``aio.run()``. If a log cannot be
+        opened, the logs opened before it are released again, and
+        ``batch.run()`` reports the error.
+
+    """
+    outputs = []
+    try:
+        yield get_job_params(args, job, num, outputs)
+    finally:
+        for output in outputs:
+            cli_log.release(output)
+
+
+def run_batch(args):
+    """Run the batch of cmds named on the command line."""
+    try:
+        if args.batch == "-":
+            jobs = batch.read_jobs(sys.stdin)
+        else:
+            with open(args.batch) as f:
+                jobs = batch.read_jobs(f)
+    except (OSError, ValueError) as e:
+        sys.exit(str(e))
+
+    cgroup_limits = get_cgroup_limits(args)
+    if cgroup_limits is not None:
+        # Each job gets its own cgroup when it starts. Make sure the host
+        # allows them before any job does.
+        get_cgroup_or_exit(args).remove()
+
+    try:
+        asyncio.run(batch.run(
+            jobs, args.concurrency, args.collectors, args.sample_interval,
+            args.collector_backend, cgroup_limits,
+            functools.partial(open_job, args)))
+    except ValueError as e:
+        sys.exit(str(e))
+    finally:
+        cli_log.close()
+
+
+def run_cmd(args):
+    """Run the CMD named on the command line."""
     params = {}
     params["cmd"] = args.CMD
     params["timeout"] = args.timeout
     params["shutdown"] = args.shutdown
+    params["cpu_timeout"] = args.cpu_timeout
+    params["idle_timeout"] = args.idle_timeout
+    params["max_rss"] = args.max_rss
+    params["collectors"] = args.collectors
+    params["sample_interval"] = args.sample_interval
+    params["max_sample_interval"] = args.max_sample_interval
+    params["buffer_size"] = args.buffer_size
+    params["buffer_policy"] = args.buffer_policy
+
+    try:
+        params["sampler"] = monitor.Sampler(
+            args.collectors, backend=args.collector_backend)
+    except ValueError as e:
+        sys.exit(str(e))
 
     runner_log = get_log_or_exit(
         "runner_log", args.runner_log,
         args.runner_log_max_bytes, args.runner_log_max_files)
     params["runner_log"] = runner_log
 
-    ps_log = get_log_or_exit(
-        "ps_log", args.ps_log,
+    ps_log = get_ps_log_or_exit(
+        args.ps_log_format, "ps_log", args.ps_log,
         args.ps_log_max_bytes, args.ps_log_max_files)
     params["ps_log"] = ps_log
 
-    stdout_log = get_log_or_exit(
-        "stdout_log", args.stdout_log,
+    ps_encode = get_ps_encoder(args.ps_log_format)
+    if ps_encode:
+        params["ps_encode"] = ps_encode
+    params["summary"] = get_summary(args, ps_log, params.get("ps_encode"))
+    params["history"] = get_history(args, ps_log, params.get("ps_encode"))
+
+    stdout_log = get_output_or_exit(
+        args.output_mode, "stdout_log", args.stdout_log,
         args.stdout_log_max_bytes, args.stdout_log_max_files)
     params["stdout_log"] = stdout_log
 
-    stderr_log = get_log_or_exit(
-        "stderr_log", args.stderr_log,
+    stderr_log = get_output_or_exit(
+        args.output_mode, "stderr_log", args.stderr_log,
         args.stderr_log_max_bytes, args.stderr_log_max_files)
     params["stderr_log"] = stderr_log
 
+    # Create the cgroup last: nothing after it exits without removing it.
+    params["cgroup"] = get_cgroup_or_exit(args)
+
     try:
         main.run(**params)
     except:  # noqa: E722
         exc_type, exc_val, exc_tb = sys.exc_info()
         msg = "Error - {}: {}".format(exc_type.__name__, exc_val)
         sys.exit(msg)
+    finally:
+        params["sampler"].close()
+        cli_log.close()
+
+
+def run(args):
+    """Run the CMD, or the batch, named on the command line."""
+    if args.batch:
+        return run_batch(args)
+    return run_cmd(args)
+
+
+def cli():
+    """Execute/run the CLI."""
+    args = parse_args(sys.argv[1:])
+
+    if not args.profile:
+        return run(args)
+
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(run, args)
+    finally:
+        profiler.dump_stats(args.profile)
@@ -0,0 +1,108 @@
+"""Sample a process as often as it is worth it.
+
+A process is sampled every ``min_interval`` secs at first. While its
+stats are steady, the interval doubles after each sample, up to
+``max_interval``; as soon as they change quickly (e.g., its RSS jumps,
+or its CPU use swings), it is back to ``min_interval``. So a long,
+steady run is sampled rarely, without missing what happens when
+something changes.
+
+"""
+
+FACTOR = 2
+"""How much longer to wait after each steady sample."""
+
+RSS_CHANGE = 0.1
+"""The change in RSS, as a fraction of the last one, that is not steady."""
+
+CPU_CHANGE = 10.0
+"""The change in CPU use, in percentage points, that is not steady."""
+
+
+def get_metrics(data):
+    """Get the stats that tell if a process is steady.
+
+    Args:
+
+        data
+            A record, as gathered by ``monitor.collect()``, or ``None``.
+
+    Returns:
+        A tuple ``rss, cpu_percent`` for the process tree, or ``None``.
+
+    """
+    if data is None:
+        return None
+    process = data.get("process", {})
+    return process.get("rss", 0), process.get("cpu_percent", 0.0)
+
+
+def is_steady(last, metrics):
+    """Check if a process's stats have not changed much.
+
+    Args:
+
+        last
+            The process's last ``rss, cpu_percent``.
+
+        metrics
+            Its latest ``rss, cpu_percent``.
+
+    Returns:
+        ``True`` if neither has changed by more than ``RSS_CHANGE`` or
+        ``CPU_CHANGE``. ``False`` otherwise.
+
+    """
+    last_rss, last_cpu = last
+    rss, cpu = metrics
+    if abs(rss - last_rss) > RSS_CHANGE * last_rss:
+        return False
+    return abs(cpu - last_cpu) <= CPU_CHANGE
+
+
+class Interval(object):
+    """Chooses how long to wait before sampling a process again.
+
+    Args:
+
+        min_interval
+            The num of secs between samples at first, and whenever the
+            process's stats change quickly.
+
+        max_interval
+            The most secs to wait between samples while the process is
+            steady. Default: ``min_interval`` (a fixed interval).
+
+    """
+
+    def __init__(self, min_interval, max_interval=None):
+        """Initialize the interval."""
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval or 0, min_interval)
+        self.current = min_interval
+        self.last = None
+
+    def next(self, data):
+        """Get the num of secs to wait before the next sample.
+
+        Args:
+
+            data
+                The latest record, as gathered by ``monitor.collect()``,
+                or ``None`` if it could not be gathered.
+
+        Returns:
+            The num of secs.
+
+        """
+        if self.max_interval == self.min_interval:
+            return self.current
+        metrics = get_metrics(data)
+        if metrics is None:
+            return self.current
+        if self.last is None or not is_steady(self.last, metrics):
+            self.current = self.min_interval
+        else:
+            self.current = min(self.current * FACTOR, self.max_interval)
+        self.last = metrics
+        return self.current
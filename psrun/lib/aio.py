@@ -0,0 +1,660 @@
+"""An asyncio version of the runner.
+
+This mirrors ``main.run()`` and ``proc.execute()``, but runs in an event
+loop instead of blocking, so it can be embedded in asyncio programs
+without a thread per command. The process's output is read by the event
+loop as it arrives, so no reader threads or buffers are needed: when
+the logs are slow, the process waits on its pipes.
+
+The process is started with ``proc.start()``, and reaped with
+``proc.reap()`` (rather than by asyncio), so the kernel reports what it
+used, as for ``proc.execute()``. Like there, a process is done when it
+exits: what is left in its pipes is read for at most
+``constants.EOF_TIMEOUT`` secs, in case children it left behind hold
+them open.
+
+"""
+
+import asyncio
+import os
+import time
+
+from . import adaptive
+from . import constants
+from . import exceptions
+from . import limits
+from . import main
+from . import monitor
+from . import overhead as overhead_lib
+from . import proc
+from . import stream
+
+
+async def connect(pipe):
+    """Read a pipe with the event loop.
+
+    Args:
+
+        pipe
+            A pipe to read, e.g., a ``subprocess.Popen``'s ``stdout``.
+
+    Returns:
+        A tuple ``reader, transport``, where ``reader`` is an
+        ``asyncio.StreamReader`` for the pipe, and ``transport`` closes
+        the pipe when closed.
+
+    """
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    transport, _ = await loop.connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader), pipe)
+    return reader, transport
+
+
+async def wait_readable(fd):
+    """Wait for a file descriptor to become readable.
+
+    Args:
+
+        fd
+            The file descriptor, e.g., a pidfd.
+
+    """
+    loop = asyncio.get_running_loop()
+    readable = loop.create_future()
+
+    def on_readable():
+        loop.remove_reader(fd)
+        readable.set_result(None)
+
+    loop.add_reader(fd, on_readable)
+    try:
+        await readable
+    finally:
+        loop.remove_reader(fd)
+
+
+async def reap(p):
+    """Wait for a process to exit, and reap it.
+
+    The event loop is woken up the instant the process exits if the
+    platform supports pidfds. Otherwise, the process is polled every
+    ``constants.POLL_DELAY`` secs.
+
+    Args:
+
+        p
+            A ``subprocess.Popen`` instance.
+
+    Returns:
+        The process's resource usage, as returned by ``proc.reap()``.
+
+    """
+    if p.returncode is not None:
+        return None
+    exit_fd = proc.open_exit_fd(p)
+    if exit_fd is not None:
+        try:
+            await wait_readable(exit_fd)
+        finally:
+            os.close(exit_fd)
+    rusage = proc.reap(p)
+    while p.returncode is None:
+        await asyncio.sleep(constants.POLL_DELAY)
+        rusage = proc.reap(p)
+    return rusage
+
+
+async def read_line(reader):
+    """Read a line from a stream, or as much of one as the stream allows.
+
+    Lines longer than the stream's limit are returned in pieces.
+
+    Args:
+
+        reader
+            An ``asyncio.StreamReader``.
+
+    Returns:
+        The line, or ``b""`` at the end of the stream.
+
+    """
+    try:
+        return await reader.readuntil(b"\n")
+    except asyncio.IncompleteReadError as e:
+        return e.partial
+    except asyncio.LimitOverrunError as e:
+        return await reader.readexactly(e.consumed)
+
+
+async def read_lines(reader, log, name, overhead):
+    """Read lines from a stream, and pass each one to a ``log()``.
+
+    Args:
+
+        reader
+            An ``asyncio.StreamReader``.
+
+        log
+            A callable we can send each line to.
+
+        name
+            The name of the stream, e.g., "stdout".
+
+        overhead
+            An ``overhead.Overhead`` to count the lines with.
+
+    """
+    while True:
+        line = await read_line(reader)
+        if not line:
+            break
+        log(line.decode("utf8", errors="replace").rstrip())
+        overhead.count(name, 1, len(line))
+
+
+async def copy_chunks(reader, fd):
+    """Copy raw bytes from a stream to a file descriptor.
+
+    Args:
+
+        reader
+            An ``asyncio.StreamReader``.
+
+        fd
+            A file descriptor to write to. If writing fails, the rest
+            of the stream is read and discarded.
+
+    """
+    while True:
+        chunk = await reader.read(constants.CHUNK_SIZE)
+        if not chunk:
+            break
+        if fd is not None:
+            try:
+                stream.write_all(fd, chunk)
+            except OSError:
+                fd = None
+
+
+def forward(reader, dest, name, overhead):
+    """Get a coroutine that forwards a stream to its destination.
+
+    Args:
+
+        reader
+            An ``asyncio.StreamReader``.
+
+        dest
+            A callable for each line, or a file descriptor to copy raw
+            bytes to.
+
+        name
+            The name of the stream, e.g., "stdout".
+
+        overhead
+            An ``overhead.Overhead`` to count the lines with (in line
+            mode).
+
+    Returns:
+        A coroutine.
+
+    """
+    if isinstance(dest, int):
+        return copy_chunks(reader, dest)
+    return read_lines(reader, dest, name, overhead)
+
+
+async def sample(
+        log, pid, procs, encode, sampler, interval, summary=None,
+        history=None, cgroup=None, max_rss=None, cmd=None, watchdog=None,
+        overhead=None, peaks=None):
+    """Monitor a process every ``interval`` secs, until cancelled.
+
+    Args:
+
+        log
+            A callable we can send info to.
+
+        pid
+            The pid of a process to monitor.
+
+        procs
+            A dict the monitor can cache process objects in.
+
+        encode
+            A callable the monitor can serialize stats with, or ``None``.
+
+        sampler
+            A ``monitor.Sampler`` to collect system stats with.
+
+        interval
+            An ``adaptive.Interval``, to choose the number of seconds
+            between samples with.
+
+        summary
+            A ``summary.Summary`` to add the stats to, or ``None``.
+
+        history
+            A ``history.History`` to add the stats to, or ``None``.
+
+        cgroup
+            A ``cgroup.Cgroup`` the process was started in, or ``None``.
+
+        max_rss
+            The max number of bytes of RSS the process tree can use, or
+            ``None``.
+
+        cmd
+            The command executed in the process, e.g., 'ls -la'.
+
+        watchdog
+            A ``limits.Watchdog`` to check the stats with, or ``None``.
+
+        overhead
+            An ``overhead.Overhead`` to time the sampling with, and to
+            count the lines forwarded so far in.
+
+        peaks
+            A dict to keep the max RSS of the process tree in any sample
+            in, under "rss".
+
+    Raises:
+
+        exceptions.ProcMaxRss
+            If the process tree uses more than ``max_rss``.
+
+        exceptions.ProcTimeout
+            If the ``watchdog`` finds the process tree is stuck, or too
+            busy.
+
+    """
+    if overhead is None:
+        overhead = overhead_lib.Overhead()
+    if peaks is None:
+        peaks = {}
+    while True:
+        with overhead.timer("Sampling"):
+            data = proc.try_monitor(
+                log, pid, procs, encode, sampler, summary, history, cgroup)
+        rss = proc.get_rss(data)
+        peaks["rss"] = max(peaks.get("rss", 0), rss or 0)
+        proc.check_rss(rss, max_rss, cmd)
+        output = sum(overhead.lines.values())
+        reason = None if watchdog is None else watchdog.check(data, output)
+        if reason is not None:
+            msg = "{}: {}".format(reason, proc.format_cmd(cmd))
+            raise exceptions.ProcTimeout(msg)
+        await asyncio.sleep(interval.next(data))
+
+
+def get_timeout(secs):
+    """Check a num of secs to wait for, before anything waits for it.
+
+    Args:
+
+        secs
+            The number of seconds, or ``None`` (or 0) to wait as long as
+            it takes.
+
+    Raises:
+
+        ValueError
+            If ``secs`` is not a number.
+
+    Returns:
+        The number of seconds, or ``None``.
+
+    """
+    if not secs:
+        return None
+    if isinstance(secs, bool) or not isinstance(secs, (int, float)):
+        raise ValueError("Bad timeout: {}".format(secs))
+    return secs
+
+
+async def stop(p, shutdown):
+    """Stop a process: terminate it, and kill it if it takes too long.
+
+    Args:
+
+        p
+            A ``subprocess.Popen`` instance.
+
+        shutdown
+            The number of seconds to let the process shutdown, or ``None``
+            to wait as long as it takes.
+
+    Returns:
+        The exit code.
+
+    """
+    shutdown = get_timeout(shutdown)
+    p.terminate()
+    try:
+        await asyncio.wait_for(reap(p), shutdown)
+    except asyncio.TimeoutError:
+        p.kill()
+        await reap(p)
+    return p.returncode
+
+
+async def wait(p, timeout, shutdown, cmd):
+    """Wait for a process to exit, and stop it if it times out.
+
+    Args:
+
+        p
+            A ``subprocess.Popen`` instance.
+
+        timeout
+            The number of seconds to timeout, or ``None``.
+
+        shutdown
+            The number of seconds to let a process shutdown.
+
+        cmd
+            The command executed in the process, e.g., 'ls -la'.
+
+    Raises:
+
+        exceptions.ProcTimeout
+            If the process times out.
+
+        ValueError
+            If ``timeout`` is not a number.
+
+    Returns:
+        The process's resource usage, as returned by ``proc.reap()``. The
+        exit code is in ``p.returncode``.
+
+    """
+    secs = get_timeout(timeout)
+    try:
+        return await asyncio.wait_for(reap(p), secs)
+    except asyncio.TimeoutError:
+        await stop(p, shutdown)
+        msg = "Timed out after {} secs: {}".format(
+            timeout, proc.format_cmd(cmd))
+        raise exceptions.ProcTimeout(msg)
+
+
+async def cancel(task):
+    """Cancel a task, wait for it to finish, and drop its exception."""
+    task.cancel()
+    await asyncio.wait([task])
+    try:
+        task.exception()
+    except asyncio.CancelledError:
+        pass
+
+
+async def execute(
+        cmd, out, err, ps, timeout, shutdown, ps_encode=None,
+        collectors=None, sample_interval=None, sampler=None, summary=None,
+        history=None, cgroup=None, max_sample_interval=None,
+        max_rss=None, cpu_timeout=None, idle_timeout=None):
+    """Execute a command.
+
+    Args:
+
+        cmd
+            A command to execute in the process, e.g., 'ls -la'.
+
+        out
+            A callable we can pass each line of stdout to, a file
+            descriptor to copy stdout to as raw bytes, or a
+            ``stream.Redirect`` for the process to write stdout to itself.
+
+        err
+            A callable we can pass each line of stderr to, a file
+            descriptor to copy stderr to as raw bytes, or a
+            ``stream.Redirect`` for the process to write stderr to itself.
+
+        ps
+            A callable we can pass stats about the proc to.
+
+        timeout
+            The number of seconds to timeout, or ``None``.
+
+        shutdown
+            The number of seconds to let a process shutdown.
+
+        ps_encode
+            A callable to serialize stats about the proc with, or ``None``
+            for ``monitor.serialize()``.
+
+        collectors
+            The system stats to collect, as returned by
+            ``monitor.get_collectors()``, or ``None`` for the defaults.
+
+        sample_interval
+            The number of seconds between samples of stats about the proc,
+            or ``None`` for ``constants.SAMPLE_INTERVAL``.
+
+        sampler
+            A ``monitor.Sampler`` to collect system stats with, e.g., one
+            shared with other runs. Default: a new one, for ``collectors``.
+
+        summary
+            A ``summary.Summary`` to add the stats about the proc to, or
+            ``None``.
+
+        history
+            A ``history.History`` to add the stats about the proc to, or
+            ``None``.
+
+        cgroup
+            A ``cgroup.Cgroup`` to start the process in, and collect stats
+            about the whole process tree from, or ``None``.
+
+        max_sample_interval
+            The most secs to wait between samples while the proc's stats
+            are steady (see ``adaptive.Interval``), or ``None`` to always
+            wait ``sample_interval``. It is capped while there are limits
+            to check (see ``proc.get_max_sample_interval()``).
+
+        max_rss
+            The max number of bytes of RSS the process tree can use, as
+            of any sample, or ``None``.
+
+        cpu_timeout
+            The number of CPU seconds the process tree can use, or
+            ``None``. See ``limits``.
+
+        idle_timeout
+            The number of seconds the process tree can go without using
+            CPU or writing anything, or ``None``. See ``limits``.
+
+    Raises:
+
+        exceptions.ProcTimeout
+            If the process times out, uses more than ``cpu_timeout``, or
+            is idle for more than ``idle_timeout``.
+
+        exceptions.ProcMaxRss
+            If the process tree uses more than ``max_rss``.
+
+        exceptions.CgroupUnavailable
+            If the process could not move into ``cgroup``.
+
+        ValueError
+            If ``timeout`` or ``shutdown`` is not a number.
+
+    Returns:
+        A tuple ``exit_code, running_time, details``, as for
+        ``proc.execute()``, except that the details leave out psrun's
+        CPU time.
+
+    """
+    timeout = get_timeout(timeout)
+    shutdown = get_timeout(shutdown)
+    if sampler is None:
+        sampler = monitor.Sampler(collectors)
+    if sample_interval is None:
+        sample_interval = constants.SAMPLE_INTERVAL
+    max_sample_interval = proc.get_max_sample_interval(
+        sample_interval, max_sample_interval, max_rss, cpu_timeout,
+        idle_timeout)
+    interval = adaptive.Interval(sample_interval, max_sample_interval)
+    start_time = proc.start_timing()
+    # Other jobs may run in this process too, so psrun's CPU time is not
+    # this job's alone.
+    overhead = overhead_lib.Overhead(cpu_time=False)
+
+    p = proc.start(cmd, proc.get_target(out), proc.get_target(err), cgroup)
+    limits.set_cpu_limit(
+        p.pid, cpu_timeout, shutdown, max_sample_interval or sample_interval)
+    watchdog = limits.Watchdog(cpu_timeout, idle_timeout, time.monotonic())
+    procs = {}
+    peaks = {"rss": 0}
+    transports = []
+    forwarders = []
+    streams = [("stdout", p.stdout, out), ("stderr", p.stderr, err)]
+    for name, pipe, dest in streams:
+        if pipe is not None:
+            reader, transport = await connect(pipe)
+            transports.append(transport)
+            forwarders.append(forward(reader, dest, name, overhead))
+    readers = asyncio.gather(*forwarders)
+    sampling = asyncio.ensure_future(
+        sample(
+            ps, p.pid, procs, ps_encode, sampler, interval, summary,
+            history, cgroup, max_rss, cmd, watchdog, overhead, peaks))
+    waiting = asyncio.ensure_future(wait(p, timeout, shutdown, cmd))
+
+    try:
+        await asyncio.wait(
+            [waiting, sampling], return_when=asyncio.FIRST_COMPLETED)
+        if sampling.done():
+            await cancel(waiting)
+            await stop(p, shutdown)
+            sampling.result()
+        rusage = waiting.result()
+        try:
+            await asyncio.wait_for(readers, constants.EOF_TIMEOUT)
+        except asyncio.TimeoutError:
+            pass
+    finally:
+        await cancel(waiting)
+        await cancel(sampling)
+        await cancel(readers)
+        for transport in transports:
+            transport.close()
+
+    with overhead.timer("Sampling"):
+        proc.try_monitor(
+            ps, p.pid, procs, ps_encode, sampler, summary, history, cgroup)
+    running_time = proc.stop_timing(start_time)
+    if cgroup is not None:
+        cgroup.check_joined(p.returncode)
+    details = proc.get_details([], overhead, rusage)
+    details["Max sampled RSS"] = "{} KiB".format(peaks["rss"] // 1024)
+    details.update(proc.get_cgroup_details(cgroup))
+    return p.returncode, running_time, details
+
+
+async def run(
+        cmd, timeout, shutdown, runner_log, ps_log, stdout_log, stderr_log,
+        ps_encode=None, collectors=None, sample_interval=None,
+        sampler=None, summary=None, history=None, cgroup=None,
+        max_sample_interval=None, max_rss=None, cpu_timeout=None,
+        idle_timeout=None):
+    """Execute a command, and report on it, like ``main.run()``.
+
+    Args:
+
+        cmd
+            A command to execute, e.g., 'ls -la'.
+
+        timeout
+            The number of seconds to timeout, or ``None``.
+
+        shutdown
+            The number of seconds to let a process shutdown.
+
+        runner_log
+            A callable we can send messages from the runner to.
+
+        ps_log
+            A callable we can send info about the process to.
+
+        stdout_log
+            A callable we can send lines from stdout to, a file
+            descriptor to copy stdout to as raw bytes, or a
+            ``stream.Redirect`` for the process to write stdout to itself.
+
+        stderr_log
+            A callable we can send lines from stderr to, a file
+            descriptor to copy stderr to as raw bytes, or a
+            ``stream.Redirect`` for the process to write stderr to itself.
+
+        ps_encode
+            A callable to serialize info about the process with.
+
+        collectors
+            The system stats to collect. Default: the default collectors.
+
+        sample_interval
+            The number of seconds between samples of info about the
+            process. Default: ``constants.SAMPLE_INTERVAL``.
+
+        sampler
+            A ``monitor.Sampler`` to collect system stats with.
+            Default: a new one, for ``collectors``.
+
+        summary
+            A ``summary.Summary`` to add info about the process to. It is
+            written out when the process is done. Default: None.
+
+        history
+            A ``history.History`` to add info about the process to. It is
+            written out (if it has a log) when the process is done.
+            Default: None.
+
+        cgroup
+            A ``cgroup.Cgroup`` to start the process in, and collect stats
+            about the whole process tree from. It is removed when the
+            process is done. Default: None.
+
+        max_sample_interval
+            The most secs to wait between samples while the process is
+            steady (see ``adaptive.Interval``). Default: None (always
+            wait ``sample_interval``).
+
+        max_rss
+            The max number of bytes of RSS the process tree can use. It
+            is stopped if it uses more. Default: None (no limit).
+
+        cpu_timeout
+            The number of CPU seconds the process tree can use. It is
+            stopped if it uses more. Default: None (no limit).
+
+        idle_timeout
+            The number of seconds the process tree can go without using
+            CPU or writing anything. It is stopped if it is idle for
+            longer. Default: None (no limit).
+
+    """
+    errs = (
+        exceptions.ProcTimeout, exceptions.ProcMaxRss,
+        exceptions.PermissionDenied, exceptions.CgroupUnavailable)
+    main.report_start_details(runner_log, cmd)
+    try:
+        exit_code, running_time, details = await execute(
+            cmd, stdout_log, stderr_log, ps_log, timeout, shutdown,
+            ps_encode, collectors, sample_interval, sampler, summary,
+            history, cgroup, max_sample_interval, max_rss, cpu_timeout,
+            idle_timeout)
+    except errs as error:
+        main.report_error(runner_log, error)
+    else:
+        main.report_final_details(
+            runner_log, exit_code, running_time, details)
+    finally:
+        if summary is not None:
+            summary.write()
+        if history is not None:
+            history.write()
+        if cgroup is not None:
+            cgroup.remove()
@@ -0,0 +1,257 @@
+"""Run a batch of commands concurrently.
+
+A batch is a list of jobs, read from lines of text. Each line is either
+a plain command, or a JSON object with a ``cmd`` and any of the other
+``JOB_KEYS``, e.g.:
+
+    ls -la
+    {"cmd": "make test", "timeout": 600, "stdout_log": "/tmp/test.log"}
+
+Blank lines, and lines that start with ``#``, are skipped.
+
+"""
+
+import asyncio
+import json
+import math
+import sys
+
+from contextlib import nullcontext
+
+from . import aio
+from . import cgroup as cgroup_lib
+from . import constants
+from . import main
+from . import monitor
+
+LOG_KEYS = ["runner_log", "ps_log", "stdout_log", "stderr_log"]
+"""The keys of a job that say where to send its logs."""
+
+JOB_KEYS = [
+    "cmd", "name", "timeout", "shutdown", "cpu_timeout", "idle_timeout",
+    "max_rss"] + LOG_KEYS
+"""The keys a job can have."""
+
+LIMIT_KEYS = [
+    "timeout", "shutdown", "cpu_timeout", "idle_timeout", "max_rss"]
+"""The keys of a job that have to be numbers above 0, if they are set."""
+
+COUNT_KEYS = ["max_rss"]
+"""The ``LIMIT_KEYS`` that also have to be whole numbers."""
+
+
+def is_positive(value, whole=False):
+    """Check that a value from a job is a finite (whole) number above 0."""
+    types = int if whole else (int, float)
+    if isinstance(value, bool) or not isinstance(value, types):
+        return False
+    return math.isfinite(value) and value > 0
+
+
+def is_log_target(value):
+    """Check that a log target from a job has no placeholder but name."""
+    if not isinstance(value, str):
+        return False
+    try:
+        value.format(name="1")
+    except (AttributeError, IndexError, KeyError, ValueError):
+        return False
+    return True
+
+
+def read_job(line, num):
+    """Read a job from a line of text.
+
+    Args:
+
+        line
+            The line, e.g., 'ls -la' or '{"cmd": "ls -la", "timeout": 5}'.
+
+        num
+            The number of the line (for error messages).
+
+    Raises:
+
+        ValueError
+            If the line is not a valid job.
+
+    Returns:
+        The job, as a dict.
+
+    """
+    if not line.startswith("{"):
+        return {"cmd": line}
+    try:
+        job = json.loads(line)
+    except ValueError as e:
+        raise ValueError("Line {}: Bad JSON: {}".format(num, e))
+    if not isinstance(job, dict) or not job.get("cmd"):
+        raise ValueError("Line {}: No cmd.".format(num))
+    unknown = sorted(set(job.keys()) - set(JOB_KEYS))
+    if unknown:
+        msg = "Line {}: Unknown keys: {}".format(num, ", ".join(unknown))
+        raise ValueError(msg)
+    for key in LIMIT_KEYS:
+        value = job.get(key)
+        whole = key in COUNT_KEYS
+        if value is not None and not is_positive(value, whole):
+            kind = "a whole number" if whole else "a number"
+            msg = "Line {}: {} must be {} above 0: {}".format(
+                num, key, kind, value)
+            raise ValueError(msg)
+    for key in LOG_KEYS:
+        value = job.get(key)
+        if value is not None and not is_log_target(value):
+            msg = "Line {}: {} must be a string, with no placeholder " + \
+                  "but {{name}}: {}"
+            raise ValueError(msg.format(num, key, value))
+    return job
+
+
+def read_jobs(lines):
+    """Read jobs from lines of text.
+
+    Each job is given a ``name`` (its number in the batch, from 1), unless
+    it has one already.
+
+    Args:
+
+        lines
+            An iterable of lines, e.g., an open file.
+
+    Raises:
+
+        ValueError
+            If a line is not a valid job.
+
+    Returns:
+        A list of jobs, as dicts.
+
+    """
+    jobs = []
+    for num, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        job = read_job(line, num)
+        job.setdefault("name", str(len(jobs) + 1))
+        jobs.append(job)
+    return jobs
+
+
+def open_params(job, num):
+    """Open a job that is already a dict of keyword args for ``aio.run()``.
+
+    This is the default ``open_job`` for ``run()``.
+
+    """
+    return nullcontext(job)
+
+
+async def run_job(semaphore, job, num, open_job, shared, cgroup_limits=None):
+    """Run a job once the semaphore lets us.
+
+    Errors are reported to the job's runner log, so that one failed job
+    does not stop the others. If the job cannot be opened, there is no
+    runner log yet, so the error is sent to stderr.
+
+    Args:
+
+        semaphore
+            An ``asyncio.Semaphore`` that limits how many jobs run at once.
+
+        job
+            The job, as given to ``run()``.
+
+        num
+            The number of the job in the batch, from 1.
+
+        open_job
+            A callable to open the job with, as for ``run()``. The job is
+            only opened once it starts, and closed once it is done.
+
+        shared
+            A dict of keyword arguments for ``aio.run()`` that all of the
+            jobs share, e.g., the ``sampler``.
+
+        cgroup_limits
+            A tuple ``cpus, memory_max`` to create a cgroup for the job
+            with (see ``cgroup.create()``), or ``None``. The cgroup is
+            only created when the job starts, and ``aio.run()`` removes
+            it when the job is done.
+
+    """
+    async with semaphore:
+        try:
+            with open_job(job, num) as params:
+                params = dict(params, **shared)
+                try:
+                    if cgroup_limits is not None:
+                        params["cgroup"] = cgroup_lib.create(*cgroup_limits)
+                    await aio.run(**params)
+                except Exception as error:
+                    main.report_error(params["runner_log"], error)
+        except Exception as error:
+            msg = "[{}] -- ERROR: {}".format(job.get("name", num), error)
+            print(msg, file=sys.stderr)
+
+
+async def run(
+        jobs, concurrency, collectors=None, sample_interval=None,
+        backend=None, cgroup_limits=None, open_job=open_params):
+    """Run jobs concurrently.
+
+    All of the jobs share one ``monitor.SharedSampler``, so system stats
+    are collected once per ``sample_interval`` for the whole batch, rather
+    than once per job.
+
+    Args:
+
+        jobs
+            A list of jobs, as dicts, e.g., of keyword arguments for
+            ``aio.run()``. These should include the logs to use, but not
+            the ``sampler``. A job's ``name`` (or else its number) is
+            used to report an error opening it.
+
+        concurrency
+            The max number of jobs to run at once.
+
+        collectors
+            The system stats to collect, as returned by
+            ``monitor.get_collectors()``. Default: the default collectors.
+
+        sample_interval
+            The number of seconds between samples of info about each
+            job. Default: ``constants.SAMPLE_INTERVAL``.
+
+        backend
+            How to collect the system stats, as for
+            ``monitor.get_reader()``. Default: with psutil.
+
+        cgroup_limits
+            A tuple ``cpus, memory_max`` to run each job in a cgroup of
+            its own with (see ``cgroup.create()``). Default: None (no
+            cgroups).
+
+        open_job
+            A callable that takes a job and its number in the batch (from
+            1), and returns a context manager that opens the job's logs,
+            gives its keyword arguments for ``aio.run()``, and closes the
+            logs again. It is only called when the job starts, so only
+            the running jobs have logs open. Default: ``open_params()``,
+            which uses each job as it is.
+
+    """
+    if sample_interval is None:
+        sample_interval = constants.SAMPLE_INTERVAL
+    semaphore = asyncio.Semaphore(concurrency)
+    sampler = monitor.SharedSampler(collectors, sample_interval, backend)
+    with sampler:
+        shared = {
+            "collectors": collectors,
+            "sample_interval": sample_interval,
+            "sampler": sampler}
+        tasks = [
+            run_job(semaphore, job, num, open_job, shared, cgroup_limits)
+            for num, job in enumerate(jobs, 1)]
+        await asyncio.gather(*tasks)
@@ -0,0 +1,407 @@
+"""Account for (and limit) a process tree with a cgroup v2 (Linux only).
+
+A process started in a cgroup stays in it, and so does everything it
+starts, so the cgroup's files account for the whole tree: including
+descendants that came and went between two samples, and without finding
+the processes first. Each stat is one small file, which a ``Cgroup``
+keeps open and re-reads as ``procfs`` does.
+
+    cgroup = cgroup_lib.create(memory_max=2 ** 30)
+    p = proc.start("make test", cgroup=cgroup)
+    ...
+    cgroup.stats()
+    cgroup.remove()
+
+The cgroup is created in psrun's own cgroup, so the host has to let
+psrun create cgroups there (e.g., because it runs as root, or in a
+cgroup delegated to it). The stats that come from a controller (memory,
+io, pids) and the limits are only available if the controller can be
+enabled for it. Outside the root cgroup, that means psrun first moves
+itself into a leaf cgroup (``SUPERVISOR``) next to the ones it creates,
+since a cgroup with processes of its own cannot enable controllers.
+That leaf is not removed when psrun exits (psrun is in it until then),
+and a later psrun reuses it.
+
+"""
+
+import itertools
+import os
+
+from . import exceptions
+from . import procfs
+
+MOUNTS = "/proc/self/mounts"
+"""Where Linux lists the mounted filesystems."""
+
+CGROUP = "/proc/self/cgroup"
+"""Where Linux lists the cgroups this process is in."""
+
+CONTROLLERS = ["cpu", "memory", "io", "pids"]
+"""The controllers to enable for a cgroup, where we can."""
+
+CPU_PERIOD = 100000
+"""The period (in microseconds) of a cgroup's CPU limit."""
+
+SHELL = "/bin/sh"
+"""The shell to execute commands with, as ``subprocess`` does."""
+
+COUNTER = itertools.count(1)
+"""Numbers the cgroups this process creates."""
+
+CANNOT_JOIN = 126
+"""The exit code of a wrapped command that cannot move into its cgroup."""
+
+SUPERVISOR = "psrun-supervisor"
+"""The leaf cgroup psrun moves itself into, to enable controllers."""
+
+
+def get_root():
+    """Get where the cgroup v2 hierarchy is mounted, or ``None``."""
+    with open(MOUNTS) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) > 2 and fields[2] == "cgroup2":
+                return fields[1]
+    return None
+
+
+def get_current():
+    """Get the path of this process's cgroup, in the cgroup v2 hierarchy."""
+    with open(CGROUP) as f:
+        for line in f:
+            if line.startswith("0::"):
+                return line[3:].strip()
+    return "/"
+
+
+def get_parent(root):
+    """Get the cgroup to create cgroups in: the one psrun was started in.
+
+    Args:
+
+        root
+            Where the cgroup v2 hierarchy is mounted.
+
+    Returns:
+        The path of the cgroup.
+
+    """
+    current = get_current()
+    parent = os.path.join(root, current.lstrip("/"))
+    if os.path.basename(current) == SUPERVISOR:
+        return os.path.dirname(parent)
+    return parent
+
+
+def get_missing_controllers(path):
+    """Get the controllers a cgroup does not enable for its children yet.
+
+    Args:
+
+        path
+            The path of the cgroup.
+
+    Returns:
+        A tuple ``missing, unavailable`` of lists of the ``CONTROLLERS``
+        the cgroup can enable, and of those it cannot (because they are
+        not enabled for it by its own parent).
+
+    """
+    with open(os.path.join(path, "cgroup.controllers")) as f:
+        available = f.read().split()
+    with open(os.path.join(path, "cgroup.subtree_control")) as f:
+        enabled = f.read().split()
+    missing = [
+        name for name in CONTROLLERS
+        if name in available and name not in enabled]
+    unavailable = [name for name in CONTROLLERS if name not in available]
+    return missing, unavailable
+
+
+def leave(path):
+    """Move this process out of a cgroup, into a leaf cgroup under it.
+
+    A cgroup (other than the root) cannot enable controllers for its
+    children while it has processes of its own, so psrun moves itself
+    into ``SUPERVISOR`` first. It stays there, and later cgroups are
+    created next to it. Nothing removes ``SUPERVISOR`` again, since
+    psrun is in it until it exits. A later psrun started in the cgroup,
+    or in ``SUPERVISOR`` itself, reuses it (see ``get_parent()``).
+
+    Args:
+
+        path
+            The path of the cgroup.
+
+    """
+    leaf = os.path.join(path, SUPERVISOR)
+    try:
+        os.mkdir(leaf)
+    except FileExistsError:
+        pass
+    with open(os.path.join(leaf, "cgroup.procs"), "w") as f:
+        f.write(str(os.getpid()))
+
+
+def enable_controllers(path, is_root=False):
+    """Enable what controllers we can for the children of a cgroup.
+
+    Args:
+
+        path
+            The path of the cgroup.
+
+        is_root
+            Whether the cgroup is the root of the hierarchy. If not, and
+            there are controllers to enable, this process is moved out
+            of the cgroup first (see ``leave()``).
+
+    Returns:
+        A dict of the ``CONTROLLERS`` that are not enabled, with the
+        reason why, e.g., ``{"io": "Not available in /sys/fs/cgroup"}``.
+
+    """
+    missing, unavailable = get_missing_controllers(path)
+    errors = {}
+    for name in unavailable:
+        errors[name] = "Not available in {}".format(path)
+    if missing and not is_root:
+        try:
+            leave(path)
+        except OSError as e:
+            msg = "Cannot move psrun out of {}: {}".format(path, e)
+            errors.update(dict.fromkeys(missing, msg))
+            return errors
+    for name in missing:
+        try:
+            with open(os.path.join(path, "cgroup.subtree_control"), "w") as f:
+                f.write("+{}".format(name))
+        except OSError as e:
+            errors[name] = "Cannot enable it in {}: {}".format(path, e)
+    return errors
+
+
+def create(cpus=None, memory_max=None):
+    """Create a cgroup to start a process in.
+
+    Controllers that cannot be enabled for the cgroup are listed, with
+    the reason why, in its ``errors``: the stats that come from them are
+    then missing.
+
+    Args:
+
+        cpus
+            The max num of CPUs the cgroup can use (e.g., 1.5), or
+            ``None`` for no limit.
+
+        memory_max
+            The max num of bytes of memory the cgroup can use, or ``None``
+            for no limit.
+
+    Raises:
+
+        exceptions.CgroupUnavailable
+            If this host does not let us create the cgroup, or set its
+            limits.
+
+    Returns:
+        A ``Cgroup``.
+
+    """
+    try:
+        root = get_root()
+        if root is None:
+            raise OSError("No cgroup v2 hierarchy is mounted")
+        parent = get_parent(root)
+        if not os.access(os.path.join(parent, "cgroup.procs"), os.W_OK):
+            raise OSError("Cannot move processes out of {}".format(parent))
+        errors = enable_controllers(
+            parent, os.path.samefile(parent, root))
+        path = os.path.join(
+            parent, "psrun-{}-{}".format(os.getpid(), next(COUNTER)))
+        os.mkdir(path)
+    except OSError as e:
+        msg = "Cannot create a cgroup: {}".format(e)
+        raise exceptions.CgroupUnavailable(msg)
+
+    limits = []
+    if cpus is not None:
+        quota = max(int(cpus * CPU_PERIOD), 1000)
+        limits.append(("cpu.max", "{} {}".format(quota, CPU_PERIOD)))
+    if memory_max is not None:
+        limits.append(("memory.max", str(memory_max)))
+
+    cgroup = Cgroup(path, errors)
+    try:
+        for name, value in limits:
+            if not os.path.exists(os.path.join(path, name)):
+                controller = name.partition(".")[0]
+                raise OSError("The {} controller is not enabled: {}".format(
+                    controller, errors.get(controller, "Unknown error")))
+            cgroup.write(name, value)
+    except OSError as e:
+        cgroup.remove()
+        msg = "Cannot limit the cgroup: {}".format(e)
+        raise exceptions.CgroupUnavailable(msg)
+    return cgroup
+
+
+class Cgroup(object):
+    """A cgroup v2, to start a process in, and account for it with.
+
+    Use ``create()`` to make one.
+
+    Args:
+
+        path
+            The path of the cgroup's directory.
+
+        errors
+            A dict of the controllers that are not enabled for the
+            cgroup, with the reason why. Default: none.
+
+    """
+
+    def __init__(self, path, errors=None):
+        """Initialize the cgroup."""
+        self.path = path
+        self.errors = errors or {}
+        self.files = {}
+
+    def write(self, name, value):
+        """Write a value to one of the cgroup's files, e.g., "memory.max".
+        """
+        with open(os.path.join(self.path, name), "w") as f:
+            f.write(value)
+
+    def wrap(self, cmd):
+        """Get the args to execute a command with in the cgroup.
+
+        The command is executed in a shell, as with ``shell=True``. The
+        shell moves itself into the cgroup before it does anything else,
+        so nothing the command starts is missed. If it cannot, it exits
+        with ``CANNOT_JOIN`` instead (see ``check_joined()``).
+
+        Args:
+
+            cmd
+                A command, e.g., 'ls -la', or a list of args for the
+                shell, as ``subprocess`` takes with ``shell=True``.
+
+        Returns:
+            A list of args, to execute without a shell.
+
+        """
+        args = [cmd] if isinstance(cmd, str) else list(cmd)
+        script = 'echo 0 > "$0" || exit {}; exec {} -c "$@"'.format(
+            CANNOT_JOIN, SHELL)
+        procs = os.path.join(self.path, "cgroup.procs")
+        return [SHELL, "-c", script, procs] + args
+
+    def check_joined(self, exit_code):
+        """Check that a command executed with ``wrap()`` was in the cgroup.
+
+        The command can exit with ``CANNOT_JOIN`` itself, but only once
+        it has run in the cgroup, which then has used some CPU time.
+
+        Args:
+
+            exit_code
+                The exit code of the command.
+
+        Raises:
+
+            exceptions.CgroupUnavailable
+                If the command could not move into the cgroup, so it was
+                not executed.
+
+        """
+        if exit_code != CANNOT_JOIN:
+            return
+        if not self.stats().get("cpu_usage"):
+            msg = "Cannot move the process into the cgroup: {}".format(
+                self.path)
+            raise exceptions.CgroupUnavailable(msg)
+
+    def read(self, name):
+        """Read one of the cgroup's files again, keeping it open.
+
+        Returns:
+            A tuple ``buffer, length``, as for ``procfs.find_line()``, or
+            ``None`` if the cgroup does not have the file.
+
+        """
+        if name not in self.files:
+            try:
+                self.files[name] = procfs.File(os.path.join(self.path, name))
+            except OSError:
+                self.files[name] = None
+        f = self.files[name]
+        if f is None:
+            return None
+        length = f.read()
+        return f.buffer, length
+
+    def read_number(self, name):
+        """Read one of the cgroup's files that holds a single int, or
+        ``None`` if it does not have the file."""
+        contents = self.read(name)
+        if contents is None:
+            return None
+        buffer, length = contents
+        return int(buffer[:length])
+
+    def stats(self):
+        """Get stats about everything in the cgroup.
+
+        Returns:
+            A dict of the stats the cgroup has: its CPU time (in secs),
+            its memory use and the most it has used (in bytes), its I/O,
+            and the num of processes in it.
+
+        """
+        data = {}
+        contents = self.read("cpu.stat")
+        if contents is not None:
+            buffer, length = contents
+            for key, name in [
+                    ("cpu_usage", b"usage_usec "),
+                    ("cpu_user", b"user_usec "),
+                    ("cpu_system", b"system_usec ")]:
+                data[key] = procfs.get_field(buffer, length, name) / 1e6
+
+        for key, name in [
+                ("memory_current", "memory.current"),
+                ("memory_peak", "memory.peak"),
+                ("num_procs", "pids.current")]:
+            value = self.read_number(name)
+            if value is not None:
+                data[key] = value
+
+        contents = self.read("io.stat")
+        if contents is not None:
+            buffer, length = contents
+            io = dict.fromkeys(
+                [b"rbytes", b"wbytes", b"rios", b"wios"], 0)
+            for field in buffer[:length].split():
+                key, _, value = field.partition(b"=")
+                key = bytes(key)
+                if key in io:
+                    io[key] += int(value)
+            data["io_read_bytes"] = io[b"rbytes"]
+            data["io_write_bytes"] = io[b"wbytes"]
+            data["io_read_count"] = io[b"rios"]
+            data["io_write_count"] = io[b"wios"]
+        return data
+
+    def remove(self):
+        """Close the cgroup's files, and remove it if nothing is left in
+        it."""
+        for f in self.files.values():
+            if f is not None:
+                f.close()
+        self.files.clear()
+        try:
+            os.rmdir(self.path)
+        except OSError:
+            pass
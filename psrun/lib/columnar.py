@@ -0,0 +1,241 @@
+"""A binary, columnar format for process info.
+
+Records are flattened (as in ``compact.flatten()``) and collected into
+columns, one per path, plus a ``time`` column with when each record was
+written. Every ``CHUNK_ROWS`` records, the columns are written out as a
+chunk, so a file can be read back as it is written, and a run that is
+killed loses at most one chunk.
+
+A file is ``MAGIC``, then any number of chunks. Each chunk is:
+
+    header_len, body_len    Two little-endian uint32s.
+    header                  JSON: {"rows": N, "byteorder": "little",
+                            "columns": [[path, type, offset, length], ...]}
+    body                    The columns' bytes, at their offsets.
+
+A column of numbers (with NaN for records that do not have the path) is
+stored as type "d": an ``array.array("d")`` of float64s, in the header's
+byte order. Any other column is stored as type "j": a JSON list, with
+``null`` for records that do not have the path.
+
+Use ``Writer`` to write a file, and ``read()`` to load it back into
+columns, which is much faster than parsing a line of JSON per record.
+
+"""
+
+import json
+import math
+import struct
+import sys
+import time
+
+from array import array
+from collections import OrderedDict
+
+from . import compact
+from . import summary as summary_lib
+
+MAGIC = b"PSRUNCOL"
+"""The first bytes of a columnar file."""
+
+PREFIX = struct.Struct("<II")
+"""The lengths of a chunk's header and body."""
+
+CHUNK_ROWS = 1000
+"""Num records to collect before writing them out as a chunk."""
+
+
+def encode(data):
+    """Pass a record through as it is, for a ``Writer`` to write.
+
+    Use this as the ``ps_encode`` of a run that logs to a ``Writer``, so
+    that records are not serialized as text on the way.
+
+    """
+    return data
+
+
+def is_numeric(values):
+    """Check if a column can be stored as numbers."""
+    return all(
+        value is None or summary_lib.is_number(value) for value in values)
+
+
+class Writer(object):
+    """Writes records to a file, in the columnar format.
+
+    Args:
+
+        file
+            A file object open for writing bytes. If it is empty, the
+            ``MAGIC`` is written first.
+
+        chunk_rows
+            Num records per chunk. Default: ``CHUNK_ROWS``.
+
+    """
+
+    def __init__(self, file, chunk_rows=None):
+        """Initialize the writer."""
+        self.file = file
+        self.chunk_rows = chunk_rows or CHUNK_ROWS
+        self.rows = 0
+        self.columns = OrderedDict()
+        if file.tell() == 0:
+            file.write(MAGIC)
+
+    def write(self, record, now=None):
+        """Add a record to the current chunk.
+
+        Args:
+
+            record
+                A dict, or a dict serialized as JSON (e.g., an error that
+                was logged while monitoring).
+
+            now
+                The time of the record, by ``time.time()``. Default: now.
+
+        """
+        if isinstance(record, str):
+            record = json.loads(record)
+        flat = compact.flatten(record)
+        flat["time"] = time.time() if now is None else now
+        columns = self.columns
+        rows = self.rows
+        for path, value in flat.items():
+            column = columns.get(path)
+            if column is None:
+                column = columns[path] = []
+            if len(column) < rows:
+                column.extend([None] * (rows - len(column)))
+            column.append(value)
+        self.rows += 1
+        if self.rows >= self.chunk_rows:
+            self.flush()
+
+    def flush(self):
+        """Write out the current chunk, if it has any records."""
+        if not self.rows:
+            return
+        specs = []
+        parts = []
+        offset = 0
+        for path, values in self.columns.items():
+            values.extend([None] * (self.rows - len(values)))
+            if is_numeric(values):
+                kind = "d"
+                data = array("d", [
+                    math.nan if value is None else value
+                    for value in values]).tobytes()
+            else:
+                kind = "j"
+                data = json.dumps(values).encode("utf-8")
+            specs.append([path, kind, offset, len(data)])
+            parts.append(data)
+            offset += len(data)
+        header = json.dumps({
+            "rows": self.rows, "byteorder": sys.byteorder,
+            "columns": specs}).encode("utf-8")
+        self.file.write(PREFIX.pack(len(header), offset))
+        self.file.write(header)
+        self.file.write(b"".join(parts))
+        self.file.flush()
+        self.rows = 0
+        self.columns = OrderedDict()
+
+    def close(self):
+        """Write out the current chunk, and close the file."""
+        self.flush()
+        self.file.close()
+
+
+def to_list(column):
+    """Turn a column into a list, with ``None`` for missing values."""
+    if isinstance(column, list):
+        return column
+    return [None if math.isnan(value) else value for value in column]
+
+
+def read_chunk(file):
+    """Read a chunk from a columnar file.
+
+    Args:
+
+        file
+            A file object, at the start of a chunk.
+
+    Returns:
+        A tuple ``rows, columns``, where ``columns`` is a list of
+        ``(path, values)`` pairs. At the end of the file, or of what was
+        written of it, ``rows`` is 0.
+
+    """
+    prefix = file.read(PREFIX.size)
+    if len(prefix) < PREFIX.size:
+        return 0, []
+    header_len, body_len = PREFIX.unpack(prefix)
+    header = file.read(header_len)
+    body = file.read(body_len)
+    if len(header) < header_len or len(body) < body_len:
+        return 0, []
+
+    header = json.loads(header.decode("utf-8"))
+    columns = []
+    for path, kind, offset, length in header["columns"]:
+        data = body[offset:offset + length]
+        if kind == "d":
+            values = array("d")
+            values.frombytes(data)
+            if header["byteorder"] != sys.byteorder:
+                values.byteswap()
+        else:
+            values = json.loads(data.decode("utf-8"))
+        columns.append((path, values))
+    return header["rows"], columns
+
+
+def read(file):
+    """Load a columnar file into columns.
+
+    Args:
+
+        file
+            A file object open for reading bytes.
+
+    Raises:
+
+        ValueError
+            If the file is not in the columnar format.
+
+    Returns:
+        An ``OrderedDict`` of ``path -> values``, with a value for each
+        record. Columns of numbers are ``array.array("d")``, with NaN for
+        missing values. Other columns are lists, with ``None`` for them.
+
+    """
+    if file.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Not a columnar file.")
+
+    columns = OrderedDict()
+    total = 0
+    while True:
+        rows, chunk = read_chunk(file)
+        if not rows:
+            break
+        for path, values in chunk:
+            column = columns.get(path)
+            if column is None:
+                column = columns[path] = array("d", [math.nan]) * total
+            if isinstance(column, array) and isinstance(values, array):
+                column.extend(values)
+            else:
+                columns[path] = to_list(column) + to_list(values)
+        total += rows
+        for path, column in columns.items():
+            missing = total - len(column)
+            if isinstance(column, array):
+                column.extend(array("d", [math.nan]) * missing)
+            else:
+                column.extend([None] * missing)
+    return columns
@@ -0,0 +1,219 @@
+"""A compact, delta-encoded format for process info.
+
+Each record is flattened into ``path -> value`` pairs (nested keys are
+joined with ``SEP``). The first record is written as a keyframe, which
+lists every path once, along with its value. After that, each record
+only mentions the paths whose values changed, by their index in the
+keyframe's list of paths:
+
+    {"d": {"3": 4096}}        Integer 3 went up by 4096.
+    {"s": {"5": 0.25}}        Value 5 was set to 0.25.
+    {"k": ["a/b"], ...}       Path "a/b" was appended to the list of paths.
+    {"x": [7]}                Path 7 is no longer present.
+
+Values that never change (``cpu_count``, frequency bounds, etc.) are
+therefore only written in keyframes. A fresh keyframe is written every
+``KEYFRAME_INTERVAL`` records, so that a rotated log file can still be
+decoded without the files that came before it.
+
+Use ``decode()`` to turn a compact log back into full records.
+
+"""
+
+import json
+
+VERSION = "compact/1"
+"""The version of the format, as it appears in keyframes."""
+
+SEP = "/"
+"""The separator for the parts of a flattened path."""
+
+KEYFRAME_INTERVAL = 600
+"""Num records between keyframes."""
+
+DELTA_KEYS = {"d", "s", "k", "x"}
+"""The keys that can appear in a delta record."""
+
+
+def is_int(value):
+    """Check if a value is an integer (but not a bool)."""
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def flatten(data, prefix="", flat=None):
+    """Flatten a nested record into a dict of ``path -> value``.
+
+    Dicts, and lists of dicts, are flattened. Any other value (including
+    lists of scalars, like a list of pids) is kept whole.
+
+    Args:
+
+        data
+            The record to flatten.
+
+        prefix
+            A prefix for the paths (used when recursing).
+
+        flat
+            The dict to put the paths in (used when recursing).
+
+    Returns:
+        The flattened record.
+
+    """
+    if flat is None:
+        flat = {}
+    for key, value in data.items():
+        path = prefix + str(key)
+        if isinstance(value, list) and value and \
+                isinstance(value[0], dict) and \
+                all(isinstance(x, dict) for x in value):
+            value = dict((str(i), x) for i, x in enumerate(value))
+        if isinstance(value, dict) and value:
+            flatten(value, path + SEP, flat)
+        else:
+            flat[path] = value
+    return flat
+
+
+def listify(data):
+    """Turn dicts with keys "0", "1", ... back into lists."""
+    for key, value in data.items():
+        if isinstance(value, dict):
+            data[key] = listify(value)
+    keys = list(data.keys())
+    if keys and keys == [str(i) for i in range(len(keys))]:
+        return [data[key] for key in keys]
+    return data
+
+
+def unflatten(flat):
+    """Rebuild a nested record from a dict of ``path -> value``.
+
+    Args:
+
+        flat
+            A flattened record.
+
+    Returns:
+        The nested record.
+
+    """
+    data = {}
+    for path, value in flat.items():
+        parts = path.split(SEP)
+        node = data
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+        node[parts[-1]] = value
+    return listify(data)
+
+
+def serialize(data):
+    """Serialize a compact record as tersely as JSON allows."""
+    return json.dumps(data, separators=(",", ":"))
+
+
+def get_encoder(keyframe_interval=KEYFRAME_INTERVAL):
+    """Get a function that encodes records in the compact format.
+
+    The function remembers the records it has encoded, so use a new
+    one for each log.
+
+    Args:
+
+        keyframe_interval
+            Num records between keyframes.
+
+    Returns:
+        A function that takes a record and returns a string.
+
+    """
+    paths = []
+    indexes = {}
+    previous = {}
+    count = [0]
+
+    def keyframe(flat):
+        paths[:] = list(flat.keys())
+        indexes.clear()
+        indexes.update((path, i) for i, path in enumerate(paths))
+        values = [flat[path] for path in paths]
+        return {"psrun": VERSION, "keys": paths, "values": values}
+
+    def delta(flat):
+        record = {}
+        for path, value in flat.items():
+            if path not in indexes:
+                indexes[path] = len(paths)
+                paths.append(path)
+                record.setdefault("k", []).append(path)
+            elif path in previous and previous[path] == value:
+                continue
+            index = str(indexes[path])
+            old = previous.get(path)
+            if is_int(value) and is_int(old):
+                record.setdefault("d", {})[index] = value - old
+            else:
+                record.setdefault("s", {})[index] = value
+        gone = [indexes[path] for path in previous if path not in flat]
+        if gone:
+            record["x"] = gone
+        return record
+
+    def encode(data):
+        flat = flatten(data)
+        if count[0] % keyframe_interval == 0:
+            record = keyframe(flat)
+        else:
+            record = delta(flat)
+        count[0] += 1
+        previous.clear()
+        previous.update(flat)
+        return serialize(record)
+
+    return encode
+
+
+def decode(lines):
+    """Decode a compact log back into full records.
+
+    Lines that are not part of the compact format (e.g., errors that
+    were logged while monitoring) are passed through as they are. Delta
+    records that come before the first keyframe cannot be decoded, so
+    they are skipped.
+
+    Args:
+
+        lines
+            An iterable of lines from a compact log.
+
+    Yields:
+        Each record, as a dict.
+
+    """
+    paths = []
+    current = None
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        record = json.loads(line)
+        if record.get("psrun") == VERSION:
+            paths = list(record["keys"])
+            current = dict(zip(paths, record["values"]))
+        elif set(record.keys()) <= DELTA_KEYS:
+            if current is None:
+                continue
+            paths.extend(record.get("k", []))
+            for index, value in record.get("d", {}).items():
+                path = paths[int(index)]
+                current[path] = current[path] + value
+            for index, value in record.get("s", {}).items():
+                current[paths[int(index)]] = value
+            for index in record.get("x", []):
+                current.pop(paths[index], None)
+        else:
+            yield record
+            continue
+        yield unflatten(current)
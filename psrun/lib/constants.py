@@ -3,3 +3,18 @@
 
 POLL_DELAY = 0.1
 """When polling a proc to see if it's done, num secs between each poll."""
+
+SAMPLE_INTERVAL = 0.1
+"""Num secs between each sample of a running proc's stats."""
+
+EOF_TIMEOUT = 1.0
+"""After a proc exits, max num secs to wait for its output to be read."""
+
+CHUNK_SIZE = 65536
+"""When copying output as raw bytes, max num bytes to read at a time."""
+
+LOG_BATCH_SIZE = 65536
+"""Num bytes of log messages to collect before writing them out."""
+
+LOG_FLUSH_INTERVAL = 0.1
+"""Max num secs to hold a log message before writing it out."""
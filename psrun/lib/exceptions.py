@@ -19,3 +19,13 @@ class PermissionDenied(Exception):
 class ProcTimeout(Exception):
     """Raise when a process times out."""
     pass
+
+
+class CgroupUnavailable(Exception):
+    """Raise when a cgroup cannot be set up."""
+    pass
+
+
+class ProcMaxRss(Exception):
+    """Raise when a process uses more memory than it is allowed."""
+    pass
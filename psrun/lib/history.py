@@ -0,0 +1,211 @@
+"""A bounded, in-memory history of the stats collected about a process.
+
+The history is kept in columns: one preallocated ``array.array`` of
+floats per numeric stat (named by its flattened path, as in
+``compact.flatten()``, e.g., "process/rss"), plus two for the time of
+each sample: one by ``time.monotonic()``, which windows and rates are
+computed with (so they are not thrown off when the system clock is set),
+and one by ``time.time()``, which the history is written out with. The
+columns are used as ring buffers, so the history keeps
+the last ``size`` samples, in the same memory, however long the process
+runs. A stat that is missing from a sample is stored as NaN.
+
+Query it while (or after) a process runs, e.g., for the child's RSS
+over the last minute, or its CPU use from the cumulative CPU times:
+
+    history.get("process/rss", secs=60)
+    history.rate("process/cpu_user", secs=60)
+
+"""
+
+import math
+import time
+
+from array import array
+from collections import OrderedDict
+from threading import Lock
+
+from . import monitor
+from . import summary as summary_lib
+
+SIZE = 600
+"""The default num of samples to keep (a minute, at the default rate)."""
+
+
+class History(object):
+    """Keeps the last ``size`` samples of each numeric stat, in columns.
+
+    Pass it to ``monitor.collect()`` (e.g., via ``main.run()``) to add
+    each record to it. If it has a log, ``main.run()`` writes it there
+    when the process is done, or times out. It is safe to query from
+    other threads while samples are being added.
+
+    Args:
+
+        size
+            The num of samples to keep, at least 1. Default: ``SIZE``.
+
+        log
+            A callable to write the history to, or ``None``.
+
+        encode
+            A callable to serialize the history with, e.g., the same one
+            as the samples. Default: ``monitor.serialize()``.
+
+    Raises:
+
+        ValueError
+            If the size is below 1.
+
+    """
+
+    def __init__(self, size=None, log=None, encode=None):
+        """Initialize the history."""
+        if size is not None and size < 1:
+            raise ValueError("Bad history size: {}".format(size))
+        self.size = size or SIZE
+        self.log = log
+        self.encode = encode or monitor.serialize
+        self.count = 0
+        self.times = self.get_column()
+        self.wall_times = self.get_column()
+        self.columns = OrderedDict()
+        self.lock = Lock()
+
+    def get_column(self):
+        """Get a new column, with room for ``size`` samples."""
+        return array("d", [math.nan]) * self.size
+
+    def __len__(self):
+        """Get the num of samples in the history."""
+        return min(self.count, self.size)
+
+    def add(self, data, now=None, wall_time=None):
+        """Add a record of stats.
+
+        Args:
+
+            data
+                A record, as gathered by ``monitor.collect()``.
+
+            now
+                The time of the record, by ``time.monotonic()``. Default:
+                now.
+
+            wall_time
+                The time of the record, by ``time.time()``. Default: now.
+
+        """
+        if now is None:
+            now = time.monotonic()
+        if wall_time is None:
+            wall_time = time.time()
+        numbers = summary_lib.get_numbers(data)
+        with self.lock:
+            i = self.count % self.size
+            self.times[i] = now
+            self.wall_times[i] = wall_time
+            for column in self.columns.values():
+                column[i] = math.nan
+            for path, value in numbers:
+                column = self.columns.get(path)
+                if column is None:
+                    column = self.columns[path] = self.get_column()
+                column[i] = value
+            self.count += 1
+
+    def get_indexes(self, secs=None):
+        """Get the indexes of the samples in the history, oldest first.
+
+        Args:
+
+            secs
+                Only get the samples from the last ``secs`` secs before
+                the latest one. Default: all of them.
+
+        Returns:
+            A list of indexes into the columns.
+
+        """
+        start = self.count - len(self)
+        indexes = [n % self.size for n in range(start, self.count)]
+        if secs is not None and indexes:
+            since = self.times[indexes[-1]] - secs
+            indexes = [i for i in indexes if self.times[i] >= since]
+        return indexes
+
+    def get(self, path, secs=None):
+        """Get the samples of a stat.
+
+        Args:
+
+            path
+                The stat, e.g., "process/rss".
+
+            secs
+                Only get the samples from the last ``secs`` secs before
+                the latest one. Default: all of them.
+
+        Returns:
+            A list of ``(time, value)`` pairs, oldest first, with the
+            time by ``time.monotonic()``. Samples without the stat are
+            left out.
+
+        """
+        with self.lock:
+            column = self.columns.get(path)
+            if column is None:
+                return []
+            return [
+                (self.times[i], column[i]) for i in self.get_indexes(secs)
+                if not math.isnan(column[i])]
+
+    def rate(self, path, secs=None):
+        """Get the rate of change of a stat, per sec.
+
+        This turns cumulative stats into rates, e.g., the CPU seconds
+        used per sec from "process/cpu_user".
+
+        Args:
+
+            path
+                The stat, e.g., "process/cpu_user".
+
+            secs
+                Only use the samples from the last ``secs`` secs before
+                the latest one. Default: all of them.
+
+        Returns:
+            A list of ``(time, rate)`` pairs, one per sample after the
+            first, oldest first, with the time by ``time.monotonic()``.
+
+        """
+        samples = self.get(path, secs)
+        return [
+            (t1, (v1 - v0) / (t1 - t0))
+            for (t0, v0), (t1, v1) in zip(samples, samples[1:])
+            if t1 > t0]
+
+    def dump(self):
+        """Get the history, as a record of columns.
+
+        Returns:
+            A dict like ``{"history": {"time": [...], "process/rss":
+            [...], ...}}``, oldest first, with ``None`` for missing values,
+            and the time by ``time.time()``.
+
+        """
+        columns = OrderedDict()
+        with self.lock:
+            indexes = self.get_indexes()
+            columns["time"] = [self.wall_times[i] for i in indexes]
+            for path, column in self.columns.items():
+                columns[path] = [
+                    None if math.isnan(column[i]) else column[i]
+                    for i in indexes]
+        return {"history": columns}
+
+    def write(self):
+        """Write the history to its log (if it has one), as one record."""
+        if self.log is not None:
+            self.log(self.encode(self.dump()))
@@ -0,0 +1,151 @@
+"""Stop a process tree that uses too much CPU, or stalls.
+
+A wall-clock timeout cannot tell a job that is busy from one that is
+stuck. A ``Watchdog`` looks at each sample of a process tree instead:
+
+- The CPU time of the whole tree is checked against a budget of CPU
+  secs. In a cgroup, it is read from the cgroup, which also counts the
+  processes that have exited. Otherwise, it is summed over the tree,
+  including the children each process has waited for.
+
+- The tree is idle if, since the last sample, it used no CPU, made no
+  write syscalls (e.g., to write its output), and psrun forwarded no
+  output from it. If it stays idle for too long, it has stalled.
+
+Each check is only as prompt as the samples. ``set_cpu_limit()`` also
+has the kernel stop any single process of the tree that goes well past
+the budget, if the watchdog has not stopped it by then.
+
+"""
+
+import math
+import resource
+import time
+
+CPU_KEYS = ["cpu_user", "cpu_system", "cpu_children"]
+"""The stats of a process tree that add up to its CPU time."""
+
+
+def get_cpu_time(data):
+    """Get the CPU time a process tree has used, from its stats.
+
+    Args:
+
+        data
+            A record, as gathered by ``monitor.collect()``.
+
+    Returns:
+        The num of CPU secs.
+
+    """
+    cgroup = data.get("cgroup", {})
+    if "cpu_usage" in cgroup:
+        return cgroup["cpu_usage"]
+    process = data.get("process", {})
+    return sum(process.get(key, 0.0) for key in CPU_KEYS)
+
+
+def set_cpu_limit(pid, cpu_timeout, shutdown=None, slack=0):
+    """Have the kernel stop a process that goes well past a CPU budget.
+
+    This sets ``RLIMIT_CPU``: past the soft limit, the process gets
+    SIGXCPU (which ends it, unless it handles it), and past the hard
+    limit, ``shutdown`` secs later, SIGKILL. The limit is per process,
+    and only the processes it starts from then on inherit it.
+
+    A ``Watchdog`` only sees the budget is used up at the next sample,
+    and then gives the process ``shutdown`` secs to stop. So the soft
+    limit is ``slack`` plus ``shutdown`` secs past the budget, and the
+    kernel only steps in if the watchdog could not (e.g., a process
+    that uses more than one CPU).
+
+    Args:
+
+        pid
+            The pid of the process.
+
+        cpu_timeout
+            The num of CPU secs the process can use, or ``None``.
+
+        shutdown
+            The num of CPU secs to let the process shutdown, or ``None``
+            to never kill it.
+
+        slack
+            The most secs between two samples.
+
+    Returns:
+        ``True`` if the limit was set. ``False`` otherwise, e.g., if
+        the platform does not support it, or the process is gone.
+
+    """
+    if not cpu_timeout:
+        return False
+    soft = math.ceil(cpu_timeout + slack + (shutdown or 0))
+    hard = soft + math.ceil(shutdown) if shutdown else resource.RLIM_INFINITY
+    try:
+        resource.prlimit(pid, resource.RLIMIT_CPU, (soft, hard))
+    except (AttributeError, OSError, ValueError):
+        return False
+    return True
+
+
+class Watchdog(object):
+    """Checks samples of a process tree for a CPU budget, and for stalls.
+
+    Args:
+
+        cpu_timeout
+            The num of CPU secs the process tree can use, or ``None``.
+
+        idle_timeout
+            The most secs the process tree can go without using CPU or
+            writing anything, or ``None``.
+
+        now
+            The (monotonic) time the process started. Default: now.
+
+    """
+
+    def __init__(self, cpu_timeout=None, idle_timeout=None, now=None):
+        """Initialize the watchdog."""
+        self.cpu_timeout = cpu_timeout
+        self.idle_timeout = idle_timeout
+        self.active_at = time.monotonic() if now is None else now
+        self.last = None
+
+    def check(self, data, output=0, now=None):
+        """Check the latest sample of the process tree.
+
+        Args:
+
+            data
+                The latest record, as gathered by ``monitor.collect()``,
+                or ``None`` if it could not be gathered.
+
+            output
+                The num of lines of output forwarded so far.
+
+            now
+                The (monotonic) time of the sample. Default: now.
+
+        Returns:
+            Why the process tree should be stopped, or ``None``.
+
+        """
+        if data is None:
+            return None
+        if now is None:
+            now = time.monotonic()
+        cpu_time = get_cpu_time(data)
+        if self.cpu_timeout and cpu_time > self.cpu_timeout:
+            return "Used more than {} CPU secs".format(self.cpu_timeout)
+
+        writes = data.get("process", {}).get("io_write_count", 0)
+        activity = cpu_time, writes, output
+        if activity != self.last:
+            self.last = activity
+            self.active_at = now
+        elif self.idle_timeout and now - self.active_at > self.idle_timeout:
+            return "Idle for more than {} secs".format(self.idle_timeout)
+        return None
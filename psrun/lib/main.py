@@ -2,6 +2,7 @@
 
 from . import exceptions
 from . import proc
+from . import stream
 
 
 def report_start_details(log, cmd):
@@ -20,7 +21,7 @@ def report_start_details(log, cmd):
     log("-- Executing {} ...".format(cmd))
 
 
-def report_final_details(log, exit_code, running_time):
+def report_final_details(log, exit_code, running_time, details=None):
     """Pass final details to a ``log()`` function.
 
     Args:
@@ -32,11 +33,16 @@ def report_final_details(log, exit_code, running_time):
             The exit code of the process.
 
         running_time
-            The time the process took to run.
+            The time the process took to run (in milliseconds).
+
+        details
+            An optional dict of anything else to report.
 
     """
     log("-- Exit code: {}".format(exit_code))
     log("-- Run time: {}ms".format(running_time))
+    for key, value in (details or {}).items():
+        log("-- {}: {}".format(key, value))
 
 
 def report_error(log, error):
@@ -54,7 +60,12 @@ def report_error(log, error):
     log("-- ERROR: {}".format(error))
 
 
-def run(cmd, timeout, shutdown, runner_log, ps_log, stdout_log, stderr_log):
+def run(
+        cmd, timeout, shutdown, runner_log, ps_log, stdout_log, stderr_log,
+        ps_encode=None, collectors=None, sample_interval=None,
+        buffer_size=0, buffer_policy=stream.BLOCK, sampler=None,
+        summary=None, history=None, cgroup=None, max_sample_interval=None,
+        max_rss=None, cpu_timeout=None, idle_timeout=None):
     """Execute a command.
 
     Args:
@@ -75,18 +86,91 @@ def run(cmd, timeout, shutdown, runner_log, ps_log, stdout_log, stderr_log):
             A callable we can send info about the process to.
 
         stdout_log
-            A callable we can send lines from stdout to.
+            A callable we can send lines from stdout to, a file
+            descriptor to copy stdout to as raw bytes, or a
+            ``stream.Redirect`` for the process to write stdout to itself.
 
         stderr_log
-            A callable we can send lines from stderr to.
+            A callable we can send lines from stderr to, a file
+            descriptor to copy stderr to as raw bytes, or a
+            ``stream.Redirect`` for the process to write stderr to itself.
+
+        ps_encode
+            A callable to serialize info about the process with,
+            e.g., ``compact.get_encoder()``. Default: JSON.
+
+        collectors
+            The system stats to collect, as returned by
+            ``monitor.get_collectors()``. Default: the default collectors.
+
+        sample_interval
+            The number of seconds between samples of info about the
+            process. Default: ``constants.SAMPLE_INTERVAL``.
+
+        buffer_size
+            The max number of lines of stdout/stderr to hold in memory
+            before they are logged. Default: no limit.
+
+        buffer_policy
+            What to do when a buffer is full: ``stream.BLOCK`` (make the
+            process wait), ``stream.DROP_OLDEST`` or ``stream.DROP_NEWEST``.
+
+        sampler
+            A ``monitor.Sampler`` to collect system stats with, e.g., a
+            ``monitor.SharedSampler`` shared with other runs.
+            Default: a new one, for ``collectors``.
+
+        summary
+            A ``summary.Summary`` to add info about the process to. It is
+            written out when the process is done. Default: None.
+
+        history
+            A ``history.History`` to add info about the process to. It is
+            written out (if it has a log) when the process is done, or
+            times out. Default: None.
+
+        cgroup
+            A ``cgroup.Cgroup`` to start the process in, and collect stats
+            about the whole process tree from. It is removed when the
+            process is done. Default: None.
+
+        max_sample_interval
+            The most secs to wait between samples while the process is
+            steady (see ``adaptive.Interval``). Default: None (always
+            wait ``sample_interval``).
+
+        max_rss
+            The max number of bytes of RSS the process tree can use. It
+            is stopped if it uses more. Default: None (no limit).
+
+        cpu_timeout
+            The number of CPU seconds the process tree can use. It is
+            stopped if it uses more. Default: None (no limit).
+
+        idle_timeout
+            The number of seconds the process tree can go without using
+            CPU or writing anything. It is stopped if it is idle for
+            longer. Default: None (no limit).
 
     """
-    errs = (exceptions.ProcTimeout, exceptions.PermissionDenied)
+    errs = (
+        exceptions.ProcTimeout, exceptions.ProcMaxRss,
+        exceptions.PermissionDenied, exceptions.CgroupUnavailable)
     report_start_details(runner_log, cmd)
     try:
-        exit_code, running_time = proc.execute(
-            cmd, stdout_log, stderr_log, ps_log, timeout, shutdown)
+        exit_code, running_time, details = proc.execute(
+            cmd, stdout_log, stderr_log, ps_log, timeout, shutdown,
+            ps_encode, collectors, sample_interval, buffer_size,
+            buffer_policy, sampler, summary, history, cgroup,
+            max_sample_interval, max_rss, cpu_timeout, idle_timeout)
     except errs as error:
         report_error(runner_log, error)
     else:
-        report_final_details(runner_log, exit_code, running_time)
+        report_final_details(runner_log, exit_code, running_time, details)
+    finally:
+        if summary is not None:
+            summary.write()
+        if history is not None:
+            history.write()
+        if cgroup is not None:
+            cgroup.remove()
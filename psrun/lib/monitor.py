@@ -1,7 +1,27 @@
 """Utilities for monitoring a process."""
 
 import json
+import math
+import os
 import psutil
+import time
+
+from collections import namedtuple, OrderedDict
+from contextlib import nullcontext
+from threading import Event, Lock, Thread
+
+from . import constants
+from . import procfs
+
+
+def all_pids():
+    """Get the pids of every process on the system."""
+    return psutil.pids()
+
+
+def cpu_count():
+    """Get the number of logical CPUs."""
+    return psutil.cpu_count()
 
 
 def cpu_times():
@@ -82,26 +102,638 @@ def swap_memory():
     data["percent"] = swap.percent
     data["sin"] = swap.sin
     data["sout"] = swap.sout
+    return data
+
+
+Collector = namedtuple("Collector", ["func", "enabled", "static"])
+"""A system stat we can collect.
+
+Attributes:
+
+    func
+        A callable that takes no arguments and returns the stat.
+
+    enabled
+        Whether the stat is collected by default.
+
+    static
+        Whether the stat never changes, so it only needs collecting once.
+
+"""
+
+COLLECTORS = OrderedDict([
+    ("all_pids", Collector(func=all_pids, enabled=False, static=False)),
+    ("cpu_count", Collector(func=cpu_count, enabled=True, static=True)),
+    ("cpu_freq", Collector(func=cpu_freq, enabled=True, static=False)),
+    ("cpu_freq_per_cpu", Collector(
+        func=cpu_freq_per_cpu, enabled=True, static=False)),
+    ("cpu_times", Collector(func=cpu_times, enabled=True, static=False)),
+    ("cpu_times_per_cpu", Collector(
+        func=cpu_times_per_cpu, enabled=True, static=False)),
+    ("cpu_stats", Collector(func=cpu_stats, enabled=True, static=False)),
+    ("virtual_memory", Collector(
+        func=virtual_memory, enabled=True, static=False)),
+    ("swap_memory", Collector(func=swap_memory, enabled=True, static=False)),
+])
+"""The system stats we can collect, by name."""
+
+
+BACKENDS = ["psutil", "procfs", "auto"]
+"""The ways we can collect system stats."""
+
+
+def get_reader(backend=None):
+    """Get a reader for the system stats, for a backend.
+
+    Args:
+
+        backend
+            "psutil" (the default) to collect every stat with psutil,
+            "procfs" to read the stats a ``procfs.Reader`` knows straight
+            from /proc and /sys (and the rest with psutil), or "auto" for
+            "procfs" where it is supported, and "psutil" elsewhere.
+
+    Raises:
+
+        ValueError
+            If the backend is unknown, or not supported here.
+
+    Returns:
+        A ``procfs.Reader``, or ``None`` to collect every stat with
+        psutil.
+
+    """
+    if backend not in BACKENDS + [None]:
+        msg = "Unknown backend: {}. Choose from: {}".format(
+            backend, ", ".join(BACKENDS))
+        raise ValueError(msg)
+    if backend in ["procfs", "auto"]:
+        if procfs.is_supported():
+            return procfs.Reader()
+        elif backend == "procfs":
+            raise ValueError("The procfs backend is not supported here.")
+    return None
+
+
+def get_funcs(reader=None):
+    """Choose the function to collect each system stat with.
+
+    Args:
+
+        reader
+            A ``procfs.Reader`` to read the stats it knows with, as
+            returned by ``get_reader()``, or ``None`` to collect every
+            stat with psutil.
+
+    Returns:
+        An ``OrderedDict`` of ``name -> func``, for each collector.
+
+    """
+    funcs = OrderedDict((name, c.func) for name, c in COLLECTORS.items())
+    if reader is not None:
+        for name in procfs.STATS:
+            funcs[name] = getattr(reader, name)
+    return funcs
+
+
+def get_collectors(spec=None):
+    """Choose which collectors to run, and how often.
+
+    Args:
+
+        spec
+            A comma separated list of changes to the default collectors.
+            Each item is ``NAME`` (collect it every sample), ``NAME=SECS``
+            (collect it at most every ``SECS`` seconds, a finite number
+            above 0), or ``-NAME`` (do not collect it), e.g.,
+            "all_pids,cpu_freq_per_cpu=5,-cpu_stats".
+
+    Raises:
+
+        ValueError
+            If the spec names an unknown collector, or has a bad interval.
+
+    Returns:
+        An ``OrderedDict`` of ``name -> interval`` (in seconds).
+
+    """
+    collectors = OrderedDict(
+        (name, 0) for name, c in COLLECTORS.items() if c.enabled)
+    items = [item.strip() for item in (spec or "").split(",")]
+    for item in [item for item in items if item]:
+        name, _, interval = item.lstrip("-").partition("=")
+        if name not in COLLECTORS:
+            msg = "Unknown collector: {}. Choose from: {}".format(
+                name, ", ".join(COLLECTORS.keys()))
+            raise ValueError(msg)
+        if item.startswith("-"):
+            collectors.pop(name, None)
+        else:
+            collectors[name] = float(interval) if interval else 0
+            secs = collectors[name]
+            if interval and not (math.isfinite(secs) and secs > 0):
+                raise ValueError("Bad interval for {}.".format(name))
+    return collectors
+
+
+class Sampler(object):
+    """Collects system stats, each at its own rate.
+
+    Static stats are collected once, when the sampler is created. Other
+    stats are collected when their interval has passed; in between, the
+    last value collected is reported again.
+
+    One sampler can be shared by many runs, in one thread or several.
+    Give it an ``interval`` so that the runs reuse each other's stats
+    instead of collecting them again each time they sample. Call
+    ``close()`` when done with it, to close the files it keeps open.
+
+    Args:
+
+        collectors
+            An ``OrderedDict`` of ``name -> interval``, as returned by
+            ``get_collectors()``. Default: the default collectors.
+
+        interval
+            The min number of seconds between collections of any stat.
+
+        backend
+            How to collect the stats, as for ``get_reader()``. Default:
+            with psutil.
+
+    """
+
+    def __init__(self, collectors=None, interval=0, backend=None):
+        """Initialize the sampler, and collect the static stats."""
+        if collectors is None:
+            collectors = get_collectors()
+        self.collectors = collectors
+        self.interval = interval
+        self.reader = get_reader(backend)
+        self.funcs = get_funcs(self.reader)
+        self.last_sampled = {}
+        self.lock = Lock()
+        self.data = OrderedDict()
+        for name in self.collectors:
+            if COLLECTORS[name].static:
+                self.data[name] = self.funcs[name]()
+
+    def sample(self, now=None):
+        """Collect the stats that are due.
+
+        Args:
+
+            now
+                The current (monotonic) time. Default: now.
+
+        Returns:
+            A dict of the latest stats, by collector name.
+
+        """
+        if now is None:
+            now = time.monotonic()
+        with self.lock, self.reading():
+            for name, interval in self.collectors.items():
+                if COLLECTORS[name].static:
+                    continue
+                interval = max(interval, self.interval)
+                last_sampled = self.last_sampled.get(name)
+                if last_sampled is None or now - last_sampled >= interval:
+                    self.data[name] = self.funcs[name]()
+                    self.last_sampled[name] = now
+            return dict(self.data)
+
+    def reading(self):
+        """Get a context to collect a sample in.
+
+        With a ``procfs.Reader``, each file is then read once per sample,
+        however many stats come from it.
+
+        """
+        if self.reader is None:
+            return nullcontext()
+        return self.reader.sample()
+
+    def close(self):
+        """Close the files the sampler keeps open, if any.
+
+        The sampler can still be used: they are opened again as needed.
+
+        """
+        with self.lock:
+            if self.reader is not None:
+                self.reader.close()
+
+
+class SharedSampler(Sampler):
+    """Collects system stats in the background, for any number of runs.
+
+    While anything is subscribed, a thread collects the stats every
+    ``interval`` seconds, and each run's ``sample()`` just returns the
+    latest snapshot. So the cost of collecting system stats stays the
+    same however many runs share the sampler; only the per-process stats
+    are collected for each run. Use it as a context manager, or call
+    ``subscribe()`` and ``unsubscribe()``:
+
+        with monitor.SharedSampler() as sampler:
+            ...  # Pass ``sampler`` to each run.
+
+    Args:
+
+        collectors
+            An ``OrderedDict`` of ``name -> interval``, as returned by
+            ``get_collectors()``. Default: the default collectors.
+
+        interval
+            The number of seconds between snapshots. Default:
+            ``constants.SAMPLE_INTERVAL``.
+
+        backend
+            How to collect the stats, as for ``get_reader()``. Default:
+            with psutil.
+
+    """
+
+    def __init__(self, collectors=None, interval=None, backend=None):
+        """Initialize the sampler, and collect the static stats."""
+        if interval is None:
+            interval = constants.SAMPLE_INTERVAL
+        super().__init__(collectors, interval, backend)
+        self.snapshot = None
+        self.error = None
+        self.subscribers = 0
+        self.subscription = Lock()
+        self.stopped = Event()
+        self.thread = None
+
+    def refresh(self):
+        """Take a new snapshot, or keep the error to raise from ``sample()``.
+        """
+        try:
+            self.snapshot = Sampler.sample(self)
+            self.error = None
+        except Exception as error:
+            self.error = error
+
+    def loop(self, stopped):
+        """Take a snapshot every ``interval`` secs, until ``stopped`` is set.
+        """
+        while not stopped.wait(self.interval):
+            self.refresh()
+
+    def subscribe(self):
+        """Start sharing snapshots with one more run.
+
+        The first subscriber takes a snapshot straight away, and starts the
+        background thread.
+
+        Returns:
+            The sampler.
+
+        """
+        with self.subscription:
+            if not self.subscribers:
+                self.refresh()
+                self.stopped = Event()
+                self.thread = Thread(target=self.loop, args=(self.stopped,))
+                self.thread.daemon = True
+                self.thread.start()
+            self.subscribers += 1
+        return self
+
+    def unsubscribe(self):
+        """Stop sharing snapshots with a run.
+
+        When the last subscriber leaves, the background thread stops, and
+        the sampler is closed.
+
+        """
+        with self.subscription:
+            self.subscribers -= 1
+            if not self.subscribers:
+                self.stopped.set()
+                self.thread.join()
+                self.close()
+
+    def __enter__(self):
+        """Subscribe."""
+        return self.subscribe()
+
+    def __exit__(self, *exc_info):
+        """Unsubscribe."""
+        self.unsubscribe()
+
+    def sample(self, now=None):
+        """Get the latest snapshot of the stats.
+
+        Without any subscribers, the stats are collected when asked for,
+        as with a plain ``Sampler``.
 
+        Args:
 
-def collect(log, pid):
-    """Collect stats about a process."""
+            now
+                The current (monotonic) time. Default: now.
+
+        Raises:
+
+            Exception
+                Whatever went wrong taking the latest snapshot.
+
+        Returns:
+            A dict of the latest stats, by collector name.
+
+        """
+        if not self.subscribers:
+            return Sampler.sample(self, now)
+        if self.error is not None:
+            raise self.error
+        return dict(self.snapshot)
+
+
+def memory_info(proc):
+    """Get memory info for a process, with USS if we are allowed it."""
+    data = {}
+    try:
+        mem = proc.memory_full_info()
+        data["uss"] = mem.uss
+    except psutil.AccessDenied:
+        mem = proc.memory_info()
+    data["rss"] = mem.rss
+    data["vms"] = mem.vms
+    return data
+
+
+def io_counters(proc):
+    """Get I/O counters for a process, if we are allowed them."""
+    data = {}
+    try:
+        io = proc.io_counters()
+    except (psutil.AccessDenied, AttributeError):
+        return data
+    data["io_read_count"] = io.read_count
+    data["io_write_count"] = io.write_count
+    data["io_read_bytes"] = io.read_bytes
+    data["io_write_bytes"] = io.write_bytes
+    return data
+
+
+def process_info(proc):
+    """Get stats about a single process.
+
+    Everything is read inside one ``oneshot()`` block, so psutil reads
+    each of the process's /proc files only once.
+
+    Args:
+
+        proc
+            A ``psutil.Process`` instance.
+
+    Returns:
+        A dict of stats.
+
+    """
+    data = {}
+    with proc.oneshot():
+        cpu_times = proc.cpu_times()
+        data["cpu_user"] = cpu_times.user
+        data["cpu_system"] = cpu_times.system
+        data["cpu_children"] = (
+            cpu_times.children_user + cpu_times.children_system)
+        data["cpu_percent"] = proc.cpu_percent()
+        data["num_threads"] = proc.num_threads()
+        data["num_fds"] = proc.num_fds()
+        ctx_switches = proc.num_ctx_switches()
+        data["ctx_switches_voluntary"] = ctx_switches.voluntary
+        data["ctx_switches_involuntary"] = ctx_switches.involuntary
+        data.update(memory_info(proc))
+        data.update(io_counters(proc))
+    return data
+
+
+PROC_CHILDREN = "/proc/{}/task/{}/children"
+"""Where Linux lists the children started by a thread of a process."""
+
+HAS_PROC_CHILDREN = os.path.exists(
+    PROC_CHILDREN.format(os.getpid(), os.getpid()))
+"""Whether this system lists children in ``PROC_CHILDREN`` files."""
+
+
+def read_children(pid):
+    """Get the pids of a process's children, from its ``PROC_CHILDREN``.
+
+    This only reads the process's own files (one per thread), whereas
+    ``psutil.Process.children()`` reads the parent of every process on
+    the system.
+
+    Args:
+
+        pid
+            The pid of the process.
+
+    Raises:
+
+        psutil.NoSuchProcess
+            If the process is gone.
+
+    Returns:
+        A list of pids.
+
+    """
+    try:
+        tids = os.listdir("/proc/{}/task".format(pid))
+    except FileNotFoundError:
+        raise psutil.NoSuchProcess(pid)
+    children = []
+    for tid in tids:
+        try:
+            with open(PROC_CHILDREN.format(pid, tid)) as f:
+                children.extend(int(child) for child in f.read().split())
+        except OSError:
+            continue
+    return children
+
+
+def find_tree(pid, procs):
+    """Find a process and all of its descendants, with psutil.
+
+    Args:
+
+        pid
+            The pid of the root process.
+
+        procs
+            A dict of cached ``psutil.Process`` objects, keyed by pid.
+
+    Returns:
+        A dict of ``psutil.Process`` objects, keyed by pid, root first.
+
+    """
+    try:
+        root = procs.get(pid) or psutil.Process(pid)
+        tree = [root] + root.children(recursive=True)
+    except psutil.NoSuchProcess:
+        tree = []
+
+    current = {}
+    for proc in tree:
+        cached = procs.get(proc.pid)
+        current[proc.pid] = cached if cached == proc else proc
+    return current
+
+
+def scan_tree(pid, procs):
+    """Find a process and all of its descendants, from ``/proc``.
+
+    Only the processes in the tree are read. As in ``find_tree()``, a
+    cached ``psutil.Process`` is only kept if it is still the same
+    process (its pid may have been reused by another one).
+
+    Args:
+
+        pid
+            The pid of the root process.
+
+        procs
+            A dict of cached ``psutil.Process`` objects, keyed by pid.
+
+    Returns:
+        An ``OrderedDict`` of ``psutil.Process`` objects, keyed by pid,
+        root first.
+
+    """
+    current = OrderedDict()
+    queue = [pid]
+    while queue:
+        parent = queue.pop(0)
+        try:
+            children = read_children(parent)
+            proc = psutil.Process(parent)
+        except psutil.NoSuchProcess:
+            continue
+        cached = procs.get(parent)
+        current[parent] = cached if cached == proc else proc
+        queue.extend(children)
+    return current
+
+
+def get_tree(pid, procs):
+    """Get a process and all of its descendants.
+
+    ``psutil.Process`` objects are cached in ``procs`` between calls,
+    because ``cpu_percent()`` measures from the previous call on the
+    same object. Processes that are gone are dropped from the cache.
+
+    On Linux, the tree is found from ``/proc``, by asking each process
+    in it for its children (see ``scan_tree()``). Elsewhere, psutil
+    scans every process on the system for ones whose parent is in it.
+
+    Args:
+
+        pid
+            The pid of the root process.
+
+        procs
+            A dict of cached ``psutil.Process`` objects, keyed by pid.
+
+    Returns:
+        A list of ``psutil.Process`` objects, root first.
+
+    """
+    if HAS_PROC_CHILDREN:
+        current = scan_tree(pid, procs)
+    else:
+        current = find_tree(pid, procs)
+    procs.clear()
+    procs.update(current)
+    return list(current.values())
+
+
+def process_tree_info(pid, procs):
+    """Get stats about a process, summed over it and its descendants.
+
+    Args:
+
+        pid
+            The pid of the root process.
+
+        procs
+            A dict of cached ``psutil.Process`` objects, keyed by pid.
+
+    Returns:
+        A dict of stats, plus the ``pids`` they were summed over.
+
+    """
+    data = {"pids": []}
+    for proc in get_tree(pid, procs):
+        try:
+            info = process_info(proc)
+        except psutil.NoSuchProcess:
+            continue
+        data["pids"].append(proc.pid)
+        for key, value in info.items():
+            data[key] = data.get(key, 0) + value
+    data["num_procs"] = len(data["pids"])
+    return data
+
+
+def serialize(data):
+    """Serialize a record of stats as JSON."""
+    return json.dumps(data, sort_keys=True)
+
+
+def collect(
+        log, pid, procs=None, encode=None, sampler=None, summary=None,
+        history=None, cgroup=None):
+    """Collect stats about a process.
+
+    Args:
+
+        log
+            A callable we can send the stats to.
+
+        pid
+            The pid of the process to collect stats about.
+
+        procs
+            A dict to cache ``psutil.Process`` objects in between calls.
+            Without one, ``cpu_percent`` is always reported as ``0.0``.
+
+        encode
+            A callable that turns the stats into a string for the log.
+            Default: ``serialize()``.
+
+        sampler
+            A ``Sampler`` to collect system stats with. Default: a new
+            ``Sampler`` with the default collectors.
+
+        summary
+            A ``summary.Summary`` to add the stats to, or ``None``. If it
+            only wants the summary, the stats are not sent to the log.
+
+        history
+            A ``history.History`` to add the stats to, or ``None``.
+
+        cgroup
+            A ``cgroup.Cgroup`` the process was started in, or ``None``.
+            Its stats are reported under "cgroup".
+
+    Returns:
+        The stats, as a dict.
+
+    """
     data = {}
 
     data["pid"] = pid
-    data["all_pids"] = psutil.pids()
-
-    data["cpu_count"] = psutil.cpu_count()
-    data["cpu_freq"] = cpu_freq()
-    data["cpu_freq_per_cpu"] = cpu_freq_per_cpu()
-    data["cpu_times"] = cpu_times()
-    data["cpu_times_per_cpu"] = cpu_times_per_cpu()
-    data["cpu_stats"] = cpu_stats()
-    data["cpu_freq"] = cpu_freq()
-    data["cpu_freq_per_cpu"] = cpu_freq_per_cpu()
-
-    data["virtual_memory"] = virtual_memory()
-    data["swap_memory"] = swap_memory()
-
-    serialized_data = json.dumps(data, sort_keys=True)
-    log(serialized_data)
+    data["process"] = process_tree_info(pid, {} if procs is None else procs)
+    if cgroup is not None:
+        data["cgroup"] = cgroup.stats()
+    data.update((sampler or Sampler()).sample())
+
+    if summary is None or summary.samples:
+        serialized_data = (encode or serialize)(data)
+        log(serialized_data)
+    if summary is not None:
+        summary.add(data)
+    if history is not None:
+        history.add(data)
+    return data
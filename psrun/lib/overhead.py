@@ -0,0 +1,95 @@
+"""Utilities for measuring what it costs psrun to run a process."""
+
+import time
+
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+def to_ms(secs):
+    """Convert seconds to whole milliseconds."""
+    return int(secs * 1000)
+
+
+class Overhead(object):
+    """Keeps track of the work psrun does while it runs a process.
+
+    This separates what the supervisor costs from what the process
+    costs: psrun's own CPU time, the time it spends on each kind of work
+    (and how many times it did it), and how much output it forwarded.
+
+    NB: The CPU time is for the whole psrun process, including its reader
+    threads, and any other runs in the same process.
+
+    Args:
+
+        cpu_time
+            Whether to report psrun's CPU time. Leave it out where other
+            runs share the process (e.g., in a batch), as it would not
+            belong to this run alone. Default: True.
+
+    """
+
+    def __init__(self, cpu_time=True):
+        """Start measuring."""
+        self.cpu_time = cpu_time
+        self.cpu_start = time.process_time()
+        self.secs = OrderedDict()
+        self.calls = OrderedDict()
+        self.lines = OrderedDict()
+        self.bytes = OrderedDict()
+
+    @contextmanager
+    def timer(self, name):
+        """Time some work, and add it to the total for its kind.
+
+        Args:
+
+            name
+                The kind of work, e.g., "Sampling".
+
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            secs = time.perf_counter() - start
+            self.secs[name] = self.secs.get(name, 0) + secs
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def count(self, name, num_lines, num_bytes):
+        """Count lines forwarded from a stream.
+
+        Args:
+
+            name
+                The name of the stream, e.g., "stdout".
+
+            num_lines
+                The number of lines forwarded.
+
+            num_bytes
+                The number of bytes in them.
+
+        """
+        self.lines[name] = self.lines.get(name, 0) + num_lines
+        self.bytes[name] = self.bytes.get(name, 0) + num_bytes
+
+    def get_details(self):
+        """Get the measurements, as details worth reporting.
+
+        Returns:
+            An ``OrderedDict`` of details.
+
+        """
+        details = OrderedDict()
+        if self.cpu_time:
+            cpu_time = time.process_time() - self.cpu_start
+            details["Psrun CPU time"] = "{}ms".format(to_ms(cpu_time))
+        for name, secs in self.secs.items():
+            details[name] = "{}ms ({} times)".format(
+                to_ms(secs), self.calls[name])
+        for name, num_lines in self.lines.items():
+            details["Forwarded {}".format(name)] = "{} lines, {} bytes".format(
+                num_lines, self.bytes[name])
+        return details
@@ -1,18 +1,27 @@
 """Utilities for executing a process."""
 
-import datetime
 import json
+import os
+import selectors
+import socket
 import subprocess
 import sys
 import time
 
+from collections import OrderedDict
+
+from . import adaptive
 from . import constants
 from . import exceptions
+from . import limits
 from . import monitor
+from . import overhead as overhead_lib
 from . import stream
 
 
-def try_monitor(log, pid):
+def try_monitor(
+        log, pid, procs=None, encode=None, sampler=None, summary=None,
+        history=None, cgroup=None):
     """Try to monitor a process, or report the error.
 
     Args:
@@ -23,19 +32,46 @@ def try_monitor(log, pid):
         pid
             The pid of a process to monitor.
 
+        procs
+            A dict the monitor can cache process objects in.
+
+        encode
+            A callable the monitor can serialize stats with.
+
+        sampler
+            A ``monitor.Sampler`` to collect system stats with.
+
+        summary
+            A ``summary.Summary`` to add the stats to, or ``None``.
+
+        history
+            A ``history.History`` to add the stats to, or ``None``.
+
+        cgroup
+            A ``cgroup.Cgroup`` the process was started in, or ``None``.
+
+    Returns:
+        The stats, as returned by ``monitor.collect()``, or ``None`` if
+        there was an error.
+
     """
     try:
-        monitor.collect(log, pid)
+        return monitor.collect(
+            log, pid, procs, encode, sampler, summary, history, cgroup)
     except:  # noqa: E722
         exc_type, exc_val, exc_tb = sys.exc_info()
         err_msg = "Error - {}: {}".format(exc_type.__name__, exc_val)
         data = {"pid": pid, "error": err_msg}
         log(json.dumps(data, sort_keys=True))
+        return None
 
 
 def read_buffer(buf, log):
     """Read all available lines from a buffer.
 
+    Bytes that are not valid UTF-8 are replaced with U+FFFD, so a
+    command that writes binary output does not stop the run.
+
     Args:
 
         buf
@@ -44,18 +80,70 @@ def read_buffer(buf, log):
         log
             A callable we can send each popped line to.
 
+    Returns:
+        A tuple ``num_lines, num_bytes`` of what was read.
+
     """
+    num_lines = 0
+    num_bytes = 0
     read_again = True
     while read_again:
         data = stream.pop(buf)
         if data:
-            decoded_data = data.decode("utf8").rstrip()
+            decoded_data = data.decode("utf8", errors="replace").rstrip()
             log(decoded_data)
+            num_lines += 1
+            num_bytes += len(data)
         else:
             read_again = False
+    return num_lines, num_bytes
+
+
+def read_buffers(buffers, overhead):
+    """Read all available lines from each buffer, and count them.
+
+    Args:
+
+        buffers
+            The ``(name, buffer, log)`` list returned by ``watch()``.
+
+        overhead
+            An ``overhead.Overhead`` to count the lines, and time the
+            reading, with.
+
+    """
+    with overhead.timer("Reading output"):
+        for name, buf, log in buffers:
+            overhead.count(name, *read_buffer(buf, log))
+
+
+def format_cmd(cmd):
+    """Format a command (a string, or a list of args) for a message."""
+    if isinstance(cmd, str):
+        return cmd
+    return " ".join(cmd)
+
+
+def get_target(dest):
+    """Get where a process should write one of its output streams.
+
+    Args:
+
+        dest
+            Where the output is going: a ``stream.Redirect``, or anything
+            else that ``execute()`` takes for ``out`` or ``err``.
+
+    Returns:
+        The redirect's file descriptor, or ``subprocess.PIPE``.
+
+    """
+    if isinstance(dest, stream.Redirect):
+        return dest.fd
+    return subprocess.PIPE
 
 
-def start(cmd):
+def start(
+        cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cgroup=None):
     """Start a process.
 
     Args:
@@ -63,6 +151,17 @@ def start(cmd):
         cmd
             A command to execute in the process, e.g., ["ls", "-la"].
 
+        stdout
+            Where the process should write its stdout: a pipe, or a file
+            descriptor.
+
+        stderr
+            Where the process should write its stderr: a pipe, or a file
+            descriptor.
+
+        cgroup
+            A ``cgroup.Cgroup`` to start the process in, or ``None``.
+
     Raises:
 
         exceptions.PermissionDenied
@@ -73,10 +172,14 @@ def start(cmd):
 
     """
     try:
-        p = subprocess.Popen(
-            cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    except PermissionError as e:
-        msg = "Permission denied. Cannot execute: {}".format(" ".join(cmd))
+        if cgroup is None:
+            p = subprocess.Popen(
+                cmd, shell=True, stdout=stdout, stderr=stderr)
+        else:
+            p = subprocess.Popen(
+                cgroup.wrap(cmd), stdout=stdout, stderr=stderr)
+    except PermissionError:
+        msg = "Permission denied. Cannot execute: {}".format(format_cmd(cmd))
         raise exceptions.PermissionDenied(msg)
     return p
 
@@ -96,26 +199,111 @@ def stop(p, shutdown):
         The exit code.
 
     """
-    elapsed_time = 0
     p.terminate()
+    try:
+        return p.wait(shutdown or None)
+    except subprocess.TimeoutExpired:
+        p.kill()
+        return p.wait()
 
-    do_again = True
-    while do_again:
-        if shutdown and elapsed_time > shutdown:
-            p.kill()
-            do_again = False
-        else:
-            exit_code = p.poll()
-            do_again = exit_code is None
-            time.sleep(constants.POLL_DELAY)
-            elapsed_time = elapsed_time + constants.POLL_DELAY
 
-    exit_code = p.poll()
-    return exit_code
+def reap(p):
+    """Reap a process if it has exited, and get its resource usage.
+
+    This does what ``p.poll()`` does, but with ``os.wait4()``, so the
+    kernel also tells us what the process (and any descendants it waited
+    for) used. Once the process is reaped, ``p.returncode`` is set, and
+    it is never waited for again (its pid may belong to another process
+    by then).
+
+    Args:
+
+        p
+            A ``subprocess.Popen`` instance.
+
+    Returns:
+        A ``resource.struct_rusage``, or ``None`` if the process is still
+        running, or was already reaped (by this or some other way).
+
+    """
+    if p.returncode is not None:
+        return None
+    try:
+        pid, status, rusage = os.wait4(p.pid, os.WNOHANG)
+    except ChildProcessError:
+        # Reaped some other way, so the exit code is lost. Like
+        # ``p.poll()``, assume it was 0.
+        p.returncode = 0
+        return None
+    if not pid:
+        return None
+    p.returncode = os.waitstatus_to_exitcode(status)
+    return rusage
+
+
+def get_rusage_details(rusage):
+    """Get details worth reporting about a process's resource usage.
+
+    The ``ru_maxrss`` is left out. The process is forked from psrun, so
+    it is no lower than psrun's own RSS when it forked, whatever the
+    process itself went on to use.
+
+    Args:
+
+        rusage
+            A ``resource.struct_rusage``, as returned by ``reap()``, or
+            ``None``.
+
+    Returns:
+        An ``OrderedDict`` of details to report.
+
+    """
+    details = OrderedDict()
+    if rusage is None:
+        return details
+    details["Child CPU time"] = "{}ms user, {}ms system".format(
+        overhead_lib.to_ms(rusage.ru_utime),
+        overhead_lib.to_ms(rusage.ru_stime))
+    details["Child page faults"] = "{} major, {} minor".format(
+        rusage.ru_majflt, rusage.ru_minflt)
+    details["Child context switches"] = "{} voluntary, {} involuntary".format(
+        rusage.ru_nvcsw, rusage.ru_nivcsw)
+    return details
+
+
+def get_cgroup_details(cgroup):
+    """Get details worth reporting about what a cgroup used.
+
+    Args:
+
+        cgroup
+            A ``cgroup.Cgroup``, or ``None``.
 
+    Returns:
+        An ``OrderedDict`` of details to report.
 
-def do_again(p):
-    """Check if we should poll again.
+    """
+    details = OrderedDict()
+    if cgroup is None:
+        return details
+    stats = cgroup.stats()
+    if "cpu_user" in stats:
+        details["Cgroup CPU time"] = "{}ms user, {}ms system".format(
+            overhead_lib.to_ms(stats["cpu_user"]),
+            overhead_lib.to_ms(stats["cpu_system"]))
+    if "memory_peak" in stats:
+        details["Cgroup peak memory"] = "{} KiB".format(
+            stats["memory_peak"] // 1024)
+    if "io_read_bytes" in stats:
+        details["Cgroup I/O"] = "{} bytes read, {} bytes written".format(
+            stats["io_read_bytes"], stats["io_write_bytes"])
+    for name, error in sorted(cgroup.errors.items()):
+        details["Cgroup {} controller".format(name)] = error
+    return details
+
+
+def open_exit_fd(p):
+    """Open a file descriptor that becomes readable when a process exits.
 
     Args:
 
@@ -123,28 +311,244 @@ def do_again(p):
             A ``subprocess.Popen`` instance.
 
     Returns:
-        ``True`` if we don't have an exit code yet. ``False`` otherwise.
+        A pidfd, or ``None`` if the platform does not support them.
+
+    """
+    try:
+        return os.pidfd_open(p.pid)
+    except (AttributeError, OSError):
+        return None
+
+
+def get_notifier(sock):
+    """Return a function that wakes up whoever is selecting on a socket.
+
+    Args:
+
+        sock
+            The writing end of a non-blocking ``socket.socketpair()``.
+
+    Returns:
+        A callable that takes no arguments.
+
     """
-    exit_code = p.poll()
-    return exit_code is None
+    def notify():
+        try:
+            sock.send(b"\0")
+        except OSError:
+            # The socket is full (a wakeup is already pending),
+            # or it has been closed (nobody is listening any more).
+            pass
+    return notify
 
 
-def pause(p, elapsed_time):
-    """Pause for a bit and increment the elapsed time.
+def drain(sock):
+    """Read and discard everything waiting on a non-blocking socket.
+
+    Args:
+
+        sock
+            The reading end of a non-blocking ``socket.socketpair()``.
+
+    """
+    try:
+        while sock.recv(4096):
+            pass
+    except BlockingIOError:
+        pass
+
+
+def watch(p, out, err, buffer_size=0, buffer_policy=stream.BLOCK):
+    """Start watching a process for output and for its exit.
+
+    The process's stdout and stderr are read in threads (unless they
+    were redirected, so there is nothing to read). In line mode, the
+    threads wake up the selector whenever they have put new lines on
+    their buffers. In raw mode, they copy bytes straight to their file
+    descriptor, and only wake up the selector when they are done. If the
+    platform supports pidfds, the selector is also woken up the instant
+    the process exits.
 
     Args:
 
         p
             A ``subprocess.Popen`` instance.
 
-        elapsed_time
-            The number of seconds elapsed since the process started.
+        out
+            A callable for each line of stdout, or a file descriptor to
+            copy stdout to as raw bytes.
+
+        err
+            A callable for each line of stderr, or a file descriptor to
+            copy stderr to as raw bytes.
+
+        buffer_size
+            The max number of lines to buffer per stream, or ``0``.
+
+        buffer_policy
+            What to do when a buffer is full. See ``stream.POLICIES``.
+
+    Returns:
+        A tuple ``selector, exit_fd, buffers``, where ``buffers`` is a list
+        of ``(name, buffer, log)`` to read lines from in line mode.
+
+    """
+    receiver, sender = socket.socketpair()
+    receiver.setblocking(False)
+    sender.setblocking(False)
+    notify = get_notifier(sender)
+
+    selector = selectors.DefaultSelector()
+    selector.register(receiver, selectors.EVENT_READ, sender)
+    exit_fd = open_exit_fd(p)
+    if exit_fd is not None:
+        selector.register(exit_fd, selectors.EVENT_READ)
+
+    buffers = []
+    streams = [("stdout", p.stdout, out), ("stderr", p.stderr, err)]
+    for name, pipe, dest in streams:
+        if pipe is None:
+            continue
+        elif isinstance(dest, int):
+            stream.forward(pipe, dest, notify)
+        else:
+            buf = stream.read(pipe, notify, buffer_size, buffer_policy)
+            buffers.append((name, buf, dest))
+    return selector, exit_fd, buffers
+
+
+def unwatch(selector, exit_fd):
+    """Stop watching a process, and release what ``watch()`` opened.
+
+    Args:
+
+        selector
+            The selector returned by ``watch()``.
+
+        exit_fd
+            The pidfd returned by ``watch()``, or ``None``.
+
+    """
+    for key in list(selector.get_map().values()):
+        selector.unregister(key.fileobj)
+        if key.data:
+            key.fileobj.close()
+            key.data.close()
+    selector.close()
+    if exit_fd is not None:
+        os.close(exit_fd)
+
+
+def wait(selector, timeout):
+    """Block until there is output, the process exits, or time runs out.
+
+    Args:
+
+        selector
+            The selector returned by ``watch()``.
+
+        timeout
+            The max number of seconds to block for.
+
+    """
+    for key, _ in selector.select(timeout):
+        if key.data:
+            drain(key.fileobj)
+
+
+def get_details(buffers, overhead=None, rusage=None):
+    """Get details worth reporting about how a process's output was read.
+
+    Args:
+
+        buffers
+            The ``(name, buffer, log)`` list returned by ``watch()``.
+
+        overhead
+            An optional ``overhead.Overhead``, to report on too.
+
+        rusage
+            The process's resource usage, as returned by ``reap()``, to
+            report on too, or ``None``.
+
+    Returns:
+        An ``OrderedDict`` of details to report.
+
+    """
+    details = get_rusage_details(rusage)
+    if overhead is not None:
+        details.update(overhead.get_details())
+    for name, buf, _ in buffers:
+        details["Max buffered {}".format(name)] = "{} lines".format(
+            buf.high_water)
+        if buf.policy != stream.BLOCK:
+            details["Dropped {}".format(name)] = "{} lines, {} bytes".format(
+                buf.dropped_lines, buf.dropped_bytes)
+    return details
+
+
+def wait_for_eof(selector, streams, buffers=(), overhead=None):
+    """Give the reader threads a chance to read the last of the output.
+
+    A process can exit before its reader threads have read everything
+    it wrote. Wait (at most ``constants.EOF_TIMEOUT`` secs, in case some
+    other process holds the pipes open) for them to reach the end. Keep
+    reading the buffers meanwhile, in case a reader is waiting for room.
+
+    Args:
+
+        selector
+            The selector returned by ``watch()``.
+
+        streams
+            The streams being read, which are closed when exhausted.
+
+        buffers
+            The ``(name, buffer, log)`` list returned by ``watch()``.
+
+        overhead
+            An ``overhead.Overhead`` to count the lines read with.
+
+    """
+    if overhead is None:
+        overhead = overhead_lib.Overhead()
+    deadline = time.monotonic() + constants.EOF_TIMEOUT
+    while not all(s.closed for s in streams):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        read_buffers(buffers, overhead)
+        wait(selector, remaining)
+
+
+def get_wait_time(now, next_sample, deadline, exit_fd):
+    """Compute how long the supervisor can block for.
+
+    Args:
+
+        now
+            The current (monotonic) time.
+
+        next_sample
+            The (monotonic) time the next sample is due.
+
+        deadline
+            The (monotonic) time the process times out, or ``None``.
+
+        exit_fd
+            A pidfd for the process, or ``None``. Without one, the
+            process must be polled every ``constants.POLL_DELAY`` secs.
 
     Returns:
-        The incremented elapsed time.
+        The number of seconds to block for.
+
     """
-    time.sleep(constants.POLL_DELAY)
-    return elapsed_time + constants.POLL_DELAY
+    wake_times = [next_sample]
+    if deadline is not None:
+        wake_times.append(deadline)
+    if exit_fd is None:
+        wake_times.append(now + constants.POLL_DELAY)
+    return max(min(wake_times) - now, 0)
 
 
 def raise_if_timeout(p, timeout, shutdown, elapsed_time, cmd):
@@ -175,19 +579,176 @@ def raise_if_timeout(p, timeout, shutdown, elapsed_time, cmd):
     """
     if timeout and elapsed_time > timeout:
         stop(p, shutdown)
-        cmd_str = " ".join(cmd)
+        cmd_str = format_cmd(cmd)
         msg = "Timed out after {} secs: {}".format(timeout, cmd_str)
         raise exceptions.ProcTimeout(msg)
 
 
+def get_rss(data):
+    """Get the RSS of a process tree from its stats, if it has any.
+
+    Args:
+
+        data
+            The stats, as returned by ``try_monitor()``, or ``None``.
+
+    Returns:
+        The RSS (in bytes), or ``None``.
+
+    """
+    if data is None:
+        return None
+    return data.get("process", {}).get("rss")
+
+
+def check_rss(rss, max_rss, cmd):
+    """Raise an error if a process tree uses more RSS than it is allowed.
+
+    Args:
+
+        rss
+            The RSS of the process tree (in bytes), or ``None``.
+
+        max_rss
+            The max number of bytes of RSS, or ``None``.
+
+        cmd
+            The command executed in the process, e.g., ["ls", "-la"].
+
+    Raises:
+
+        exceptions.ProcMaxRss
+            If the process tree uses more than ``max_rss``.
+
+    """
+    if max_rss and rss is not None and rss > max_rss:
+        msg = "Used {} bytes of RSS, over the max of {}: {}".format(
+            rss, max_rss, format_cmd(cmd))
+        raise exceptions.ProcMaxRss(msg)
+
+
+def raise_if_over_max_rss(p, max_rss, shutdown, rss, cmd):
+    """Stop the process, and raise an error, if it uses too much RSS.
+
+    Args:
+
+        p
+            A ``subprocess.Popen`` instance.
+
+        max_rss
+            The max number of bytes of RSS, or ``None``.
+
+        shutdown
+            The number of seconds to let a process shutdown.
+
+        rss
+            The RSS of the process tree (in bytes), or ``None``.
+
+        cmd
+            The command executed in the process, e.g., ["ls", "-la"].
+
+    Raises:
+
+        exceptions.ProcMaxRss
+            If the process tree uses more than ``max_rss``.
+
+    """
+    try:
+        check_rss(rss, max_rss, cmd)
+    except exceptions.ProcMaxRss:
+        stop(p, shutdown)
+        raise
+
+
+def raise_if_stuck(p, watchdog, shutdown, data, output, cmd):
+    """Stop the process, and raise an error, if it is stuck or too busy.
+
+    Args:
+
+        p
+            A ``subprocess.Popen`` instance.
+
+        watchdog
+            A ``limits.Watchdog`` to check the stats with.
+
+        shutdown
+            The number of seconds to let a process shutdown.
+
+        data
+            The stats, as returned by ``try_monitor()``, or ``None``.
+
+        output
+            The number of lines of output forwarded so far.
+
+        cmd
+            The command executed in the process, e.g., ["ls", "-la"].
+
+    Raises:
+
+        exceptions.ProcTimeout
+            If the process tree used more than its CPU budget, or was
+            idle for too long.
+
+    """
+    reason = watchdog.check(data, output)
+    if reason is not None:
+        stop(p, shutdown)
+        msg = "{}: {}".format(reason, format_cmd(cmd))
+        raise exceptions.ProcTimeout(msg)
+
+
+def get_max_sample_interval(
+        sample_interval, max_sample_interval, max_rss=None,
+        cpu_timeout=None, idle_timeout=None):
+    """Get the most secs to wait between samples, given the limits.
+
+    The limits are only checked when the process is sampled, so the
+    interval must not back off past them: with ``max_rss``, the process
+    is sampled every ``sample_interval`` (its RSS can jump at any time),
+    and with ``cpu_timeout`` or ``idle_timeout``, at least twice per
+    timeout.
+
+    Args:
+
+        sample_interval
+            The number of seconds between samples at first.
+
+        max_sample_interval
+            The most secs to wait between samples while the process is
+            steady, or ``None`` to always wait ``sample_interval``.
+
+        max_rss
+            The max number of bytes of RSS, or ``None``.
+
+        cpu_timeout
+            The number of CPU seconds the process tree can use, or
+            ``None``.
+
+        idle_timeout
+            The number of seconds the process tree can be idle for, or
+            ``None``.
+
+    Returns:
+        The most secs to wait, for ``adaptive.Interval``, or ``None``.
+
+    """
+    if max_sample_interval is None:
+        return None
+    if max_rss is not None:
+        return sample_interval
+    caps = [secs / 2 for secs in [cpu_timeout, idle_timeout] if secs]
+    return min([max_sample_interval] + caps)
+
+
 def start_timing():
     """Start timing.
 
     Returns:
-        The time this function was invoked.
+        The time this function was invoked, from a monotonic clock
+        (in nanoseconds).
 
     """
-    start_time = datetime.datetime.now()
+    start_time = time.perf_counter_ns()
     return start_time
 
 
@@ -200,14 +761,18 @@ def stop_timing(start_time):
             The time the process started.
 
     Returns:
-        The running time (in milliseconds).
+        The running time (in milliseconds, to the microsecond).
     """
-    end_time = datetime.datetime.now()
-    total_seconds = (end_time - start_time).total_seconds()
-    return int(total_seconds * 1000)
+    end_time = time.perf_counter_ns()
+    return round((end_time - start_time) / 1e6, 3)
 
 
-def execute(cmd, out, err, ps, timeout, shutdown):
+def execute(
+        cmd, out, err, ps, timeout, shutdown, ps_encode=None,
+        collectors=None, sample_interval=None, buffer_size=0,
+        buffer_policy=stream.BLOCK, sampler=None, summary=None,
+        history=None, cgroup=None, max_sample_interval=None,
+        max_rss=None, cpu_timeout=None, idle_timeout=None):
     """Execute a command.
 
     Args:
@@ -216,10 +781,14 @@ def execute(cmd, out, err, ps, timeout, shutdown):
             A command to execute in the process, e.g., ["ls", "-la"].
 
         out
-            A callable we can pass each line of stdout to.
+            A callable we can pass each line of stdout to, a file
+            descriptor to copy stdout to as raw bytes, or a
+            ``stream.Redirect`` for the process to write stdout to itself.
 
         err
-            A callable we can pass each line of stderr to.
+            A callable we can pass each line of stderr to, a file
+            descriptor to copy stderr to as raw bytes, or a
+            ``stream.Redirect`` for the process to write stderr to itself.
 
         ps
             A callable we can pass stats about the proc to.
@@ -230,32 +799,147 @@ def execute(cmd, out, err, ps, timeout, shutdown):
         shutdown
             The number of seconds to let a process shutdown.
 
-    Returns:
-        A tuple ``exit_code, running_time``.
+        ps_encode
+            A callable to serialize stats about the proc with, or ``None``
+            for ``monitor.serialize()``.
 
-    """
-    elapsed_time = 0
-    start_time = start_timing()
+        collectors
+            The system stats to collect, as returned by
+            ``monitor.get_collectors()``, or ``None`` for the defaults.
+
+        sample_interval
+            The number of seconds between samples of stats about the proc,
+            or ``None`` for ``constants.SAMPLE_INTERVAL``. Output is
+            forwarded as it arrives, regardless of this interval.
+
+        buffer_size
+            The max number of lines of stdout/stderr to hold in memory
+            before they are logged, or ``0`` for no limit.
+
+        buffer_policy
+            What to do when a buffer is full. See ``stream.POLICIES``.
 
-    p = start(cmd)
+        sampler
+            A ``monitor.Sampler`` to collect system stats with, e.g., a
+            ``monitor.SharedSampler`` shared with other runs. Default: a
+            new one, for ``collectors``.
 
-    stdout_buf = stream.read(p.stdout)
-    stderr_buf = stream.read(p.stderr)
+        summary
+            A ``summary.Summary`` to add the stats about the proc to, or
+            ``None``.
 
-    while do_again(p):
+        history
+            A ``history.History`` to add the stats about the proc to, or
+            ``None``.
 
-        read_buffer(stdout_buf, out)
-        read_buffer(stderr_buf, err)
-        try_monitor(ps, p.pid)
+        cgroup
+            A ``cgroup.Cgroup`` to start the process in, and collect stats
+            about the whole process tree from, or ``None``.
 
-        elapsed_time = pause(p, elapsed_time)
+        max_sample_interval
+            The most secs to wait between samples while the proc's stats
+            are steady (see ``adaptive.Interval``), or ``None`` to always
+            wait ``sample_interval``. It is capped while there are limits
+            to check (see ``get_max_sample_interval()``).
 
-        raise_if_timeout(p, timeout, shutdown, elapsed_time, cmd)
+        max_rss
+            The max number of bytes of RSS the process tree can use, as
+            of any sample, or ``None``.
 
-    read_buffer(stdout_buf, out)
-    read_buffer(stderr_buf, err)
-    try_monitor(ps, p.pid)
+        cpu_timeout
+            The number of CPU seconds the process tree can use, or
+            ``None``. See ``limits``.
+
+        idle_timeout
+            The number of seconds the process tree can go without using
+            CPU or writing anything, or ``None``. See ``limits``.
+
+    Raises:
+
+        exceptions.ProcTimeout
+            If the process times out, uses more than ``cpu_timeout``, or
+            is idle for more than ``idle_timeout``.
+
+        exceptions.ProcMaxRss
+            If the process tree uses more than ``max_rss``.
+
+        exceptions.CgroupUnavailable
+            If the process could not move into ``cgroup``.
+
+    Returns:
+        A tuple ``exit_code, running_time, details``, where ``details`` is
+        an ``OrderedDict`` of anything else worth reporting, including
+        what it cost psrun to run the process, and the max RSS of the
+        process tree in any sample.
+
+    """
+    if sampler is None:
+        sampler = monitor.Sampler(collectors)
+    if sample_interval is None:
+        sample_interval = constants.SAMPLE_INTERVAL
+    max_sample_interval = get_max_sample_interval(
+        sample_interval, max_sample_interval, max_rss, cpu_timeout,
+        idle_timeout)
+    interval = adaptive.Interval(sample_interval, max_sample_interval)
+    start_time = start_timing()
+    overhead = overhead_lib.Overhead()
+
+    p = start(cmd, get_target(out), get_target(err), cgroup)
+    limits.set_cpu_limit(
+        p.pid, cpu_timeout, shutdown, max_sample_interval or sample_interval)
+    selector, exit_fd, buffers = watch(
+        p, out, err, buffer_size, buffer_policy)
+
+    try:
+        started = time.monotonic()
+        deadline = started + timeout if timeout else None
+        next_sample = started
+        procs = {}
+        peak_rss = 0
+        watchdog = limits.Watchdog(cpu_timeout, idle_timeout, started)
+
+        rusage = reap(p)
+        while p.returncode is None:
+
+            read_buffers(buffers, overhead)
+
+            now = time.monotonic()
+            if now >= next_sample:
+                with overhead.timer("Sampling"):
+                    data = try_monitor(
+                        ps, p.pid, procs, ps_encode, sampler, summary,
+                        history, cgroup)
+                next_sample = now + interval.next(data)
+                rss = get_rss(data)
+                peak_rss = max(peak_rss, rss or 0)
+                raise_if_over_max_rss(p, max_rss, shutdown, rss, cmd)
+                raise_if_stuck(
+                    p, watchdog, shutdown, data,
+                    sum(overhead.lines.values()), cmd)
+
+            raise_if_timeout(p, timeout, shutdown, now - started, cmd)
+
+            wait(selector, get_wait_time(now, next_sample, deadline, exit_fd))
+            rusage = reap(p)
+
+        if exit_fd is not None:
+            # The pidfd stays readable once the process has exited.
+            selector.unregister(exit_fd)
+        pipes = [pipe for pipe in [p.stdout, p.stderr] if pipe is not None]
+        wait_for_eof(selector, pipes, buffers, overhead)
+        read_buffers(buffers, overhead)
+        with overhead.timer("Sampling"):
+            try_monitor(
+                ps, p.pid, procs, ps_encode, sampler, summary, history,
+                cgroup)
+    finally:
+        unwatch(selector, exit_fd)
 
     running_time = stop_timing(start_time)
-    exit_code = p.poll()
-    return exit_code, running_time
+    exit_code = p.returncode
+    if cgroup is not None:
+        cgroup.check_joined(exit_code)
+    details = get_details(buffers, overhead, rusage)
+    details["Max sampled RSS"] = "{} KiB".format(peak_rss // 1024)
+    details.update(get_cgroup_details(cgroup))
+    return exit_code, running_time, details
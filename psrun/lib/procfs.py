@@ -0,0 +1,287 @@
+"""Read system stats straight from /proc and /sys (Linux only).
+
+psutil opens and parses a file (or several) from scratch each time it is
+asked for a stat. A ``Reader`` instead keeps each file it needs open, and
+re-reads it with ``os.preadv()`` into a buffer that it keeps from one
+sample to the next, and parses only the fields that ``monitor`` reports.
+
+The stats are the same as the psutil collectors' in ``monitor``, in the
+same units. Use them with ``monitor.Sampler(backend="procfs")``, which
+collects each sample in a ``Reader.sample()``, so that a file several
+stats come from (e.g., /proc/stat) is only read once per sample.
+
+"""
+
+import glob
+import os
+
+from contextlib import contextmanager
+
+STAT = "/proc/stat"
+MEMINFO = "/proc/meminfo"
+VMSTAT = "/proc/vmstat"
+CPUINFO = "/proc/cpuinfo"
+CPUFREQ = "/sys/devices/system/cpu/cpufreq/policy[0-9]*"
+
+BUFFER_SIZE = 4096
+"""The initial size of a file's buffer. It doubles until the file fits."""
+
+SWAP_PAGE_SIZE = 4096
+"""Num bytes per page swapped in or out, as psutil counts them."""
+
+STATS = [
+    "cpu_freq", "cpu_freq_per_cpu", "cpu_times", "cpu_times_per_cpu",
+    "cpu_stats", "virtual_memory", "swap_memory"]
+"""The names of the ``monitor`` collectors that a ``Reader`` provides."""
+
+
+def is_supported():
+    """Check if this system has the /proc files that a ``Reader`` needs."""
+    try:
+        with open(MEMINFO, "rb") as f:
+            return b"MemAvailable:" in f.read() and os.path.exists(STAT)
+    except OSError:
+        return False
+
+
+def find_line(buffer, end, key, start=0):
+    """Find the next line that starts with ``key``.
+
+    Args:
+
+        buffer
+            The contents of a file.
+
+        end
+            The length of the contents.
+
+        key
+            The bytes the line starts with, e.g., b"MemTotal:".
+
+        start
+            Where in the contents to start looking.
+
+    Returns:
+        A tuple ``fields, position``: the fields of the line (split on
+        whitespace, starting with the key), and where the line ends. If
+        there is no such line, ``fields`` is ``None``.
+
+    """
+    i = buffer.find(key, start, end)
+    while i > 0 and buffer[i - 1] != ord("\n"):
+        i = buffer.find(key, i + 1, end)
+    if i < 0:
+        return None, end
+    j = buffer.find(b"\n", i, end)
+    if j < 0:
+        j = end
+    return buffer[i:j].split(), j
+
+
+def get_field(buffer, end, key, default=None):
+    """Get the number that follows ``key`` at the start of a line.
+
+    Returns:
+        The number, as an int, or ``default`` if there is no such line.
+
+    """
+    fields, _ = find_line(buffer, end, key)
+    if fields is None:
+        return default
+    return int(fields[1])
+
+
+class File(object):
+    """A file that is kept open, and read again from the start on demand.
+
+    Args:
+
+        path
+            The path of the file.
+
+    """
+
+    def __init__(self, path):
+        """Open the file."""
+        self.file = open(path, "rb", buffering=0)
+        self.buffer = bytearray(BUFFER_SIZE)
+
+    def read(self):
+        """Read the whole file again, into ``buffer``.
+
+        Returns:
+            The length of the contents, at the start of ``buffer``.
+
+        """
+        while True:
+            length = os.preadv(self.file.fileno(), [self.buffer], 0)
+            if length < len(self.buffer):
+                return length
+            self.buffer = bytearray(len(self.buffer) * 2)
+
+    def close(self):
+        """Close the file."""
+        self.file.close()
+
+
+class Reader(object):
+    """Reads system stats from /proc and /sys, keeping the files open.
+
+    Each file is opened the first time it is needed. A reader is not
+    thread safe: a ``monitor.Sampler`` only uses its reader while it holds
+    its lock.
+
+    """
+
+    def __init__(self):
+        """Initialize the reader."""
+        self.clock_ticks = os.sysconf("SC_CLK_TCK")
+        self.files = {}
+        self.lengths = None
+        self.policies = None
+
+    def close(self):
+        """Close the files. They are opened again if they are read again.
+        """
+        while self.files:
+            _, f = self.files.popitem()
+            f.close()
+        if self.lengths is not None:
+            self.lengths.clear()
+
+    @contextmanager
+    def sample(self):
+        """Read each file at most once, while in this context.
+
+        Several stats come from one file: /proc/stat has the CPU times
+        (in total and per CPU) and the CPU stats, and /proc/meminfo has
+        the virtual and swap memory. Collect them in one ``sample()``,
+        and each is parsed from the same read of the file.
+
+        """
+        self.lengths = {}
+        try:
+            yield self
+        finally:
+            self.lengths = None
+
+    def read(self, path):
+        """Read a file again, opening it the first time.
+
+        In a ``sample()``, a file that was read already is not read again.
+
+        Returns:
+            A tuple ``buffer, length``, as for ``find_line()``.
+
+        """
+        f = self.files.get(path)
+        if f is None:
+            f = self.files[path] = File(path)
+        if self.lengths is None:
+            return f.buffer, f.read()
+        if path not in self.lengths:
+            self.lengths[path] = f.read()
+        return f.buffer, self.lengths[path]
+
+    def read_number(self, path):
+        """Read a file that holds a single int."""
+        buffer, length = self.read(path)
+        return int(buffer[:length])
+
+    def get_cpu_times(self, fields):
+        """Get the CPU times from a "cpu" line of /proc/stat."""
+        ticks = self.clock_ticks
+        return {
+            "user": int(fields[1]) / ticks,
+            "system": int(fields[3]) / ticks,
+            "idle": int(fields[4]) / ticks}
+
+    def cpu_times(self):
+        """Get system CPU times."""
+        buffer, length = self.read(STAT)
+        fields, _ = find_line(buffer, length, b"cpu ")
+        return self.get_cpu_times(fields)
+
+    def cpu_times_per_cpu(self):
+        """Get system CPU times, per CPU."""
+        data = []
+        buffer, length = self.read(STAT)
+        fields, position = find_line(buffer, length, b"cpu")
+        while fields is not None:
+            if fields[0] != b"cpu":
+                data.append(self.get_cpu_times(fields))
+            fields, position = find_line(buffer, length, b"cpu", position)
+        return data
+
+    def cpu_stats(self):
+        """Get CPU stats."""
+        buffer, length = self.read(STAT)
+        return {
+            "ctx_switches": get_field(buffer, length, b"ctxt "),
+            "interrupts": get_field(buffer, length, b"intr "),
+            "soft_interrupts": get_field(buffer, length, b"softirq "),
+            "syscalls": 0}
+
+    def cpu_freq_per_cpu(self):
+        """Get CPU frequency per CPU.
+
+        Read from the cpufreq policies in /sys if there are any, or else
+        from /proc/cpuinfo, without a min or max.
+
+        """
+        if self.policies is None:
+            self.policies = sorted(
+                glob.glob(CPUFREQ),
+                key=lambda path: int(path.rpartition("policy")[2]))
+        data = []
+        for policy in self.policies:
+            data.append({
+                "current": self.read_number(
+                    policy + "/scaling_cur_freq") / 1000,
+                "min": self.read_number(policy + "/scaling_min_freq") / 1000,
+                "max": self.read_number(policy + "/scaling_max_freq") / 1000})
+        if data:
+            return data
+
+        buffer, length = self.read(CPUINFO)
+        fields, position = find_line(buffer, length, b"cpu MHz")
+        while fields is not None:
+            data.append({"current": float(fields[-1]), "min": 0.0, "max": 0.0})
+            fields, position = find_line(
+                buffer, length, b"cpu MHz", position)
+        return data
+
+    def cpu_freq(self):
+        """Get CPU frequency, averaged over the CPUs (or zeros, if there
+        is nowhere to read it from)."""
+        data = self.cpu_freq_per_cpu()
+        return {
+            key: sum(freq[key] for freq in data) / len(data) if data else 0.0
+            for key in ["current", "min", "max"]}
+
+    def virtual_memory(self):
+        """Get virtual memory info."""
+        buffer, length = self.read(MEMINFO)
+        total = get_field(buffer, length, b"MemTotal:") * 1024
+        available = get_field(buffer, length, b"MemAvailable:") * 1024
+        return {
+            "total": total,
+            "available": available,
+            "used": total - available,
+            "free": get_field(buffer, length, b"MemFree:") * 1024}
+
+    def swap_memory(self):
+        """Get swap memory info."""
+        buffer, length = self.read(MEMINFO)
+        total = get_field(buffer, length, b"SwapTotal:") * 1024
+        free = get_field(buffer, length, b"SwapFree:") * 1024
+        used = total - free
+        buffer, length = self.read(VMSTAT)
+        return {
+            "total": total,
+            "used": used,
+            "free": free,
+            "percent": round(used / total * 100, 1) if total else 0.0,
+            "sin": get_field(buffer, length, b"pswpin ", 0) * SWAP_PAGE_SIZE,
+            "sout": get_field(
+                buffer, length, b"pswpout ", 0) * SWAP_PAGE_SIZE}
@@ -1,10 +1,117 @@
 """Execute/stream utilities."""
 
-from queue import Queue, Empty
+import errno
+import os
+import stat
+
+from collections import namedtuple
+from queue import Queue, Empty, Full
 from threading import Thread
 
+from . import constants
+
+BLOCK = "block"
+"""When a buffer is full, wait for room (so the process waits too)."""
+
+DROP_OLDEST = "drop-oldest"
+"""When a buffer is full, drop the oldest line in it."""
+
+DROP_NEWEST = "drop-newest"
+"""When a buffer is full, drop the line being added."""
+
+POLICIES = [BLOCK, DROP_OLDEST, DROP_NEWEST]
+"""The policies a buffer can have for when it is full."""
+
+UNSPLICEABLE = (errno.EINVAL, errno.ENOSYS, errno.EBADF)
+"""The errors that mean a file descriptor cannot be spliced to."""
+
+SPLICE_FDS = set()
+"""The file descriptors of files that output can be spliced into.
+
+Splicing into a file does not take the lock that writes take on its
+offset, so it is only safe if nothing else writes to the file (e.g.,
+psrun just created it, for one output). Pipes can always be spliced
+into. Anything else is written to normally.
+"""
+
+Redirect = namedtuple("Redirect", ["fd"])
+"""A file descriptor to give a process as its stdout or stderr.
+
+The process then writes straight to it: there is no pipe, no thread
+and no copying in between.
+
+Attributes:
+
+    fd
+        The file descriptor.
+
+"""
+
+
+class Buffer(Queue):
+    """A queue of lines, with a policy for what to do when it is full.
+
+    With the ``BLOCK`` policy, the thread putting lines on the buffer
+    waits for room. It then stops reading from its pipe, and once the
+    pipe fills up, the process writing to it has to wait as well. With
+    the drop policies, lines are dropped instead, and counted.
+
+    The most lines the buffer has held at once is kept in ``high_water``.
+
+    Args:
+
+        maxsize
+            The max number of lines to hold, or ``0`` for no limit.
+
+        policy
+            One of ``POLICIES``.
+
+    """
+
+    def __init__(self, maxsize=0, policy=BLOCK):
+        """Initialize the buffer."""
+        super().__init__(maxsize)
+        self.policy = policy
+        self.dropped_lines = 0
+        self.dropped_bytes = 0
+        self.high_water = 0
+
+    def _put(self, item):
+        """Put a line on the buffer (its lock is held), and track its size."""
+        super()._put(item)
+        self.high_water = max(self.high_water, len(self.queue))
+
+    def drop(self, line):
+        """Count a dropped line."""
+        self.dropped_lines += 1
+        self.dropped_bytes += len(line)
+
+    def put_line(self, line):
+        """Put a line on the buffer, following the buffer's policy.
 
-def put_lines_into_queue(stream, queue):
+        Args:
+
+            line
+                The line to put on the buffer.
+
+        """
+        if self.policy == BLOCK:
+            self.put(line)
+            return
+        while True:
+            try:
+                self.put_nowait(line)
+                return
+            except Full:
+                if self.policy == DROP_NEWEST:
+                    self.drop(line)
+                    return
+            oldest = pop(self)
+            if oldest is not None:
+                self.drop(oldest)
+
+
+def put_lines_into_queue(stream, queue, notify=None):
     """Read lines from a stream, put them on a queue, and close the stream.
 
     Args:
@@ -13,14 +120,22 @@ def put_lines_into_queue(stream, queue):
             A stream you can read lines from.
 
         queue
-            A queue.
+            A ``Buffer``.
+
+        notify
+            An optional callable to invoke each time a line is put on
+            the queue, and once more when the stream is exhausted.
 
     Returns:
         The queue.
     """
     for line in iter(stream.readline, b''):
-        queue.put(line)
+        queue.put_line(line)
+        if notify:
+            notify()
     stream.close()
+    if notify:
+        notify()
     return queue
 
 
@@ -41,7 +156,7 @@ def pop(queue):
         return None
 
 
-def read(stream):
+def read(stream, notify=None, maxsize=0, policy=BLOCK):
     """In a thread, read lines from a stream and put them on a queue.
 
     Args:
@@ -49,11 +164,206 @@ def read(stream):
         stream
             The stream to read.
 
+        notify
+            An optional callable to invoke whenever new lines are ready.
+
+        maxsize
+            The max number of lines to queue up, or ``0`` for no limit.
+
+        policy
+            What to do when the queue is full. One of ``POLICIES``.
+
     Returns:
-        A queue the lines can be popped from.
+        A ``Buffer`` the lines can be popped from.
     """
-    queue = Queue()
-    thread = Thread(target=put_lines_into_queue, args=(stream, queue))
+    queue = Buffer(maxsize, policy)
+    thread = Thread(
+        target=put_lines_into_queue, args=(stream, queue, notify))
     thread.daemon = True
     thread.start()
     return queue
+
+
+def write_all(fd, data):
+    """Write all of ``data`` to a file descriptor.
+
+    Args:
+
+        fd
+            A file descriptor to write to.
+
+        data
+            A bytes-like object (e.g., a ``memoryview``) to write.
+
+    """
+    while data:
+        written = os.write(fd, data)
+        data = data[written:]
+
+
+def splice_chunks(src, fd, chunk_size):
+    """Move bytes from a pipe to a file descriptor, inside the kernel.
+
+    The bytes never pass through Python. This only works on Linux, and
+    only if ``fd`` is a file (not opened for appending) or a pipe.
+
+    Args:
+
+        src
+            The file descriptor of the pipe to read.
+
+        fd
+            A file descriptor to write to.
+
+        chunk_size
+            Max num bytes to move at a time.
+
+    Raises:
+
+        OSError
+            If writing fails after some bytes have been moved, or for any
+            reason other than ``fd`` not supporting splicing.
+
+    Returns:
+        The number of bytes moved, or ``None`` if ``fd`` does not support
+        splicing (in which case no bytes were moved).
+
+    """
+    if getattr(os, "splice", None) is None:
+        return None
+    moved = 0
+    while True:
+        try:
+            num_bytes = os.splice(src, fd, chunk_size)
+        except OSError as e:
+            if moved or e.errno not in UNSPLICEABLE:
+                raise
+            return None
+        if not num_bytes:
+            return moved
+        moved += num_bytes
+
+
+def can_splice(fd):
+    """Check if bytes can be spliced into a file descriptor safely.
+
+    Args:
+
+        fd
+            A file descriptor to write to.
+
+    Returns:
+        ``True`` for pipes, and for the files in ``SPLICE_FDS``.
+        ``False`` otherwise.
+
+    """
+    if fd in SPLICE_FDS:
+        return True
+    try:
+        return stat.S_ISFIFO(os.fstat(fd).st_mode)
+    except OSError:
+        return False
+
+
+def copy_chunks(stream, fd, notify=None, chunk_size=None):
+    """Copy raw bytes from a stream to a file descriptor, and close the stream.
+
+    Where the platform allows it, and ``fd`` is a pipe or in
+    ``SPLICE_FDS``, the bytes are spliced from the stream's pipe to
+    ``fd`` inside the kernel. Otherwise, they are
+    read straight from the stream's file descriptor into one reusable
+    buffer, and written out without being decoded or split into lines.
+    If writing fails (e.g., the destination is a closed pipe), the rest
+    of the stream is read and discarded, so the process writing to it
+    never blocks.
+
+    Args:
+
+        stream
+            A stream with a ``fileno()``, e.g., a ``Popen.stdout``.
+
+        fd
+            A file descriptor to write to.
+
+        notify
+            An optional callable to invoke when the stream is exhausted.
+
+        chunk_size
+            Max num bytes to read at a time, or ``None`` for
+            ``constants.CHUNK_SIZE``.
+
+    Returns:
+        The number of bytes copied.
+    """
+    chunk_size = chunk_size or constants.CHUNK_SIZE
+    src = stream.fileno()
+    copied = None
+    if fd is not None and can_splice(fd):
+        try:
+            copied = splice_chunks(src, fd, chunk_size)
+        except OSError:
+            fd = None
+    if copied is None:
+        copied = read_chunks(src, fd, chunk_size)
+    stream.close()
+    if notify:
+        notify()
+    return copied
+
+
+def read_chunks(src, fd, chunk_size):
+    """Copy raw bytes from one file descriptor to another, through Python.
+
+    Args:
+
+        src
+            The file descriptor to read.
+
+        fd
+            A file descriptor to write to, or ``None`` to discard the
+            bytes. If writing fails, the rest of the bytes are discarded.
+
+        chunk_size
+            Max num bytes to read at a time.
+
+    Returns:
+        The number of bytes read.
+    """
+    buf = bytearray(chunk_size)
+    view = memoryview(buf)
+    copied = 0
+    while True:
+        num_bytes = os.readv(src, [buf])
+        if not num_bytes:
+            break
+        if fd is not None:
+            try:
+                write_all(fd, view[:num_bytes])
+            except OSError:
+                fd = None
+        copied += num_bytes
+    view.release()
+    return copied
+
+
+def forward(stream, fd, notify=None):
+    """In a thread, copy raw bytes from a stream to a file descriptor.
+
+    Args:
+
+        stream
+            The stream to read.
+
+        fd
+            The file descriptor to write to.
+
+        notify
+            An optional callable to invoke when the stream is exhausted.
+
+    Returns:
+        The thread.
+    """
+    thread = Thread(target=copy_chunks, args=(stream, fd, notify))
+    thread.daemon = True
+    thread.start()
+    return thread
@@ -0,0 +1,259 @@
+"""Running summaries of the stats collected about a process.
+
+Each numeric stat in the records that ``monitor.collect()`` gathers is
+folded into a ``Metric``: its count, min, max and mean, plus estimates
+of its percentiles. The percentiles are estimated with the P-square
+algorithm (Jain and Chlamtac, 1985), which keeps five numbers per
+percentile, however long the process runs. So a summary takes the same
+memory after a day as after a second, and a log can keep just the
+summary instead of every sample.
+
+Stats are named by their flattened path, as in ``compact.flatten()``,
+e.g., "process/rss" or "cpu_times_per_cpu/0/user".
+
+"""
+
+import time
+
+from collections import OrderedDict
+
+from . import compact
+from . import monitor
+
+PERCENTILES = (50, 95, 99)
+"""The percentiles to estimate for each stat."""
+
+
+class Quantile(object):
+    """Estimates a quantile of a stream of numbers, in constant memory.
+
+    This is the P-square algorithm: it tracks five markers (the min, the
+    max, the quantile, and two points half way to it), and nudges their
+    heights along a parabola as numbers arrive, so that they stay close
+    to where they would be in the sorted stream.
+
+    Args:
+
+        p
+            The quantile to estimate, e.g., 0.95.
+
+    """
+
+    def __init__(self, p):
+        """Initialize the estimator."""
+        self.p = p
+        self.heights = []
+        self.positions = [0, 1, 2, 3, 4]
+        self.desired = [0, 2 * p, 4 * p, 2 + 2 * p, 4]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, x):
+        """Add a number to the stream."""
+        q = self.heights
+        if len(q) < 5:
+            q.append(x)
+            q.sort()
+            return
+
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+
+        n = self.positions
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        for i in range(1, 4):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or \
+                    (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                height = self.parabolic(i, d)
+                if not q[i - 1] < height < q[i + 1]:
+                    height = self.linear(i, d)
+                q[i] = height
+                n[i] += d
+
+    def parabolic(self, i, d):
+        """Get the parabolic prediction of marker ``i``, moved by ``d``."""
+        q = self.heights
+        n = self.positions
+        return q[i] + d / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i]) +
+            (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+
+    def linear(self, i, d):
+        """Get the linear prediction of marker ``i``, moved by ``d``."""
+        q = self.heights
+        n = self.positions
+        return q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+
+    def value(self):
+        """Get the estimate, or ``None`` if no numbers were added."""
+        q = self.heights
+        if not q:
+            return None
+        if len(q) < 5:
+            return q[min(len(q) - 1, int(self.p * len(q)))]
+        return q[2]
+
+
+class Metric(object):
+    """Summarizes a stream of numbers.
+
+    Args:
+
+        percentiles
+            The percentiles to estimate. Default: ``PERCENTILES``.
+
+    """
+
+    def __init__(self, percentiles=None):
+        """Initialize the metric."""
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        self.quantiles = OrderedDict(
+            (pct, Quantile(pct / 100)) for pct in percentiles or PERCENTILES)
+
+    def add(self, x):
+        """Add a number to the stream."""
+        self.count += 1
+        self.total += x
+        if self.min is None or x < self.min:
+            self.min = x
+        if self.max is None or x > self.max:
+            self.max = x
+        for quantile in self.quantiles.values():
+            quantile.add(x)
+
+    def get_summary(self):
+        """Get the summary, e.g., ``{"count": 3, "min": 1, ...}``."""
+        data = OrderedDict()
+        data["count"] = self.count
+        data["min"] = self.min
+        data["max"] = self.max
+        data["mean"] = self.total / self.count if self.count else None
+        for pct, quantile in self.quantiles.items():
+            data["p{}".format(pct)] = quantile.value()
+        return data
+
+
+def is_number(value):
+    """Check if a value is a number (but not a bool)."""
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def get_numbers(data):
+    """Get the numeric stats in a record, as ``(path, value)`` pairs.
+
+    Args:
+
+        data
+            A record, as gathered by ``monitor.collect()``.
+
+    Returns:
+        A list of pairs, e.g., ``[("process/rss", 4096), ...]``.
+
+    """
+    return [
+        (path, value) for path, value in compact.flatten(data).items()
+        if path != "pid" and is_number(value)]
+
+
+class Summary(object):
+    """Keeps running summaries of the stats collected about a process.
+
+    Pass it to ``monitor.collect()`` (e.g., via ``main.run()``) to add
+    each record to it. The summary is written to its log as a record of
+    its own, like ``{"summary": {"process/rss": {"count": ...}}}``,
+    whenever ``write()`` is called, and every ``interval`` secs.
+
+    Args:
+
+        log
+            A callable to send summary records to.
+
+        encode
+            A callable to serialize summary records with, e.g., the same
+            one as the samples. Default: ``monitor.serialize()``.
+
+        interval
+            Num secs between summary records, or ``None`` to only write
+            them when asked to.
+
+        samples
+            Whether the samples should be logged too, or only the summary.
+
+        percentiles
+            The percentiles to estimate. Default: ``PERCENTILES``.
+
+    """
+
+    def __init__(
+            self, log, encode=None, interval=None, samples=True,
+            percentiles=None):
+        """Initialize the summary."""
+        self.log = log
+        self.encode = encode or monitor.serialize
+        self.interval = interval
+        self.samples = samples
+        self.percentiles = percentiles
+        self.count = 0
+        self.metrics = OrderedDict()
+        self.written = time.monotonic()
+
+    def add(self, data, now=None):
+        """Add a record of stats, and write the summary if it is due.
+
+        Args:
+
+            data
+                A record, as gathered by ``monitor.collect()``.
+
+            now
+                The time, by ``time.monotonic()``. Default: now.
+
+        """
+        self.count += 1
+        for path, value in get_numbers(data):
+            metric = self.metrics.get(path)
+            if metric is None:
+                metric = self.metrics[path] = Metric(self.percentiles)
+            metric.add(value)
+
+        if now is None:
+            now = time.monotonic()
+        if self.interval and now - self.written >= self.interval:
+            self.write(now)
+
+    def get_summary(self):
+        """Get the summary of each stat, by path."""
+        return OrderedDict(
+            (path, metric.get_summary())
+            for path, metric in self.metrics.items())
+
+    def write(self, now=None):
+        """Write the summary to the log.
+
+        Args:
+
+            now
+                The time, by ``time.monotonic()``. Default: now.
+
+        """
+        data = OrderedDict()
+        data["samples"] = self.count
+        data["summary"] = self.get_summary()
+        self.log(self.encode(data))
+        self.written = time.monotonic() if now is None else now
@@ -16,7 +16,7 @@ setup(
     description="Runs commands and monitors them",
     long_description=long_description,
     packages=find_packages(
-        exclude=["venv", "tests"]
+        exclude=["venv", "tests", "benchmarks"]
     ),
     install_requires=["psutil", "flake8", "coverage"],
     entry_points={
@@ -3,9 +3,13 @@
 from unittest import TestCase
 from unittest.mock import Mock, patch
 
+import fcntl
 import io
 import os
 import sys
+import tempfile
+import threading
+import time
 
 import logging
 import logging.handlers
@@ -13,6 +17,8 @@ import logging.handlers
 from collections import OrderedDict
 
 from psrun.cli import log as log_lib
+from psrun.lib import columnar
+from psrun.lib import stream
 
 
 class TestLog(TestCase):
@@ -94,6 +100,113 @@ class TestLog(TestCase):
             result = stream.getvalue()
             self.assertEqual(result, "{}{}".format(msg, os.linesep))
 
+    def test_sink(self):
+        """Ensure a ``Sink`` writes out messages in batches."""
+        batches = []
+        sink = log_lib.Sink(batches.append, batch_size=10, flush_interval=60)
+        for msg in ["one", "two", "three"]:
+            sink.write(msg)
+        sink.close()
+        self.assertEqual(batches[0], "one\ntwo\nthree")
+        self.assertEqual(len(batches), 1)
+        self.assertEqual(log_lib.constants.LOG_BATCH_SIZE, 65536)
+
+    def test_sink_without_join(self):
+        """Ensure a ``Sink`` can write out a batch a message at a time."""
+        batches = []
+        sink = log_lib.Sink(
+            batches.append, batch_size=10, flush_interval=60, join=False)
+        for msg in ["one", "two", "three"]:
+            sink.write(msg)
+        sink.close()
+        self.assertEqual(batches, ["one", "two", "three"])
+
+    def test_rotating_log_stays_under_max_bytes(self):
+        """Ensure a rotating log rotates between messages."""
+        p = patch.dict(log_lib.SINKS, clear=True)
+        with p, tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "out.log")
+            log = log_lib.get_log("rotating-log", path, 100, 10)
+            for i in range(50):
+                log("message {:02}".format(i))
+            log_lib.close_sinks()
+            for handler in logging.getLogger("rotating-log").handlers:
+                handler.close()
+            names = os.listdir(tmp)
+            self.assertGreater(len(names), 2)
+            for name in names:
+                self.assertLessEqual(
+                    os.path.getsize(os.path.join(tmp, name)), 100)
+            with open(path + ".1") as f:
+                self.assertTrue(f.read().startswith("message"))
+
+    def test_sink_flushes_in_time(self):
+        """Ensure a ``Sink`` writes out messages after its flush interval."""
+        batches = []
+        sink = log_lib.Sink(batches.append, flush_interval=0.01)
+        sink.write("one")
+        time.sleep(0.2)
+        self.assertEqual(batches, ["one"])
+        sink.close()
+        self.assertEqual(batches, ["one"])
+
+    def test_sink_after_close(self):
+        """Ensure a ``Sink`` writes out messages sent after it closed."""
+        batches = []
+        sink = log_lib.Sink(batches.append)
+        sink.close()
+        sink.write("late")
+        self.assertEqual(batches, ["late"])
+
+    def test_sink_waits_for_room(self):
+        """Ensure senders wait while a ``Sink`` has too much to write."""
+        batches = []
+        written = threading.Event()
+
+        def write_batch(batch):
+            written.wait()
+            batches.append(batch)
+
+        sink = log_lib.Sink(write_batch, batch_size=1, flush_interval=60)
+        sender = threading.Thread(
+            target=lambda: [sink.write(str(i)) for i in range(100)])
+        sender.start()
+        sender.join(0.1)
+        self.assertTrue(sender.is_alive())
+        self.assertLessEqual(sink.size, sink.max_pending + 2)
+
+        written.set()
+        sender.join()
+        sink.close()
+        lines = "\n".join(batches).split("\n")
+        self.assertEqual(lines, [str(i) for i in range(100)])
+
+    def test_get_sink(self):
+        """Ensure ``get_sink()`` shares one sink per output."""
+        batches = []
+        p = patch.dict(log_lib.SINKS, clear=True)
+        with p:
+            sink = log_lib.get_sink("stdout", batches.append)
+            self.assertIs(log_lib.get_sink("stdout", Mock()), sink)
+            self.assertIsNot(log_lib.get_sink("stderr", Mock()), sink)
+            sink.write("one")
+
+            log_lib.close_sinks()
+            self.assertEqual(log_lib.SINKS, {})
+            self.assertEqual(batches, ["one"])
+
+    def test_get_log_writes_in_batches(self):
+        """Ensure logs write out to their files through sinks."""
+        p = patch.dict(log_lib.SINKS, clear=True)
+        with p, tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "out.log")
+            log = log_lib.get_log("dummy-batched", path)
+            for msg in ["one", "two"]:
+                log(msg)
+            log_lib.close_sinks()
+            with open(path) as f:
+                self.assertEqual(f.read(), "one\ntwo\n")
+
     def test_get_null_log(self):
         """Ensure ``get_log()`` dispatches to null log builders."""
         name = "dummy-name"
@@ -119,40 +232,56 @@ class TestLog(TestCase):
         name = "dummy-name"
         output = "stdout"
         logger = Mock(info=Mock())
+        sink = Mock(write=Mock())
         writer = Mock()
 
         p1 = patch("{}.get_stream_logger".format(log_lib.__name__))
         p2 = patch("{}.get_writer".format(log_lib.__name__))
+        p3 = patch("{}.get_sink".format(log_lib.__name__))
+
+        p4 = patch.dict(log_lib.LOGGERS, clear=True)
+        p5 = patch.dict(log_lib.REFS, clear=True)
 
-        with p1 as get_stream_logger, p2 as get_writer:
+        with p1 as get_stream_logger, p2 as get_writer, \
+                p3 as get_sink, p4, p5:
             get_stream_logger.return_value = logger
+            get_sink.return_value = sink
             get_writer.return_value = writer
 
             result = log_lib.get_log(name, output)
 
             self.assertEqual(result, writer)
             get_stream_logger.assert_called_once_with(name, sys.stdout)
-            get_writer.assert_called_once_with(logger.info)
+            get_sink.assert_called_once_with(output, logger.info, True)
+            get_writer.assert_called_once_with(sink.write)
 
     def test_get_stderr_log(self):
         """Ensure ``get_log()`` dispatches to stderr log builders."""
         name = "dummy-name"
         output = "stderr"
         logger = Mock(info=Mock())
+        sink = Mock(write=Mock())
         writer = Mock()
 
         p1 = patch("{}.get_stream_logger".format(log_lib.__name__))
         p2 = patch("{}.get_writer".format(log_lib.__name__))
+        p3 = patch("{}.get_sink".format(log_lib.__name__))
+
+        p4 = patch.dict(log_lib.LOGGERS, clear=True)
+        p5 = patch.dict(log_lib.REFS, clear=True)
 
-        with p1 as get_stream_logger, p2 as get_writer:
+        with p1 as get_stream_logger, p2 as get_writer, \
+                p3 as get_sink, p4, p5:
             get_stream_logger.return_value = logger
+            get_sink.return_value = sink
             get_writer.return_value = writer
 
             result = log_lib.get_log(name, output)
 
             self.assertEqual(result, writer)
             get_stream_logger.assert_called_once_with(name, sys.stderr)
-            get_writer.assert_called_once_with(logger.info)
+            get_sink.assert_called_once_with(output, logger.info, True)
+            get_writer.assert_called_once_with(sink.write)
 
     def test_get_file_log(self):
         """Ensure ``get_log()`` dispatches to file log builders."""
@@ -161,13 +290,20 @@ class TestLog(TestCase):
         num_bytes = 1000
         num_files = 4
         logger = Mock(info=Mock())
+        sink = Mock(write=Mock())
         writer = Mock()
 
         p1 = patch("{}.get_file_logger".format(log_lib.__name__))
         p2 = patch("{}.get_writer".format(log_lib.__name__))
+        p3 = patch("{}.get_sink".format(log_lib.__name__))
+
+        p4 = patch.dict(log_lib.LOGGERS, clear=True)
+        p5 = patch.dict(log_lib.REFS, clear=True)
 
-        with p1 as get_file_logger, p2 as get_writer:
+        with p1 as get_file_logger, p2 as get_writer, \
+                p3 as get_sink, p4, p5:
             get_file_logger.return_value = logger
+            get_sink.return_value = sink
             get_writer.return_value = writer
 
             result = log_lib.get_log(name, output, num_bytes, num_files)
@@ -175,4 +311,97 @@ class TestLog(TestCase):
             self.assertEqual(result, writer)
             get_file_logger.assert_called_once_with(
                 name, output, num_bytes, num_files)
-            get_writer.assert_called_once_with(logger.info)
+            get_sink.assert_called_once_with(output, logger.info, False)
+            get_writer.assert_called_once_with(sink.write)
+
+    def test_get_fd(self):
+        """Ensure ``get_fd()`` returns file descriptors to write to."""
+        self.assertEqual(log_lib.get_fd("stdout"), sys.stdout.fileno())
+        self.assertEqual(log_lib.get_fd("stderr"), sys.stderr.fileno())
+
+    def test_get_fd_for_a_file(self):
+        """Ensure ``get_fd()`` splices only into files it creates."""
+        p = patch.dict(log_lib.FDS, clear=True)
+        with p, tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "out.log")
+            for data, append in [(b"one\n", False), (b"two\n", True)]:
+                fd = log_lib.get_fd(path)
+                flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+                self.assertEqual(bool(flags & os.O_APPEND), append)
+                self.assertEqual(stream.can_splice(fd), not append)
+                os.write(fd, data)
+                log_lib.close_fds()
+                self.assertNotIn(fd, stream.SPLICE_FDS)
+            self.assertEqual(log_lib.FDS, {})
+            with open(path, "rb") as f:
+                self.assertEqual(f.read(), b"one\ntwo\n")
+
+    def test_get_fd_for_a_shared_file(self):
+        """Ensure ``get_fd()`` shares a file in append mode."""
+        p = patch.dict(log_lib.FDS, clear=True)
+        with p, tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "out.log")
+            fd = log_lib.get_fd(path)
+            self.assertEqual(log_lib.get_fd(path), fd)
+            self.assertTrue(fcntl.fcntl(fd, fcntl.F_GETFL) & os.O_APPEND)
+            self.assertFalse(stream.can_splice(fd))
+            log_lib.close()
+            self.assertEqual(log_lib.FDS, {})
+
+    def test_get_columnar_log(self):
+        """Ensure ``get_columnar_log()`` shares a writer per file."""
+        p = patch.dict(log_lib.WRITERS, clear=True)
+        with p, tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "ps.bin")
+            for pid in [10, 11]:
+                log_lib.get_columnar_log(path)({"pid": pid})
+                log_lib.get_columnar_log(path)({"pid": pid})
+                self.assertEqual(len(log_lib.WRITERS), 1)
+                log_lib.close()
+            self.assertEqual(log_lib.WRITERS, {})
+            with open(path, "rb") as f:
+                result = columnar.read(f)
+            self.assertEqual(list(result["pid"]), [10, 10, 11, 11])
+
+    def test_release(self):
+        """Ensure ``release()`` closes an output once nothing uses it."""
+        p1 = patch.dict(log_lib.SINKS, clear=True)
+        p2 = patch.dict(log_lib.LOGGERS, clear=True)
+        p3 = patch.dict(log_lib.FDS, clear=True)
+        p4 = patch.dict(log_lib.REFS, clear=True)
+        with p1, p2, p3, p4, tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "out.log")
+            log = log_lib.get_log("dummy-released", path)
+            log_lib.get_log("dummy-released-2", path)("two")
+            log("one")
+            self.assertEqual(len(logging.getLogger(
+                "dummy-released-2").handlers), 0)
+            log_lib.release(path)
+            self.assertIn(path, log_lib.SINKS)
+            log_lib.release(path)
+            self.assertEqual(log_lib.SINKS, {})
+            self.assertEqual(log_lib.LOGGERS, {})
+            self.assertEqual(log_lib.REFS, {})
+            self.assertEqual(
+                logging.getLogger("dummy-released").handlers, [])
+            with open(path) as f:
+                self.assertEqual(f.read(), "two\none\n")
+
+            raw = os.path.join(tmp, "raw.log")
+            fd = log_lib.get_fd(raw)
+            log_lib.release(raw)
+            self.assertEqual(log_lib.FDS, {})
+            with self.assertRaises(OSError):
+                os.fstat(fd)
+
+    def test_release_a_columnar_log(self):
+        """Ensure ``release()`` writes out a columnar log, and closes it."""
+        p1 = patch.dict(log_lib.WRITERS, clear=True)
+        p2 = patch.dict(log_lib.REFS, clear=True)
+        with p1, p2, tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "ps.bin")
+            log_lib.get_columnar_log(path)({"pid": 10})
+            log_lib.release(path)
+            self.assertEqual(log_lib.WRITERS, {})
+            with open(path, "rb") as f:
+                self.assertEqual(list(columnar.read(f)["pid"]), [10])
@@ -1,9 +1,18 @@
 """Unit tests for the ``cli.main`` module."""
 
 from unittest import TestCase
-from unittest.mock import patch, Mock
+from unittest.mock import patch, ANY, Mock
+
+import os
+import pstats
+import tempfile
 
 from psrun.cli import main
+from psrun.lib import batch
+from psrun.lib import columnar
+from psrun.lib import exceptions
+from psrun.lib import monitor
+from psrun.lib import stream
 
 
 class TestMain(TestCase):
@@ -16,10 +25,15 @@ class TestMain(TestCase):
         shutdown = "10"
         args = [
             cmd, "--timeout", timeout, "--shutdown", shutdown,
+            "--max-rss", "4096", "--cpu-timeout", "30", "--idle-timeout", "5",
             "--runner-log", "stdout", "--runner-log-max-bytes", "1000",
             "--runner-log-max-file", "4",
             "--ps-log", "stdout", "--ps-log-max-bytes", "1000",
-            "--ps-log-max-file", "4",
+            "--ps-log-max-file", "4", "--ps-log-format", "compact",
+            "--collectors", "all_pids,-cpu_stats", "--sample-interval", "5",
+            "--collector-backend", "psutil", "--max-sample-interval", "60",
+            "--output-mode", "raw", "--buffer-size", "100",
+            "--buffer-policy", "drop-oldest",
             "--stdout-log", "stdout", "--stdout-log-max-bytes", "1000",
             "--stdout-log-max-files", "4",
             "--stderr-log", "stderr",
@@ -28,12 +42,24 @@ class TestMain(TestCase):
         self.assertEqual(result.CMD, cmd)
         self.assertEqual(result.timeout, int(timeout))
         self.assertEqual(result.shutdown, int(shutdown))
+        self.assertEqual(result.max_rss, 4096)
+        self.assertEqual(result.cpu_timeout, 30.0)
+        self.assertEqual(result.idle_timeout, 5.0)
         self.assertEqual(result.runner_log, "stdout")
         self.assertEqual(result.runner_log_max_bytes, 1000)
         self.assertEqual(result.runner_log_max_files, 4)
         self.assertEqual(result.ps_log, "stdout")
         self.assertEqual(result.ps_log_max_bytes, 1000)
         self.assertEqual(result.ps_log_max_files, 4)
+        self.assertEqual(result.ps_log_format, "compact")
+        self.assertIn("all_pids", result.collectors)
+        self.assertEqual(result.sample_interval, 5.0)
+        self.assertEqual(result.collector_backend, "psutil")
+        self.assertEqual(result.max_sample_interval, 60.0)
+        self.assertEqual(result.output_mode, "raw")
+        self.assertEqual(result.buffer_size, 100)
+        self.assertEqual(result.buffer_policy, "drop-oldest")
+        self.assertNotIn("cpu_stats", result.collectors)
         self.assertEqual(result.stdout_log, "stdout")
         self.assertEqual(result.stdout_log_max_bytes, 1000)
         self.assertEqual(result.stdout_log_max_files, 4)
@@ -41,6 +67,339 @@ class TestMain(TestCase):
         self.assertEqual(result.stderr_log_max_bytes, 1000)
         self.assertEqual(result.stderr_log_max_files, 4)
 
+    def test_parse_args_with_bad_collectors(self):
+        """Ensure ``parse_args()`` rejects unknown collectors."""
+        p = patch("sys.stderr")
+        with p, self.assertRaises(SystemExit):
+            main.parse_args(["cmd", "--collectors", "bogus"])
+
+    def test_parse_args_with_bad_sample_interval(self):
+        """Ensure ``parse_args()`` rejects intervals that would spin."""
+        p = patch("sys.stderr")
+        bad_args = [
+            ["--sample-interval", "0"], ["--sample-interval", "-1"],
+            ["--sample-interval", "nan"], ["--sample-interval", "x"],
+            ["--max-sample-interval", "0"],
+            ["--sample-interval", "5", "--max-sample-interval", "1"]]
+        for args in bad_args:
+            with p, self.assertRaises(SystemExit):
+                main.parse_args(["cmd"] + args)
+
+    def test_parse_args_with_bad_numbers(self):
+        """Ensure ``parse_args()`` rejects numbers that are not above 0."""
+        p = patch("sys.stderr")
+        bad_args = [
+            ["--ps-history", "-5"], ["--ps-history", "0"],
+            ["--ps-summary-interval", "-1"],
+            ["--ps-summary-interval", "inf"],
+            ["--cpu-timeout", "-5"], ["--cpu-timeout", "0"],
+            ["--idle-timeout", "-1"], ["--idle-timeout", "nan"],
+            ["--max-rss", "0"], ["--max-rss", "-1024"]]
+        for args in bad_args:
+            with p, self.assertRaises(SystemExit):
+                main.parse_args(["cmd"] + args)
+
+    def test_parse_args_with_batch(self):
+        """Ensure ``parse_args()`` takes a batch instead of a CMD."""
+        result = main.parse_args(["--batch", "-", "--concurrency", "3"])
+        self.assertIsNone(result.CMD)
+        self.assertEqual(result.batch, "-")
+        self.assertEqual(result.concurrency, 3)
+
+    def test_parse_args_with_bad_batch_options(self):
+        """Ensure ``parse_args()`` rejects what a batch cannot do."""
+        p = patch("sys.stderr")
+        bad_args = [
+            ["--concurrency", "0"], ["--concurrency", "-2"],
+            ["--concurrency", "x"], ["--buffer-size", "10"],
+            ["--buffer-policy", "drop-oldest"]]
+        for args in bad_args:
+            with p, self.assertRaises(SystemExit):
+                main.parse_args(["--batch", "-"] + args)
+
+    def test_parse_args_needs_cmd_or_batch(self):
+        """Ensure ``parse_args()`` needs a CMD or a batch, not both."""
+        p = patch("sys.stderr")
+        for args in [[], ["cmd", "--batch", "-"]]:
+            with p, self.assertRaises(SystemExit):
+                main.parse_args(args)
+
+    def test_get_cgroup_or_exit(self):
+        """Ensure ``get_cgroup_or_exit()`` makes a cgroup if asked to."""
+        p = patch("{}.cgroup_lib.create".format(main.__name__))
+        with p as create:
+            args = main.parse_args(["cmd"])
+            self.assertIsNone(main.get_cgroup_or_exit(args))
+
+            args = main.parse_args(["cmd", "--cgroup"])
+            result = main.get_cgroup_or_exit(args)
+            self.assertEqual(result, create.return_value)
+            create.assert_called_with(None, None)
+
+            args = main.parse_args([
+                "cmd", "--cgroup-cpus", "1.5", "--cgroup-memory-max", "1024"])
+            main.get_cgroup_or_exit(args)
+            create.assert_called_with(1.5, 1024)
+
+            create.side_effect = exceptions.CgroupUnavailable("dummy-error")
+            with self.assertRaises(SystemExit):
+                main.get_cgroup_or_exit(args)
+
+    def test_run_cmd_creates_the_cgroup_last(self):
+        """Ensure ``run_cmd()`` makes no cgroup if it exits before running."""
+        args = main.parse_args([
+            "true", "--cgroup", "--runner-log", "/dev/null", "--ps-log",
+            "/dev/null", "--stdout-log", "/dummy/dir/out.log"])
+        p = patch("{}.cgroup_lib.create".format(main.__name__))
+        with p as create, self.assertRaises(SystemExit):
+            main.run_cmd(args)
+        self.assertFalse(create.called)
+
+    def test_label(self):
+        """Ensure ``label()`` prefixes messages that go to a shared stream."""
+        data = []
+        log = main.label(data.append, "stdout", "job")
+        log("msg")
+        self.assertEqual(data, ["[job] msg"])
+        self.assertEqual(main.label(data.append, "/path", "job"), data.append)
+
+    def test_get_job_params(self):
+        """Ensure ``get_job_params()`` builds logs for a job."""
+        args = main.parse_args([
+            "--batch", "-", "--timeout", "5", "--ps-log-format", "compact",
+            "--stdout-log", "/logs/{name}.out", "--output-mode", "raw",
+            "--ps-summary", "append"])
+        job = {"cmd": "ls", "name": "one", "timeout": 10, "max_rss": 1024,
+               "idle_timeout": 60, "stderr_log": "/logs/{name}.err"}
+
+        outputs = []
+        p1 = patch("{}.cli_log.get_log".format(main.__name__))
+        p2 = patch("{}.cli_log.get_fd".format(main.__name__))
+        with p1 as get_log, p2 as get_fd:
+            get_fd.return_value = 7
+            result = main.get_job_params(args, job, 2, outputs)
+
+            get_log.assert_any_call("job-2.runner_log", "stdout", None, None)
+            get_fd.assert_any_call("/logs/one.out")
+            get_fd.assert_any_call("/logs/one.err")
+
+        self.assertEqual(outputs, [
+            "stdout", "stdout", "/logs/one.out", "/logs/one.err"])
+        self.assertEqual(result["cmd"], "ls")
+        self.assertEqual(result["timeout"], 10)
+        self.assertEqual(result["shutdown"], 30)
+        self.assertEqual(result["max_rss"], 1024)
+        self.assertEqual(result["idle_timeout"], 60)
+        self.assertIsNone(result["cpu_timeout"])
+        self.assertEqual(result["stdout_log"], 7)
+        self.assertTrue(callable(result["ps_encode"]))
+        self.assertIs(result["summary"].log, result["ps_log"])
+        self.assertIs(result["summary"].encode, result["ps_encode"])
+        self.assertIsNone(result["history"])
+
+    def test_get_history(self):
+        """Ensure ``get_history()`` sets up the history asked for."""
+        log = Mock()
+        args = main.parse_args(["cmd"])
+        self.assertIsNone(main.get_history(args, log))
+
+        args = main.parse_args(["cmd", "--ps-history", "100"])
+        result = main.get_history(args, log)
+        self.assertEqual(result.size, 100)
+        self.assertIs(result.log, log)
+
+    def test_get_summary(self):
+        """Ensure ``get_summary()`` sets up the summary asked for."""
+        log = Mock()
+        args = main.parse_args(["cmd"])
+        self.assertIsNone(main.get_summary(args, log))
+
+        args = main.parse_args(["cmd", "--ps-summary", "append"])
+        result = main.get_summary(args, log)
+        self.assertIs(result.log, log)
+        self.assertIsNone(result.interval)
+        self.assertTrue(result.samples)
+
+        args = main.parse_args([
+            "cmd", "--ps-summary", "only", "--ps-summary-interval", "60"])
+        result = main.get_summary(args, log)
+        self.assertEqual(result.interval, 60)
+        self.assertFalse(result.samples)
+
+    def test_run_batch(self):
+        """Ensure ``run_batch()`` runs the jobs in a file."""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "jobs.txt")
+            out = os.path.join(tmp, "{name}.out")
+            with open(path, "w") as f:
+                f.write("echo one\n")
+                f.write('{"cmd": "echo two", "name": "two"}\n')
+            args = main.parse_args([
+                "--batch", path, "--runner-log", "/dev/null",
+                "--ps-log", "/dev/null", "--stdout-log", out])
+            main.run_batch(args)
+
+            with open(os.path.join(tmp, "1.out")) as f:
+                self.assertEqual(f.read(), "one\n")
+            with open(os.path.join(tmp, "two.out")) as f:
+                self.assertEqual(f.read(), "two\n")
+
+    def test_run_batch_with_bad_logs(self):
+        """Ensure a job whose logs cannot be opened does not stop a batch."""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "jobs.txt")
+            out = os.path.join(tmp, "{name}.out")
+            with open(path, "w") as f:
+                f.write('{"cmd": "true", "stdout_log": "/no/such/dir/x"}\n')
+                f.write("echo two\n")
+            args = main.parse_args([
+                "--batch", path, "--runner-log", "/dev/null",
+                "--ps-log", "/dev/null", "--stdout-log", out])
+            p = patch("{}.print".format(batch.__name__), create=True)
+            with p as print_:
+                main.run_batch(args)
+            self.assertIn("[1] -- ERROR: ", print_.call_args_list[0][0][0])
+
+            with open(os.path.join(tmp, "2.out")) as f:
+                self.assertEqual(f.read(), "two\n")
+
+    def test_run_batch_from_stdin(self):
+        """Ensure ``run_batch()`` reads jobs from stdin."""
+        args = main.parse_args(["--batch", "-"])
+        p1 = patch("{}.sys.stdin".format(main.__name__), ["echo one"])
+        p2 = patch("{}.batch.run".format(main.__name__))
+        with p1, p2 as batch_run:
+            main.run_batch(args)
+            batch_run.assert_awaited_once_with(
+                [{"cmd": "echo one", "name": "1"}], args.concurrency, None,
+                args.sample_interval, "auto", None, ANY)
+            open_job = batch_run.call_args[0][-1]
+            self.assertIs(open_job.func, main.open_job)
+            self.assertEqual(open_job.args, (args,))
+
+    def test_run_batch_in_cgroups(self):
+        """Ensure ``run_batch()`` checks cgroups, and leaves them to jobs."""
+        args = main.parse_args(["--batch", "-", "--cgroup-cpus", "2"])
+        p1 = patch("{}.sys.stdin".format(main.__name__), ["echo one"])
+        p2 = patch("{}.cgroup_lib.create".format(main.__name__))
+        p3 = patch("{}.batch.run".format(main.__name__))
+        with p1, p2 as create, p3 as batch_run:
+            main.run_batch(args)
+            create.assert_called_once_with(2.0, None)
+            create.return_value.remove.assert_called_once_with()
+            cgroup_limits = batch_run.call_args[0][5]
+            self.assertEqual(cgroup_limits, (2.0, None))
+
+        p2 = patch("{}.cgroup_lib.create".format(main.__name__))
+        with p1, p2 as create, p3 as batch_run, self.assertRaises(SystemExit):
+            create.side_effect = exceptions.CgroupUnavailable("dummy-error")
+            main.run_batch(args)
+        self.assertFalse(batch_run.called)
+
+    def test_open_job(self):
+        """Ensure ``open_job()`` opens a job's logs, then releases them."""
+        args = main.parse_args(["--batch", "-"])
+        job = {"cmd": "ls", "name": "one"}
+        p1 = patch("{}.get_job_params".format(main.__name__))
+        p2 = patch("{}.cli_log.release".format(main.__name__))
+        with p1 as get_job_params, p2 as release:
+            get_job_params.side_effect = (
+                lambda args, job, num, outputs: outputs.append("out") or {})
+            with main.open_job(args, job, 3) as params:
+                self.assertEqual(params, {})
+                self.assertFalse(release.called)
+            get_job_params.assert_called_once_with(args, job, 3, ["out"])
+            release.assert_called_once_with("out")
+
+    def test_open_job_with_error(self):
+        """Ensure ``open_job()`` releases the logs it opened on errors."""
+        args = main.parse_args(["--batch", "-"])
+        job = {"cmd": "ls", "name": "one"}
+        p1 = patch("{}.get_job_params".format(main.__name__))
+        p2 = patch("{}.cli_log.release".format(main.__name__))
+        with p1 as get_job_params, p2 as release:
+            def fail(args, job, num, outputs):
+                outputs.append("out")
+                raise OSError("dummy-error")
+            get_job_params.side_effect = fail
+            with self.assertRaises(OSError):
+                with main.open_job(args, job, 3):
+                    pass
+            release.assert_called_once_with("out")
+
+    def test_run_batch_closes_logs_as_jobs_finish(self):
+        """Ensure a batch keeps only its running jobs' log files open."""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "jobs.txt")
+            with open(path, "w") as f:
+                f.write("true\n" * 20)
+            args = main.parse_args([
+                "--batch", path, "--concurrency", "2",
+                "--runner-log", os.path.join(tmp, "{name}.log"),
+                "--ps-log", os.path.join(tmp, "{name}.ps"),
+                "--sample-interval", "0.01"])
+            opened = []
+            get_log = main.cli_log.get_log
+
+            def count(*args):
+                opened.append(len(main.cli_log.SINKS))
+                return get_log(*args)
+
+            p = patch("{}.cli_log.get_log".format(main.__name__), count)
+            with p:
+                main.run_batch(args)
+            self.assertEqual(len(opened), 80)
+            self.assertLessEqual(max(opened), 4)
+            self.assertEqual(main.cli_log.SINKS, {})
+            self.assertEqual(main.cli_log.REFS, {})
+            self.assertEqual(len(os.listdir(tmp)), 41)
+
+    def test_run_batch_with_bad_backend(self):
+        """Ensure ``run_batch()`` exits if the backend is not supported."""
+        args = main.parse_args(["--batch", "-"])
+        p1 = patch("{}.sys.stdin".format(main.__name__), ["echo one"])
+        p2 = patch("{}.batch.run".format(main.__name__))
+        with p1, p2 as batch_run, self.assertRaises(SystemExit):
+            batch_run.side_effect = ValueError("dummy-error")
+            main.run_batch(args)
+
+    def test_run_batch_with_bad_jobs(self):
+        """Ensure ``run_batch()`` exits if it cannot read the jobs."""
+        args = main.parse_args(["--batch", "/dummy/path"])
+        with self.assertRaises(SystemExit):
+            main.run_batch(args)
+
+        args = main.parse_args(["--batch", "-"])
+        p = patch("{}.sys.stdin".format(main.__name__), ["{bad json"])
+        with p, self.assertRaises(SystemExit):
+            main.run_batch(args)
+
+    def test_cli_with_batch(self):
+        """Ensure ``cli()`` runs a batch if asked."""
+        args = Mock(batch="-", profile=None)
+        p1 = patch("{}.parse_args".format(main.__name__))
+        p2 = patch("{}.run_batch".format(main.__name__))
+        with p1 as parse_args, p2 as run_batch:
+            parse_args.return_value = args
+            main.cli()
+            run_batch.assert_called_once_with(args)
+
+    def test_cli_with_profile(self):
+        """Ensure ``cli()`` profiles itself if asked."""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "psrun.prof")
+            args = Mock(batch="-", profile=path)
+            p1 = patch("{}.parse_args".format(main.__name__))
+            p2 = patch("{}.run_batch".format(main.__name__))
+            with p1 as parse_args, p2 as run_batch:
+                parse_args.return_value = args
+                main.cli()
+                run_batch.assert_called_once_with(args)
+
+            stats = pstats.Stats(path)
+            names = [func[2] for func in stats.stats]
+            self.assertIn("run", names)
+
     def test_get_log_or_exit(self):
         """Ensure ``test_get_log_or_exit()`` returns a log."""
         log = Mock()
@@ -63,6 +422,88 @@ class TestMain(TestCase):
             with self.assertRaises(SystemExit):
                 main.get_log_or_exit(*args)
 
+    def test_get_fd_or_exit(self):
+        """Ensure ``get_fd_or_exit()`` returns a file descriptor."""
+        p = patch("{}.cli_log.get_fd".format(main.__name__))
+        with p as get_fd:
+            get_fd.return_value = 5
+            result = main.get_fd_or_exit("stdout", None, None)
+            self.assertEqual(result, 5)
+            get_fd.assert_called_once_with("stdout")
+
+    def test_get_fd_or_exit_with_error(self):
+        """Ensure ``get_fd_or_exit()`` exits on errors and rotation."""
+        p = patch("{}.cli_log.get_fd".format(main.__name__))
+        with p as get_fd:
+            get_fd.side_effect = OSError
+            with self.assertRaises(SystemExit):
+                main.get_fd_or_exit("/dummy/path", None, None)
+            with self.assertRaises(SystemExit):
+                main.get_fd_or_exit("/dummy/path", 1000, None)
+
+    def test_get_output_or_exit(self):
+        """Ensure ``get_output_or_exit()`` dispatches on the mode."""
+        p1 = patch("{}.get_raw_fd".format(main.__name__))
+        p2 = patch("{}.cli_log.get_log".format(main.__name__))
+        with p1 as get_raw_fd, p2 as get_log:
+            result = main.get_output_or_exit("raw", "name", "stdout", 1, 2)
+            self.assertEqual(result, get_raw_fd.return_value)
+            get_raw_fd.assert_called_once_with("stdout", 1, 2)
+
+            result = main.get_output_or_exit("line", "name", "stdout", 1, 2)
+            self.assertEqual(result, get_log.return_value)
+            get_log.assert_called_once_with("name", "stdout", 1, 2)
+
+    def test_get_ps_log_or_exit(self):
+        """Ensure ``get_ps_log_or_exit()`` gets a log for the format."""
+        p1 = patch("{}.cli_log.get_log".format(main.__name__))
+        p2 = patch("{}.cli_log.get_columnar_log".format(main.__name__))
+        with p1 as get_log, p2 as get_columnar_log:
+            result = main.get_ps_log_or_exit(
+                "compact", "ps_log", "stdout", 1, 2)
+            self.assertEqual(result, get_log.return_value)
+            get_log.assert_called_once_with("ps_log", "stdout", 1, 2)
+
+            result = main.get_ps_log_or_exit(
+                "columnar", "ps_log", "/dummy/path", None, None)
+            self.assertEqual(result, get_columnar_log.return_value)
+            get_columnar_log.assert_called_once_with("/dummy/path")
+
+    def test_get_ps_log_or_exit_with_error(self):
+        """Ensure ``get_ps_log_or_exit()`` exits if it cannot write."""
+        p = patch("{}.cli_log.get_columnar_log".format(main.__name__))
+        with p as get_columnar_log:
+            get_columnar_log.side_effect = OSError
+            for output, max_bytes in [
+                    ("stdout", None), ("/dummy/path", 1000),
+                    ("/dummy/path", None)]:
+                with self.assertRaises(SystemExit):
+                    main.get_ps_log_or_exit(
+                        "columnar", "ps_log", output, max_bytes, None)
+
+    def test_get_ps_encoder(self):
+        """Ensure ``get_ps_encoder()`` gets an encoder for the format."""
+        self.assertIsNone(main.get_ps_encoder("json"))
+        self.assertIs(main.get_ps_encoder("columnar"), columnar.encode)
+        self.assertTrue(callable(main.get_ps_encoder("compact")))
+
+    def test_get_output_or_exit_in_direct_mode(self):
+        """Ensure direct mode redirects to a fd, unless it has to rotate."""
+        p1 = patch("{}.cli_log.get_fd".format(main.__name__))
+        p2 = patch("{}.cli_log.get_log".format(main.__name__))
+        with p1 as get_fd, p2 as get_log:
+            get_fd.return_value = 5
+            result = main.get_output_or_exit(
+                "direct", "name", "/dummy/path", None, None)
+            self.assertEqual(result, stream.Redirect(5))
+            get_fd.assert_called_once_with("/dummy/path")
+
+            result = main.get_output_or_exit(
+                "direct", "name", "/dummy/path", 1, None)
+            self.assertEqual(result, get_log.return_value)
+            get_log.assert_called_once_with(
+                "name", "/dummy/path", 1, None)
+
     def test_cli(self):
         """Ensure ``cli()`` invokes the main program."""
         runner_log = Mock()
@@ -72,7 +513,14 @@ class TestMain(TestCase):
 
         args = Mock(
             CMD="cmd -al", timeout=None, shutdown=30, runner_log=runner_log,
-            ps_log=ps_log, stdout_log=stdout_log, stderr_log=stderr_log)
+            ps_log=ps_log, stdout_log=stdout_log, stderr_log=stderr_log,
+            ps_log_format="json", collectors=None, sample_interval=0.1,
+            max_sample_interval=None, max_rss=None, cpu_timeout=None,
+            idle_timeout=None,
+            output_mode="line", buffer_size=0, buffer_policy="block",
+            ps_summary="none", ps_history=0, collector_backend="psutil",
+            cgroup=False, cgroup_cpus=None, cgroup_memory_max=None,
+            batch=None, profile=None)
 
         p1 = patch("{}.parse_args".format(main.__name__))
         p2 = patch("{}.cli_log.get_log".format(main.__name__))
@@ -84,12 +532,60 @@ class TestMain(TestCase):
             main.cli()
             main_run.assert_called_once_with(
                 cmd=args.CMD, timeout=args.timeout, shutdown=args.shutdown,
+                cpu_timeout=args.cpu_timeout,
+                idle_timeout=args.idle_timeout, max_rss=args.max_rss,
                 runner_log=args.runner_log, ps_log=args.ps_log,
-                stdout_log=args.stdout_log, stderr_log=args.stderr_log)
+                stdout_log=args.stdout_log, stderr_log=args.stderr_log,
+                collectors=args.collectors,
+                sample_interval=args.sample_interval,
+                max_sample_interval=args.max_sample_interval,
+                buffer_size=args.buffer_size,
+                buffer_policy=args.buffer_policy, sampler=ANY, summary=None,
+                history=None, cgroup=None)
+            _, kwargs = main_run.call_args
+            self.assertEqual(
+                kwargs["sampler"].funcs, monitor.get_funcs())
+
+    def test_cli_with_bad_backend(self):
+        """Ensure ``cli()`` exits if the backend is not supported."""
+        args = main.parse_args(["cmd", "--collector-backend", "procfs"])
+        p1 = patch("{}.parse_args".format(main.__name__))
+        p2 = patch("{}.monitor.procfs.is_supported".format(main.__name__))
+        p3 = patch("{}.main.run".format(main.__name__))
+        with p1 as parse_args, p2 as is_supported, p3 as main_run:
+            parse_args.return_value = args
+            is_supported.return_value = False
+            with self.assertRaises(SystemExit):
+                main.cli()
+            main_run.assert_not_called()
+
+    def test_cli_with_compact_ps_log(self):
+        """Ensure ``cli()`` sets up a compact encoder if asked."""
+        args = Mock(
+            CMD="cmd -al", ps_log_format="compact", ps_history=0,
+            collectors=None, collector_backend="psutil", cgroup=False,
+            cgroup_cpus=None, cgroup_memory_max=None, batch=None,
+            profile=None)
+        encoder = Mock()
+
+        p1 = patch("{}.parse_args".format(main.__name__))
+        p2 = patch("{}.cli_log.get_log".format(main.__name__))
+        p3 = patch("{}.main.run".format(main.__name__))
+        p4 = patch("{}.compact.get_encoder".format(main.__name__))
+        with p1 as parse_args, p2, p3 as main_run, p4 as get_encoder:
+            parse_args.return_value = args
+            get_encoder.return_value = encoder
+
+            main.cli()
+            _, kwargs = main_run.call_args
+            self.assertEqual(kwargs["ps_encode"], encoder)
 
     def test_cli_catches_main_errors(self):
         """Ensure ``cli()`` catches ``run()`` errors."""
-        args = Mock(CMD="cmd -al")
+        args = Mock(
+            CMD="cmd -al", ps_history=0, collectors=None,
+            collector_backend="psutil", cgroup=False, cgroup_cpus=None,
+            cgroup_memory_max=None, batch=None, profile=None)
         log = Mock()
         p1 = patch("{}.parse_args".format(main.__name__))
         p2 = patch("{}.cli_log.get_log".format(main.__name__))
@@ -0,0 +1,15 @@
+"""Records like the ones ``monitor.collect()`` gathers, for the tests."""
+
+
+def get_record(cgroup=None, **process):
+    """Get a record of pid 10, with the given process (and cgroup) stats.
+
+    The process also lists its ``pids``, as ``monitor.collect()`` does.
+    That is not a stat, so it should be left out of anything computed
+    from the stats.
+
+    """
+    data = {"pid": 10, "process": dict(process, pids=[10])}
+    if cgroup is not None:
+        data["cgroup"] = cgroup
+    return data
@@ -0,0 +1,60 @@
+"""Unit tests for the ``lib.adaptive`` module."""
+
+from unittest import TestCase
+
+from psrun.lib import adaptive
+
+from .records import get_record
+
+
+class TestAdaptive(TestCase):
+    """Test suite for the ``lib.adaptive`` module."""
+
+    def test_get_metrics(self):
+        """Ensure ``get_metrics()`` gets the RSS and CPU use, if any."""
+        result = adaptive.get_metrics(get_record(rss=100, cpu_percent=5.0))
+        self.assertEqual(result, (100, 5.0))
+        self.assertEqual(adaptive.get_metrics({"pid": 10}), (0, 0.0))
+        self.assertIsNone(adaptive.get_metrics(None))
+
+    def test_is_steady(self):
+        """Ensure ``is_steady()`` spots RSS jumps and CPU swings."""
+        self.assertTrue(adaptive.is_steady((100, 50.0), (105, 55.0)))
+        self.assertFalse(adaptive.is_steady((100, 50.0), (150, 50.0)))
+        self.assertFalse(adaptive.is_steady((100, 50.0), (50, 50.0)))
+        self.assertFalse(adaptive.is_steady((100, 50.0), (100, 80.0)))
+        self.assertTrue(adaptive.is_steady((0, 0.0), (0, 0.0)))
+
+    def test_interval_backs_off(self):
+        """Ensure an ``Interval`` waits longer while things are steady."""
+        interval = adaptive.Interval(0.1, 1)
+        result = [interval.next(get_record(rss=100)) for _ in range(6)]
+        self.assertEqual(result, [0.1, 0.2, 0.4, 0.8, 1, 1])
+
+    def test_interval_speeds_up(self):
+        """Ensure an ``Interval`` is back to the min when things change."""
+        interval = adaptive.Interval(0.1, 1)
+        for _ in range(5):
+            interval.next(get_record(rss=100))
+        self.assertEqual(interval.next(get_record(rss=200)), 0.1)
+        self.assertEqual(interval.next(get_record(rss=200)), 0.2)
+        data = get_record(rss=200, cpu_percent=90.0)
+        self.assertEqual(interval.next(data), 0.1)
+
+    def test_interval_after_errors(self):
+        """Ensure an ``Interval`` keeps its pace when a sample fails."""
+        interval = adaptive.Interval(0.1, 1)
+        self.assertEqual(interval.next(None), 0.1)
+        interval.next(get_record(rss=100))
+        interval.next(get_record(rss=100))
+        self.assertEqual(interval.next(None), 0.2)
+        self.assertEqual(interval.next(get_record(rss=100)), 0.4)
+
+    def test_fixed_interval(self):
+        """Ensure an ``Interval`` without a max never changes."""
+        for interval in [adaptive.Interval(0.1), adaptive.Interval(1, 0.5)]:
+            self.assertEqual(interval.max_interval, interval.min_interval)
+            self.assertEqual(
+                interval.next(get_record(rss=100)), interval.min_interval)
+            self.assertEqual(
+                interval.next(get_record(rss=900)), interval.min_interval)
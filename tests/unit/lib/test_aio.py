@@ -0,0 +1,378 @@
+"""Unit tests for the ``lib.aio`` module."""
+
+from unittest import TestCase
+from unittest.mock import ANY, patch, Mock
+
+import asyncio
+import gc
+import json
+import os
+import tempfile
+
+from psrun.lib import aio
+from psrun.lib import cgroup as cgroup_lib
+from psrun.lib import exceptions
+from psrun.lib import history as history_lib
+from psrun.lib import overhead as overhead_lib
+from psrun.lib import proc
+from psrun.lib import stream
+from psrun.lib import summary as summary_lib
+
+
+class TestAio(TestCase):
+    """Test suite for the ``lib.aio`` module."""
+
+    def test_run_in_a_cgroup(self):
+        """Ensure ``run()`` runs a process in a cgroup, and removes it."""
+        runner_data = []
+        ps_data = []
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "psrun-1")
+            os.mkdir(path)
+            with open(os.path.join(path, "cpu.stat"), "w") as f:
+                f.write("usage_usec 3\nuser_usec 2000\nsystem_usec 1000\n")
+            cgroup = cgroup_lib.Cgroup(path)
+            p = patch.object(cgroup, "remove", wraps=cgroup.remove)
+            with p as remove:
+                asyncio.run(aio.run(
+                    "true", None, None, runner_data.append, ps_data.append,
+                    Mock(), Mock(), cgroup=cgroup))
+                remove.assert_called_once_with()
+        self.assertIn("-- Cgroup CPU time: 2ms user, 1ms system", runner_data)
+        self.assertIn('"cgroup": {"cpu_system": 0.001', ps_data[-1])
+
+    def test_run_when_cannot_join_the_cgroup(self):
+        """Ensure ``run()`` reports a process that is not in its cgroup."""
+        runner_data = []
+        with tempfile.TemporaryDirectory() as tmp:
+            cgroup = cgroup_lib.Cgroup(os.path.join(tmp, "missing"))
+            asyncio.run(aio.run(
+                "true", None, None, runner_data.append, Mock(), Mock(),
+                Mock(), cgroup=cgroup))
+        self.assertIn(
+            "-- ERROR: Cannot move the process into the cgroup",
+            runner_data[-1])
+
+    def test_read_line(self):
+        """Ensure ``read_line()`` reads lines, long lines, and the end."""
+        async def read():
+            reader = asyncio.StreamReader(limit=8)
+            reader.feed_data(b"short\nvery long line\npartial")
+            reader.feed_eof()
+            lines = []
+            line = await aio.read_line(reader)
+            while line:
+                lines.append(line)
+                line = await aio.read_line(reader)
+            return lines
+
+        result = asyncio.run(read())
+        self.assertEqual(b"".join(result), b"short\nvery long line\npartial")
+        self.assertEqual(result[0], b"short\n")
+        self.assertEqual(result[-1], b"partial")
+
+    def test_read_lines_with_bad_utf8(self):
+        """Ensure ``read_lines()`` reads past bytes it cannot decode."""
+        data = []
+
+        async def read():
+            reader = asyncio.StreamReader()
+            reader.feed_data(b"bad \xff byte\nnext\n")
+            reader.feed_eof()
+            await aio.read_lines(
+                reader, data.append, "stdout", overhead_lib.Overhead())
+
+        asyncio.run(read())
+        self.assertEqual(data, ["bad \ufffd byte", "next"])
+
+    def test_copy_chunks(self):
+        """Ensure ``copy_chunks()`` copies raw bytes."""
+        dest_r, dest_w = os.pipe()
+
+        async def copy(fd):
+            reader = asyncio.StreamReader()
+            reader.feed_data(b"raw \xff bytes")
+            reader.feed_eof()
+            await aio.copy_chunks(reader, fd)
+
+        asyncio.run(copy(dest_w))
+        os.close(dest_w)
+        with os.fdopen(dest_r, "rb") as dest:
+            self.assertEqual(dest.read(), b"raw \xff bytes")
+
+        p1 = patch("{}.stream.write_all".format(aio.__name__))
+        p2 = patch("{}.constants.CHUNK_SIZE".format(aio.__name__), 2)
+        with p1 as write_all, p2:
+            write_all.side_effect = BrokenPipeError
+            asyncio.run(copy(99))
+            self.assertEqual(write_all.call_count, 1)
+
+    def test_sample(self):
+        """Ensure ``sample()`` checks each sample against the limits."""
+        peaks = {}
+        p = patch("{}.proc.try_monitor".format(aio.__name__))
+        with p as try_monitor:
+            try_monitor.return_value = {"pid": 10, "process": {"rss": 2048}}
+            with self.assertRaises(exceptions.ProcMaxRss):
+                asyncio.run(aio.sample(
+                    Mock(), 10, {}, None, Mock(), Mock(), max_rss=1024,
+                    cmd="some-cmd", peaks=peaks))
+            self.assertEqual(peaks, {"rss": 2048})
+            with self.assertRaises(exceptions.ProcMaxRss):
+                asyncio.run(aio.sample(
+                    Mock(), 10, {}, None, Mock(), Mock(), max_rss=1024,
+                    cmd="some-cmd"))
+            try_monitor.assert_called_with(
+                ANY, 10, {}, None, ANY, None, None, None)
+
+    def test_sample_with_watchdog(self):
+        """Ensure ``sample()`` counts forwarded output as activity."""
+        overhead = overhead_lib.Overhead()
+        watchdog = Mock()
+        watchdog.check.side_effect = [None, "Idle for more than 5 secs"]
+        overhead.count("stdout", 3, 30)
+        overhead.count("stderr", 1, 10)
+        interval = Mock()
+        interval.next.return_value = 0
+        p = patch("{}.proc.try_monitor".format(aio.__name__))
+        with p as try_monitor, self.assertRaises(exceptions.ProcTimeout) as e:
+            try_monitor.return_value = {"pid": 10}
+            asyncio.run(aio.sample(
+                Mock(), 10, {}, None, Mock(), interval, cmd=["ls", "-la"],
+                watchdog=watchdog, overhead=overhead))
+        self.assertEqual(
+            str(e.exception), "Idle for more than 5 secs: ls -la")
+        watchdog.check.assert_called_with({"pid": 10}, 4)
+
+    def test_execute(self):
+        """Ensure ``execute()`` runs a command, and forwards its output."""
+        stdout_data = []
+        stderr_data = []
+        ps_data = []
+        cmd = "echo out; echo err >&2; sleep 0.2; exit 3"
+
+        result = asyncio.run(aio.execute(
+            cmd, stdout_data.append, stderr_data.append, ps_data.append,
+            None, None, sample_interval=0.05))
+
+        exit_code, running_time, details = result
+        self.assertEqual(exit_code, 3)
+        self.assertGreaterEqual(running_time, 200)
+        self.assertIn("Child CPU time", details)
+        self.assertNotIn("Psrun CPU time", details)
+        self.assertIn("Sampling", details)
+        self.assertEqual(details["Forwarded stdout"], "1 lines, 4 bytes")
+        self.assertEqual(details["Forwarded stderr"], "1 lines, 4 bytes")
+        self.assertNotEqual(details["Max sampled RSS"], "0 KiB")
+        self.assertEqual(stdout_data, ["out"])
+        self.assertEqual(stderr_data, ["err"])
+        self.assertGreater(len(ps_data), 2)
+
+    def test_execute_without_pidfds(self):
+        """Ensure ``execute()`` polls for the exit without a pidfd."""
+        p = patch(
+            "{}.proc.open_exit_fd".format(aio.__name__), return_value=None)
+        with p:
+            result = asyncio.run(aio.execute(
+                "sleep 0.2; exit 3", Mock(), Mock(), Mock(), None, None))
+        self.assertEqual(result[0], 3)
+        self.assertIn("Child CPU time", result[2])
+
+    def test_execute_waits_for_eof_for_a_time(self):
+        """Ensure ``execute()`` gives up on pipes held open by children."""
+        stdout_data = []
+        p = patch("{}.constants.EOF_TIMEOUT".format(aio.__name__), 0.1)
+        with p:
+            exit_code, running_time, _ = asyncio.run(aio.execute(
+                "sleep 2 & echo out", stdout_data.append, Mock(), Mock(),
+                None, None))
+        self.assertEqual(exit_code, 0)
+        self.assertLess(running_time, 1000)
+        self.assertEqual(stdout_data, ["out"])
+
+    def test_execute_with_adaptive_interval(self):
+        """Ensure ``execute()`` samples a steady process less often."""
+        ps_data = []
+        asyncio.run(aio.execute(
+            "sleep 0.5", Mock(), Mock(), ps_data.append, None, None,
+            sample_interval=0.01, max_sample_interval=0.16))
+        self.assertGreater(len(ps_data), 4)
+        self.assertLess(len(ps_data), 15)
+
+    def test_execute_with_adaptive_interval_and_max_rss(self):
+        """Ensure ``execute()`` does not back off while checking the RSS."""
+        ps_data = []
+        asyncio.run(aio.execute(
+            "sleep 0.5", Mock(), Mock(), ps_data.append, None, None,
+            sample_interval=0.01, max_sample_interval=0.16,
+            max_rss=2 ** 40))
+        self.assertGreater(len(ps_data), 15)
+
+    def test_execute_in_raw_mode(self):
+        """Ensure ``execute()`` copies output to file descriptors."""
+        dest_r, dest_w = os.pipe()
+        result = asyncio.run(aio.execute(
+            "printf 'raw'", dest_w, Mock(), Mock(), None, None))
+        os.close(dest_w)
+        with os.fdopen(dest_r, "rb") as dest:
+            self.assertEqual(dest.read(), b"raw")
+        self.assertEqual(result[0], 0)
+
+    def test_execute_in_direct_mode(self):
+        """Ensure ``execute()`` lets processes write to fds themselves."""
+        dest_r, dest_w = os.pipe()
+        redirect = stream.Redirect(dest_w)
+        result = asyncio.run(aio.execute(
+            "echo out; echo err >&2", redirect, redirect, Mock(), None, None))
+        os.close(dest_w)
+        with os.fdopen(dest_r, "rb") as dest:
+            self.assertEqual(dest.read(), b"out\nerr\n")
+        self.assertEqual(result[0], 0)
+
+    def test_execute_with_timeout(self):
+        """Ensure ``execute()`` stops processes that time out."""
+        with self.assertRaises(exceptions.ProcTimeout):
+            asyncio.run(aio.execute(
+                "exec sleep 5", Mock(), Mock(), Mock(), 0.1, 1))
+
+    def test_execute_with_max_rss(self):
+        """Ensure ``execute()`` stops processes that use too much RSS."""
+        with self.assertRaises(exceptions.ProcMaxRss) as context:
+            asyncio.run(aio.execute(
+                "exec sleep 5", Mock(), Mock(), Mock(), None, 1,
+                sample_interval=0.05, max_rss=1024))
+        self.assertIn("over the max of 1024: exec sleep 5",
+                      str(context.exception))
+
+    def test_execute_under_max_rss(self):
+        """Ensure ``execute()`` lets processes under ``max_rss`` finish."""
+        result = asyncio.run(aio.execute(
+            "sleep 0.1", Mock(), Mock(), Mock(), None, 1,
+            sample_interval=0.02, max_rss=2 ** 40))
+        self.assertEqual(result[0], 0)
+
+    def test_execute_with_cpu_timeout(self):
+        """Ensure ``execute()`` stops processes that use too much CPU."""
+        with self.assertRaises(exceptions.ProcTimeout) as context:
+            asyncio.run(aio.execute(
+                "while :; do :; done", Mock(), Mock(), Mock(), 5, 1,
+                sample_interval=0.05, cpu_timeout=0.2))
+        self.assertIn("Used more than 0.2 CPU secs", str(context.exception))
+
+    def test_execute_with_idle_timeout(self):
+        """Ensure ``execute()`` stops processes that stall."""
+        with self.assertRaises(exceptions.ProcTimeout) as context:
+            asyncio.run(aio.execute(
+                "exec sleep 5", Mock(), Mock(), Mock(), None, 1,
+                sample_interval=0.05, idle_timeout=0.2))
+        self.assertIn("Idle for more than 0.2 secs", str(context.exception))
+
+    def test_stop_and_kill(self):
+        """Ensure ``stop()`` kills a process after a time."""
+        async def stop():
+            p = proc.start("trap '' TERM; sleep 5", None, None)
+            await asyncio.sleep(0.1)
+            return await aio.stop(p, 0.1)
+
+        self.assertEqual(asyncio.run(stop()), -9)
+
+    def test_stop_when_reaped(self):
+        """Ensure ``stop()`` leaves processes that were reaped alone."""
+        p = Mock(returncode=0)
+        self.assertEqual(asyncio.run(aio.stop(p, 0.1)), 0)
+
+    def test_get_timeout(self):
+        """Ensure ``get_timeout()`` only takes a number of secs."""
+        self.assertEqual(aio.get_timeout(0.5), 0.5)
+        self.assertIsNone(aio.get_timeout(0))
+        self.assertIsNone(aio.get_timeout(None))
+        for secs in ["5", True]:
+            with self.assertRaises(ValueError) as context:
+                aio.get_timeout(secs)
+            self.assertEqual(
+                str(context.exception), "Bad timeout: {}".format(secs))
+
+    def test_wait_with_bad_timeout(self):
+        """Ensure ``wait()`` checks the timeout before it reaps."""
+        with patch("{}.reap".format(aio.__name__)) as reap:
+            with self.assertRaises(ValueError):
+                asyncio.run(aio.wait(Mock(), "5", None, "some-cmd"))
+            reap.assert_not_called()
+
+    def test_execute_with_bad_timeout(self):
+        """Ensure ``execute()`` checks the timeouts before it starts."""
+        with patch("{}.proc.start".format(aio.__name__)) as start:
+            with self.assertRaises(ValueError):
+                asyncio.run(aio.execute(
+                    "true", Mock(), Mock(), Mock(), None, "1"))
+            start.assert_not_called()
+
+    def test_cancel(self):
+        """Ensure ``cancel()`` leaves no exception unretrieved."""
+        errors = []
+
+        async def cancel():
+            loop = asyncio.get_running_loop()
+            loop.set_exception_handler(lambda _, context: errors.append(
+                context["message"]))
+            task = asyncio.gather(asyncio.sleep(5))
+            await aio.cancel(task)
+            del task
+            gc.collect()
+
+        asyncio.run(cancel())
+        self.assertEqual(errors, [])
+
+    def test_run(self):
+        """Ensure ``run()`` reports on the command."""
+        runner_data = []
+        asyncio.run(aio.run(
+            "true", None, None, runner_data.append, Mock(), Mock(), Mock()))
+        self.assertIn("-- Exit code: 0", runner_data)
+
+    def test_run_writes_summary(self):
+        """Ensure ``run()`` writes a summary of the samples."""
+        ps_data = []
+        summary = summary_lib.Summary(ps_data.append, samples=False)
+        asyncio.run(aio.run(
+            "sleep 0.1", None, None, Mock(), ps_data.append, Mock(), Mock(),
+            sample_interval=0.02, summary=summary))
+        self.assertEqual(len(ps_data), 1)
+        record = json.loads(ps_data[0])
+        self.assertGreater(record["samples"], 2)
+        self.assertGreater(record["summary"]["process/rss"]["max"], 0)
+
+    def test_run_writes_history(self):
+        """Ensure ``run()`` keeps a history of the samples, and writes it."""
+        ps_data = []
+        history = history_lib.History(log=ps_data.append)
+        asyncio.run(aio.run(
+            "sleep 0.1", None, None, Mock(), Mock(), Mock(), Mock(),
+            sample_interval=0.02, history=history))
+        self.assertGreater(len(history), 2)
+        self.assertEqual(len(ps_data), 1)
+        record = json.loads(ps_data[0])
+        self.assertEqual(len(record["history"]["time"]), len(history))
+
+    def test_run_when_permission_denied(self):
+        """Ensure ``run()`` reports commands it cannot execute."""
+        runner_data = []
+        p = patch("{}.subprocess.Popen".format(proc.__name__))
+        with p as popen:
+            popen.side_effect = PermissionError
+            asyncio.run(aio.run(
+                "dummy command", None, None, runner_data.append, Mock(),
+                Mock(), Mock()))
+        self.assertEqual(
+            runner_data[-1],
+            "-- ERROR: Permission denied. Cannot execute: dummy command")
+
+    def test_run_handles_errors(self):
+        """Ensure ``run()`` reports errors."""
+        runner_data = []
+        p = patch("{}.execute".format(aio.__name__))
+        with p as execute:
+            execute.side_effect = exceptions.ProcTimeout("dummy-error")
+            asyncio.run(aio.run(
+                "true", 1, 1, runner_data.append, Mock(), Mock(), Mock()))
+        self.assertEqual(runner_data[-1], "-- ERROR: dummy-error")
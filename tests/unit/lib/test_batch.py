@@ -0,0 +1,197 @@
+"""Unit tests for the ``lib.batch`` module."""
+
+from unittest import TestCase
+from unittest.mock import call, patch, MagicMock, Mock
+
+import asyncio
+
+from contextlib import contextmanager
+
+from psrun.lib import batch
+from psrun.lib import exceptions
+
+
+class TestBatch(TestCase):
+    """Test suite for the ``lib.batch`` module."""
+
+    def test_read_jobs(self):
+        """Ensure ``read_jobs()`` reads plain and JSON jobs."""
+        lines = [
+            "ls -la\n", "\n", "# A comment\n",
+            '{"cmd": "make", "timeout": 5, "name": "build"}\n', "true"]
+        result = batch.read_jobs(lines)
+        self.assertEqual(result, [
+            {"cmd": "ls -la", "name": "1"},
+            {"cmd": "make", "timeout": 5, "name": "build"},
+            {"cmd": "true", "name": "3"}])
+
+    def test_read_jobs_with_bad_lines(self):
+        """Ensure ``read_jobs()`` rejects bad jobs."""
+        bad_lines = [
+            "{not json", '{"timeout": 5}', '{"cmd": "ls", "bogus": 1}']
+        for line in bad_lines:
+            with self.assertRaises(ValueError):
+                batch.read_jobs(["true", line])
+
+    def test_read_jobs_with_bad_limits(self):
+        """Ensure ``read_jobs()`` rejects limits that are not above 0."""
+        for value in ["-5", "0", '"10"', "true"]:
+            for key in batch.LIMIT_KEYS:
+                line = '{{"cmd": "ls", "{}": {}}}'.format(key, value)
+                with self.assertRaises(ValueError) as context:
+                    batch.read_jobs([line])
+                self.assertIn("Line 1: {}".format(key), str(context.exception))
+        result = batch.read_jobs(['{"cmd": "ls", "cpu_timeout": null}'])
+        self.assertIsNone(result[0]["cpu_timeout"])
+        result = batch.read_jobs(['{"cmd": "ls", "idle_timeout": 1.5}'])
+        self.assertEqual(result[0]["idle_timeout"], 1.5)
+        with self.assertRaises(ValueError) as context:
+            batch.read_jobs(['{"cmd": "ls", "shutdown": 0}'])
+        self.assertEqual(
+            str(context.exception),
+            "Line 1: shutdown must be a number above 0: 0")
+        with self.assertRaises(ValueError) as context:
+            batch.read_jobs(['{"cmd": "ls", "max_rss": 1.5}'])
+        self.assertEqual(
+            str(context.exception),
+            "Line 1: max_rss must be a whole number above 0: 1.5")
+        result = batch.read_jobs(['{"cmd": "ls", "max_rss": 1024}'])
+        self.assertEqual(result[0]["max_rss"], 1024)
+
+    def test_read_jobs_with_bad_logs(self):
+        """Ensure ``read_jobs()`` rejects logs it cannot name the job in."""
+        for value in ["5", '"{nam}.log"', '"{0}.log"', '"{name.x}"', '"{"']:
+            for key in batch.LOG_KEYS:
+                line = '{{"cmd": "ls", "{}": {}}}'.format(key, value)
+                with self.assertRaises(ValueError) as context:
+                    batch.read_jobs([line])
+                self.assertIn("Line 1: {}".format(key), str(context.exception))
+        result = batch.read_jobs(['{"cmd": "ls", "ps_log": "/tmp/{name}"}'])
+        self.assertEqual(result[0]["ps_log"], "/tmp/{name}")
+
+    def test_run(self):
+        """Ensure ``run()`` runs jobs concurrently, sharing a sampler."""
+        logs = [[] for _ in range(3)]
+        jobs = [
+            {"cmd": "sleep 0.3", "timeout": None, "shutdown": None,
+             "runner_log": log.append, "ps_log": Mock(),
+             "stdout_log": Mock(), "stderr_log": Mock()}
+            for log in logs]
+
+        p = patch("{}.monitor.SharedSampler".format(batch.__name__))
+        with p as SharedSampler:
+            SharedSampler.return_value = MagicMock()
+            loop = asyncio.new_event_loop()
+            start = loop.time()
+            loop.run_until_complete(batch.run(jobs, 3, sample_interval=0.1))
+            elapsed = loop.time() - start
+            loop.close()
+
+            SharedSampler.assert_called_once_with(None, 0.1, None)
+            sampler = SharedSampler.return_value
+            sampler.__enter__.assert_called_once_with()
+            sampler.__exit__.assert_called_once_with(None, None, None)
+
+        self.assertLess(elapsed, 0.6)
+        for log in logs:
+            self.assertIn("-- Exit code: 0", log)
+
+    def test_run_limits_concurrency(self):
+        """Ensure ``run()`` runs at most ``concurrency`` jobs at once."""
+        running = []
+        peak = []
+
+        async def run(**params):
+            running.append(None)
+            peak.append(len(running))
+            await asyncio.sleep(0.01)
+            running.pop()
+
+        p = patch("{}.aio.run".format(batch.__name__), run)
+        with p:
+            jobs = [{"runner_log": Mock()} for _ in range(5)]
+            asyncio.run(batch.run(jobs, 2))
+        self.assertEqual(max(peak), 2)
+        self.assertEqual(len(peak), 5)
+
+    def test_run_opens_jobs_as_they_start(self):
+        """Ensure ``run()`` opens each job only while it runs."""
+        events = []
+
+        async def run(**params):
+            events.append(("run", params["name"]))
+            self.assertIn("sampler", params)
+
+        @contextmanager
+        def open_job(job, num):
+            events.append(("open", num))
+            yield {"name": job["name"], "runner_log": Mock()}
+            events.append(("close", num))
+
+        p = patch("{}.aio.run".format(batch.__name__), run)
+        with p:
+            jobs = [{"name": "a"}, {"name": "b"}]
+            asyncio.run(batch.run(jobs, 1, open_job=open_job))
+        self.assertEqual(events, [
+            ("open", 1), ("run", "a"), ("close", 1),
+            ("open", 2), ("run", "b"), ("close", 2)])
+
+    def test_run_reports_errors_opening_jobs(self):
+        """Ensure ``run()`` reports a job it cannot open, and goes on."""
+        @contextmanager
+        def open_job(job, num):
+            if "fail" in job:
+                raise job["fail"]
+            yield {"runner_log": Mock()}
+
+        p1 = patch("{}.aio.run".format(batch.__name__))
+        p2 = patch("{}.print".format(batch.__name__), create=True)
+        with p1 as run, p2 as print_:
+            jobs = [
+                {"name": "one", "fail": OSError("dummy-error")},
+                {"fail": KeyError("nam")}, {"name": "three"}]
+            asyncio.run(batch.run(jobs, 1, open_job=open_job))
+            self.assertEqual(run.call_count, 1)
+        print_.assert_has_calls([
+            call("[one] -- ERROR: dummy-error", file=batch.sys.stderr),
+            call("[2] -- ERROR: 'nam'", file=batch.sys.stderr)])
+
+    def test_run_in_cgroups(self):
+        """Ensure ``run()`` creates each job's cgroup when it starts."""
+        created = []
+        cgroups = []
+
+        async def run(**params):
+            cgroups.append(params["cgroup"])
+            self.assertEqual(len(created), len(cgroups))
+
+        p1 = patch("{}.aio.run".format(batch.__name__), run)
+        p2 = patch("{}.cgroup_lib.create".format(batch.__name__))
+        with p1, p2 as create:
+            create.side_effect = lambda *limits: created.append(limits) or (
+                "cgroup-{}".format(len(created)))
+            jobs = [{"runner_log": Mock()} for _ in range(3)]
+            asyncio.run(batch.run(jobs, 1, cgroup_limits=(1.5, None)))
+        self.assertEqual(created, [(1.5, None)] * 3)
+        self.assertEqual(cgroups, ["cgroup-1", "cgroup-2", "cgroup-3"])
+
+    def test_run_without_a_cgroup(self):
+        """Ensure ``run()`` reports a job whose cgroup cannot be created."""
+        data = []
+        p1 = patch("{}.aio.run".format(batch.__name__))
+        p2 = patch("{}.cgroup_lib.create".format(batch.__name__))
+        with p1 as run, p2 as create:
+            create.side_effect = exceptions.CgroupUnavailable("dummy-error")
+            asyncio.run(batch.run(
+                [{"runner_log": data.append}], 1, cgroup_limits=(1, None)))
+            self.assertFalse(run.called)
+        self.assertEqual(data, ["-- ERROR: dummy-error"])
+
+    def test_run_reports_errors(self):
+        """Ensure ``run()`` reports a job's errors to its runner log."""
+        data = []
+        p = patch("{}.aio.run".format(batch.__name__))
+        with p as run:
+            run.side_effect = OSError("dummy-error")
+            asyncio.run(batch.run([{"runner_log": data.append}], 1))
+        self.assertEqual(data, ["-- ERROR: dummy-error"])
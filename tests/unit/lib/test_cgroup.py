@@ -0,0 +1,250 @@
+"""Unit tests for the ``lib.cgroup`` module."""
+
+from unittest import TestCase
+from unittest.mock import patch
+
+import os
+import subprocess
+import tempfile
+
+from psrun.lib import cgroup as cgroup_lib
+from psrun.lib import exceptions
+
+CPU_STAT = b"""usage_usec 3000000
+user_usec 2000000
+system_usec 1000000
+nice_usec 0
+"""
+
+IO_STAT = b"""8:0 rbytes=100 wbytes=200 rios=1 wios=2 dbytes=0 dios=0
+8:16 rbytes=1000 wbytes=2000 rios=10 wios=20 dbytes=0 dios=0
+"""
+
+
+def write(path, contents):
+    """Write a file."""
+    with open(path, "w") as f:
+        f.write(contents)
+
+
+class TestCgroup(TestCase):
+    """Test suite for the ``lib.cgroup`` module."""
+
+    def setUp(self):
+        """Fake a cgroup v2 hierarchy in a temp dir."""
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = tmp.name
+        self.mounts = os.path.join(self.root, "mounts")
+        self.cgroup = os.path.join(self.root, "cgroup")
+        write(self.mounts, "proc /proc proc rw 0 0\n")
+        write(self.cgroup, "1:cpu:/\n")
+        for name in ["cgroup.procs", "cgroup.subtree_control"]:
+            write(os.path.join(self.root, name), "")
+        write(os.path.join(self.root, "cgroup.controllers"), "cpu pids\n")
+        p1 = patch.object(cgroup_lib, "MOUNTS", self.mounts)
+        p2 = patch.object(cgroup_lib, "CGROUP", self.cgroup)
+        for p in [p1, p2]:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def mount(self):
+        """Mount the fake hierarchy, with this process at its root."""
+        with open(self.mounts, "a") as f:
+            f.write("cgroup2 {} cgroup2 rw 0 0\n".format(self.root))
+        with open(self.cgroup, "a") as f:
+            f.write("0::/\n")
+
+    def test_get_root(self):
+        """Ensure ``get_root()`` finds the cgroup v2 mount, if any."""
+        self.assertIsNone(cgroup_lib.get_root())
+        self.mount()
+        self.assertEqual(cgroup_lib.get_root(), self.root)
+
+    def test_get_current(self):
+        """Ensure ``get_current()`` finds this process's cgroup v2."""
+        self.assertEqual(cgroup_lib.get_current(), "/")
+        write(self.cgroup, "1:cpu:/\n0::/user.slice/psrun\n")
+        self.assertEqual(cgroup_lib.get_current(), "/user.slice/psrun")
+
+    def test_get_parent(self):
+        """Ensure ``get_parent()`` skips psrun's own leaf cgroup."""
+        write(self.cgroup, "0::/user.slice\n")
+        self.assertEqual(
+            cgroup_lib.get_parent(self.root),
+            os.path.join(self.root, "user.slice"))
+        write(self.cgroup, "0::/user.slice/psrun-supervisor\n")
+        self.assertEqual(
+            cgroup_lib.get_parent(self.root),
+            os.path.join(self.root, "user.slice"))
+
+    def test_enable_controllers(self):
+        """Ensure ``enable_controllers()`` enables what it can."""
+        written = []
+        real_open = open
+
+        def fake_open(path, mode="r"):
+            if path.endswith("cgroup.subtree_control") and mode == "w":
+                written.append(path)
+                if len(written) > 1:
+                    raise OSError("dummy-error")
+            return real_open(path, mode)
+
+        p = patch("builtins.open", fake_open)
+        with p:
+            errors = cgroup_lib.enable_controllers(self.root, True)
+        self.assertEqual(len(written), 2)
+        subtree_control = os.path.join(self.root, "cgroup.subtree_control")
+        with open(subtree_control) as f:
+            self.assertEqual(f.read(), "+cpu")
+        self.assertEqual(sorted(errors), ["io", "memory", "pids"])
+        self.assertIn("dummy-error", errors["pids"])
+        self.assertIn("Not available", errors["memory"])
+        self.assertFalse(os.path.exists(
+            os.path.join(self.root, cgroup_lib.SUPERVISOR)))
+
+    def test_enable_controllers_outside_the_root(self):
+        """Ensure ``enable_controllers()`` moves psrun into a leaf first."""
+        p = patch("{}.leave".format(cgroup_lib.__name__))
+        with p as leave:
+            cgroup_lib.enable_controllers(self.root)
+            leave.assert_called_once_with(self.root)
+
+            write(os.path.join(self.root, "cgroup.subtree_control"),
+                  "cpu pids\n")
+            leave.reset_mock()
+            self.assertEqual(
+                sorted(cgroup_lib.enable_controllers(self.root)),
+                ["io", "memory"])
+            self.assertFalse(leave.called)
+
+            write(os.path.join(self.root, "cgroup.subtree_control"), "")
+            leave.side_effect = OSError("dummy-error")
+            errors = cgroup_lib.enable_controllers(self.root)
+            self.assertIn("Cannot move psrun", errors["cpu"])
+            self.assertIn("dummy-error", errors["pids"])
+
+    def test_leave(self):
+        """Ensure ``leave()`` moves this process into a leaf cgroup."""
+        cgroup_lib.leave(self.root)
+        cgroup_lib.leave(self.root)
+        procs = os.path.join(self.root, cgroup_lib.SUPERVISOR, "cgroup.procs")
+        with open(procs) as f:
+            self.assertEqual(f.read(), str(os.getpid()))
+
+    def test_create(self):
+        """Ensure ``create()`` makes a cgroup in this process's cgroup."""
+        self.mount()
+        cgroup = cgroup_lib.create()
+        self.assertTrue(os.path.isdir(cgroup.path))
+        self.assertEqual(os.path.dirname(cgroup.path), self.root)
+        self.assertNotEqual(cgroup_lib.create().path, cgroup.path)
+
+    def test_create_with_limits(self):
+        """Ensure ``create()`` sets the limits it is given."""
+        self.mount()
+        p = patch("{}.os.path.exists".format(cgroup_lib.__name__))
+        with p as exists:
+            exists.return_value = True
+            cgroup = cgroup_lib.create(cpus=1.5, memory_max=1024)
+        with open(os.path.join(cgroup.path, "cpu.max")) as f:
+            self.assertEqual(f.read(), "150000 100000")
+        with open(os.path.join(cgroup.path, "memory.max")) as f:
+            self.assertEqual(f.read(), "1024")
+
+    def test_create_without_controllers(self):
+        """Ensure ``create()`` raises if it cannot set the limits."""
+        self.mount()
+        for limits in [{"cpus": 1}, {"memory_max": 1024}]:
+            with self.assertRaises(exceptions.CgroupUnavailable) as context:
+                cgroup_lib.create(**limits)
+            self.assertIn("controller is not enabled", str(context.exception))
+        self.assertIn("Not available", str(context.exception))
+        self.assertEqual(
+            [name for name in os.listdir(self.root) if "psrun" in name], [])
+
+    def test_create_when_unavailable(self):
+        """Ensure ``create()`` raises if the host does not allow it."""
+        with self.assertRaises(exceptions.CgroupUnavailable):
+            cgroup_lib.create()
+
+        self.mount()
+        p = patch("{}.os.access".format(cgroup_lib.__name__))
+        with p as access, self.assertRaises(exceptions.CgroupUnavailable):
+            access.return_value = False
+            cgroup_lib.create()
+
+        p = patch("{}.os.mkdir".format(cgroup_lib.__name__))
+        with p as mkdir, self.assertRaises(exceptions.CgroupUnavailable):
+            mkdir.side_effect = PermissionError
+            cgroup_lib.create()
+
+    def test_wrap(self):
+        """Ensure ``wrap()`` moves a shell into the cgroup, and runs a cmd."""
+        cgroup = cgroup_lib.Cgroup(self.root)
+        result = subprocess.check_output(cgroup.wrap("echo $0"))
+        self.assertEqual(result, b"/bin/sh\n")
+        with open(os.path.join(self.root, "cgroup.procs")) as f:
+            self.assertEqual(f.read(), "0\n")
+
+        result = subprocess.check_output(cgroup.wrap(["echo $0", "arg"]))
+        self.assertEqual(result, b"arg\n")
+
+    def test_wrap_when_cannot_join(self):
+        """Ensure ``wrap()`` does not run a cmd outside of the cgroup."""
+        cgroup = cgroup_lib.Cgroup(os.path.join(self.root, "missing"))
+        result = subprocess.run(
+            cgroup.wrap("echo ran"), stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL)
+        self.assertEqual(result.returncode, cgroup_lib.CANNOT_JOIN)
+        self.assertEqual(result.stdout, b"")
+
+    def test_check_joined(self):
+        """Ensure ``check_joined()`` tells a failed join from a cmd's exit.
+        """
+        cgroup = cgroup_lib.Cgroup(self.root)
+        cgroup.check_joined(0)
+        with self.assertRaises(exceptions.CgroupUnavailable) as context:
+            cgroup.check_joined(cgroup_lib.CANNOT_JOIN)
+        self.assertIn(self.root, str(context.exception))
+
+        cgroup = cgroup_lib.Cgroup(self.root)
+        write(os.path.join(self.root, "cpu.stat"), CPU_STAT.decode("utf-8"))
+        cgroup.check_joined(cgroup_lib.CANNOT_JOIN)
+        cgroup.remove()
+
+    def test_stats(self):
+        """Ensure ``stats()`` reads the whole cgroup's stats."""
+        cgroup = cgroup_lib.Cgroup(self.root)
+        self.addCleanup(cgroup.remove)
+        self.assertEqual(cgroup.stats(), {})
+
+        cgroup = cgroup_lib.Cgroup(self.root)
+        self.addCleanup(cgroup.remove)
+        files = {
+            "cpu.stat": CPU_STAT, "io.stat": IO_STAT,
+            "memory.current": b"4096\n", "memory.peak": b"8192\n",
+            "pids.current": b"3\n"}
+        for name, contents in files.items():
+            write(os.path.join(self.root, name), contents.decode("utf-8"))
+        self.assertEqual(cgroup.stats(), {
+            "cpu_usage": 3.0, "cpu_user": 2.0, "cpu_system": 1.0,
+            "memory_current": 4096, "memory_peak": 8192, "num_procs": 3,
+            "io_read_bytes": 1100, "io_write_bytes": 2200,
+            "io_read_count": 11, "io_write_count": 22})
+
+        write(os.path.join(self.root, "memory.current"), "2048\n")
+        self.assertEqual(cgroup.stats()["memory_current"], 2048)
+
+    def test_remove(self):
+        """Ensure ``remove()`` removes the cgroup, if it is empty."""
+        path = os.path.join(self.root, "psrun-1")
+        os.mkdir(path)
+        cgroup = cgroup_lib.Cgroup(path)
+        cgroup.stats()
+        cgroup.remove()
+        self.assertFalse(os.path.exists(path))
+
+        cgroup = cgroup_lib.Cgroup(self.root)
+        cgroup.remove()
+        self.assertTrue(os.path.exists(self.root))
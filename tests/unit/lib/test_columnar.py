@@ -0,0 +1,135 @@
+"""Unit tests for the ``lib.columnar`` module."""
+
+from unittest import TestCase
+
+from array import array
+import io
+import json
+import math
+import sys
+
+from psrun.lib import columnar
+
+
+class TestColumnar(TestCase):
+    """Test suite for the ``lib.columnar`` module."""
+
+    def test_encode(self):
+        """Ensure ``encode()`` passes records through as they are."""
+        record = {"pid": 10}
+        self.assertIs(columnar.encode(record), record)
+
+    def test_write_and_read(self):
+        """Ensure ``read()`` loads what a ``Writer`` writes, as columns."""
+        f = io.BytesIO()
+        writer = columnar.Writer(f, chunk_rows=2)
+        writer.write({"pid": 10, "process": {"rss": 100, "pids": [10]}}, 1)
+        writer.write({"pid": 10, "process": {"rss": 200, "pids": [11]}}, 2)
+        writer.write(json.dumps({"pid": 10, "error": "Oops"}), 3)
+        writer.flush()
+        writer.flush()
+
+        f.seek(0)
+        result = columnar.read(f)
+
+        self.assertEqual(
+            list(result), ["pid", "process/rss", "process/pids", "time",
+                           "error"])
+        self.assertIsInstance(result["process/rss"], array)
+        self.assertEqual(list(result["time"]), [1, 2, 3])
+        self.assertEqual(list(result["pid"]), [10, 10, 10])
+        self.assertEqual(
+            columnar.to_list(result["process/rss"]), [100, 200, None])
+        self.assertEqual(result["process/pids"], [[10], [11], None])
+        self.assertEqual(result["error"], [None, None, "Oops"])
+
+    def test_write_columns_that_change_type(self):
+        """Ensure a column can hold numbers in one chunk, and not later."""
+        f = io.BytesIO()
+        writer = columnar.Writer(f, chunk_rows=1)
+        writer.write({"value": 1.5})
+        writer.write({"value": "text"})
+        writer.write({"other": 2})
+
+        f.seek(0)
+        result = columnar.read(f)
+        self.assertEqual(result["value"], [1.5, "text", None])
+        self.assertEqual(columnar.to_list(result["other"]), [None, None, 2])
+        self.assertGreater(result["time"][0], 0)
+
+    def test_write_columns_with_gaps(self):
+        """Ensure a chunk can have columns that some records lack."""
+        f = io.BytesIO()
+        writer = columnar.Writer(f)
+        for record in [{"a": 1}, {"b": 2}, {"b": 3}, {"a": 4}]:
+            writer.write(record)
+        writer.flush()
+
+        f.seek(0)
+        result = columnar.read(f)
+        self.assertEqual(columnar.to_list(result["a"]), [1, None, None, 4])
+        self.assertEqual(columnar.to_list(result["b"]), [None, 2, 3, None])
+
+    def test_writer_appends_to_files(self):
+        """Ensure a ``Writer`` only starts a file with ``MAGIC`` once."""
+        f = io.BytesIO()
+        columnar.Writer(f).write({"value": 1})
+        f.seek(0)
+        self.assertEqual(f.read(len(columnar.MAGIC)), columnar.MAGIC)
+        f.seek(0, io.SEEK_END)
+
+        writer = columnar.Writer(f)
+        writer.write({"value": 1})
+        writer.flush()
+        self.assertEqual(f.getvalue().count(columnar.MAGIC), 1)
+
+    def test_close(self):
+        """Ensure ``close()`` writes out the last chunk."""
+        f = io.BytesIO()
+        writer = columnar.Writer(f)
+        writer.write({"value": 1})
+        data = []
+        f.close = lambda: data.append(f.getvalue())
+        writer.close()
+
+        result = columnar.read(io.BytesIO(data[0]))
+        self.assertEqual(list(result["value"]), [1])
+
+    def test_read_a_truncated_file(self):
+        """Ensure ``read()`` skips a chunk that was not fully written."""
+        f = io.BytesIO()
+        writer = columnar.Writer(f, chunk_rows=1)
+        writer.write({"value": 1})
+        writer.write({"value": 2})
+        data = f.getvalue()
+        chunk_size = (len(data) - len(columnar.MAGIC)) // 2
+
+        for cut in [1, chunk_size - 10, chunk_size - 4]:
+            result = columnar.read(io.BytesIO(data[:-cut]))
+            self.assertEqual(list(result["value"]), [1])
+
+    def test_read_other_files(self):
+        """Ensure ``read()`` refuses files in other formats."""
+        with self.assertRaises(ValueError):
+            columnar.read(io.BytesIO(b'{"pid": 10}'))
+
+    def test_read_other_byte_orders(self):
+        """Ensure ``read()`` swaps the bytes of numbers if it has to."""
+        other = "big" if sys.byteorder == "little" else "little"
+        values = array("d", [1.5])
+        values.byteswap()
+        body = values.tobytes()
+        header = json.dumps({
+            "rows": 1, "byteorder": other,
+            "columns": [["value", "d", 0, len(body)]]}).encode("utf-8")
+        data = columnar.MAGIC + columnar.PREFIX.pack(
+            len(header), len(body)) + header + body
+
+        result = columnar.read(io.BytesIO(data))
+        self.assertEqual(list(result["value"]), [1.5])
+
+    def test_to_list(self):
+        """Ensure ``to_list()`` turns NaN into ``None``."""
+        values = array("d", [1, math.nan])
+        self.assertEqual(columnar.to_list(values), [1, None])
+        self.assertEqual(columnar.to_list([1, None]), [1, None])
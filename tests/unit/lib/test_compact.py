@@ -0,0 +1,99 @@
+"""Unit tests for the ``lib.compact`` module."""
+
+from unittest import TestCase
+
+import json
+
+from psrun.lib import compact
+
+
+class TestCompact(TestCase):
+    """Test suite for the ``lib.compact`` module."""
+
+    def get_records(self):
+        """Get some records that look like process info."""
+        first = {
+            "pid": 10, "cpu_count": 4, "process": {"pids": [10], "rss": 100},
+            "cpu_times_per_cpu": [{"user": 1.5}, {"user": 2.5}],
+            "cpu_freq_per_cpu": [], "swap_memory": None}
+        second = {
+            "pid": 10, "cpu_count": 4,
+            "process": {"pids": [10, 11], "rss": 164},
+            "cpu_times_per_cpu": [{"user": 1.75}, {"user": 2.5}],
+            "cpu_freq_per_cpu": [], "swap_memory": None}
+        third = {
+            "pid": 10, "cpu_count": 4,
+            "process": {"pids": [10, 11], "rss": 120, "uss": 80},
+            "cpu_times_per_cpu": [{"user": 1.75}, {"user": 2.5}],
+            "cpu_freq_per_cpu": []}
+        fourth = dict(second)
+        return [first, second, third, fourth]
+
+    def test_flatten_and_unflatten(self):
+        """Ensure ``unflatten()`` reverses ``flatten()``."""
+        record = self.get_records()[0]
+        flat = compact.flatten(record)
+        self.assertEqual(flat["process/rss"], 100)
+        self.assertEqual(flat["process/pids"], [10])
+        self.assertEqual(flat["cpu_times_per_cpu/1/user"], 2.5)
+        self.assertEqual(flat["cpu_freq_per_cpu"], [])
+        self.assertEqual(compact.unflatten(flat), record)
+
+    def test_encode(self):
+        """Ensure the encoder only writes what changed."""
+        encode = compact.get_encoder()
+        lines = [json.loads(encode(r)) for r in self.get_records()]
+
+        keyframe = lines[0]
+        self.assertEqual(keyframe["psrun"], compact.VERSION)
+        keys = keyframe["keys"]
+        rss = str(keys.index("process/rss"))
+        user = str(keys.index("cpu_times_per_cpu/0/user"))
+        pids = str(keys.index("process/pids"))
+        swap = keys.index("swap_memory")
+
+        self.assertEqual(lines[1], {
+            "d": {rss: 64}, "s": {user: 1.75, pids: [10, 11]}})
+        self.assertEqual(lines[2], {
+            "d": {rss: -44}, "k": ["process/uss"],
+            "s": {str(len(keys)): 80}, "x": [swap]})
+        self.assertEqual(lines[3]["s"], {str(swap): None})
+        self.assertEqual(lines[3]["d"], {rss: 44})
+
+    def test_encode_writes_keyframes(self):
+        """Ensure the encoder writes keyframes at intervals."""
+        encode = compact.get_encoder(keyframe_interval=2)
+        lines = [json.loads(encode(r)) for r in self.get_records()]
+        self.assertIn("psrun", lines[0])
+        self.assertNotIn("psrun", lines[1])
+        self.assertIn("psrun", lines[2])
+        self.assertNotIn("psrun", lines[3])
+
+    def test_encode_when_nothing_changes(self):
+        """Ensure the encoder writes an empty record for no changes."""
+        encode = compact.get_encoder()
+        record = self.get_records()[0]
+        encode(record)
+        self.assertEqual(encode(record), "{}")
+
+    def test_decode(self):
+        """Ensure ``decode()`` rebuilds the encoded records."""
+        records = self.get_records()
+        encode = compact.get_encoder(keyframe_interval=3)
+        lines = [encode(r) for r in records]
+        error = json.dumps({"pid": 10, "error": "dummy-error"})
+        lines.insert(2, error)
+        lines.insert(3, "")
+
+        result = list(compact.decode(lines))
+        self.assertEqual(result[2], json.loads(error))
+        del result[2]
+        self.assertEqual(result, records)
+
+    def test_decode_skips_until_keyframe(self):
+        """Ensure ``decode()`` skips deltas it has no keyframe for."""
+        records = self.get_records()
+        encode = compact.get_encoder(keyframe_interval=2)
+        lines = [encode(r) for r in records]
+        result = list(compact.decode(lines[1:]))
+        self.assertEqual(result, records[2:])
@@ -0,0 +1,130 @@
+"""Unit tests for the ``lib.history`` module."""
+
+from unittest import TestCase
+from unittest.mock import Mock
+
+import json
+import threading
+import time
+
+from psrun.lib import history as history_lib
+
+from .records import get_record
+
+
+class TestHistory(TestCase):
+    """Test suite for the ``lib.history`` module."""
+
+    def test_history(self):
+        """Ensure a ``History`` keeps each stat's samples, in columns."""
+        history = history_lib.History(size=5)
+        self.assertEqual(len(history), 0)
+        self.assertEqual(history.get("process/rss"), [])
+
+        history.add(get_record(rss=100), now=1)
+        history.add(get_record(rss=200, cpu_user=0.5), now=2)
+
+        self.assertEqual(len(history), 2)
+        self.assertEqual(
+            list(history.columns), ["process/rss", "process/cpu_user"])
+        self.assertEqual(history.get("process/rss"), [(1, 100), (2, 200)])
+        self.assertEqual(history.get("process/cpu_user"), [(2, 0.5)])
+        self.assertEqual(history.get("process/missing"), [])
+
+    def test_history_is_bounded(self):
+        """Ensure a ``History`` keeps only the last ``size`` samples."""
+        history = history_lib.History(size=3)
+        for n in range(10):
+            history.add(get_record(rss=n), now=n)
+        self.assertEqual(len(history), 3)
+        self.assertEqual(len(history.times), 3)
+        self.assertEqual(
+            history.get("process/rss"), [(7, 7), (8, 8), (9, 9)])
+
+    def test_history_defaults(self):
+        """Ensure a ``History`` has a default size and clocks."""
+        history = history_lib.History()
+        self.assertEqual(history.size, history_lib.SIZE)
+        before = time.time()
+        history.add(get_record(rss=1))
+        self.assertLessEqual(
+            history.get("process/rss")[0][0], time.monotonic())
+        self.assertGreaterEqual(history.dump()["history"]["time"][0], before)
+
+    def test_history_with_bad_size(self):
+        """Ensure a ``History`` rejects sizes below 1."""
+        for size in [0, -1]:
+            with self.assertRaises(ValueError):
+                history_lib.History(size=size)
+
+    def test_windows_ignore_the_wall_clock(self):
+        """Ensure windows and rates hold when the system clock is set."""
+        history = history_lib.History(size=10)
+        history.add(get_record(rss=1, cpu_user=1.0), now=10, wall_time=1000)
+        history.add(get_record(rss=1, cpu_user=2.0), now=12, wall_time=0)
+        self.assertEqual(
+            history.rate("process/cpu_user", secs=5), [(12, 0.5)])
+
+    def test_get_recent_samples(self):
+        """Ensure ``get()`` can keep to the last ``secs`` secs."""
+        history = history_lib.History(size=10)
+        for n in range(5):
+            history.add(get_record(rss=n * 10), now=n)
+        self.assertEqual(
+            history.get("process/rss", secs=1.5), [(3, 30), (4, 40)])
+
+    def test_rate(self):
+        """Ensure ``rate()`` turns cumulative stats into rates."""
+        history = history_lib.History(size=10)
+        history.add(get_record(rss=1, cpu_user=1.0), now=10)
+        history.add(get_record(rss=1, cpu_user=1.5), now=11)
+        history.add(get_record(rss=1, cpu_user=1.5), now=11)
+        history.add(get_record(rss=1, cpu_user=2.5), now=13)
+        self.assertEqual(
+            history.rate("process/cpu_user"), [(11, 0.5), (13, 0.5)])
+        self.assertEqual(
+            history.rate("process/cpu_user", secs=2), [(13, 0.5)])
+
+    def test_dump(self):
+        """Ensure ``dump()`` gives the columns, with gaps as ``None``."""
+        history = history_lib.History(size=2)
+        history.add(get_record(rss=1), now=1, wall_time=101)
+        history.add(get_record(rss=2, cpu_user=0.5), now=2, wall_time=102)
+        history.add(get_record(rss=3), now=3, wall_time=103)
+        self.assertEqual(history.dump(), {"history": {
+            "time": [102, 103],
+            "process/rss": [2, 3],
+            "process/cpu_user": [0.5, None]}})
+
+    def test_write(self):
+        """Ensure ``write()`` writes the history to its log, if any."""
+        history_lib.History().write()
+
+        data = []
+        history = history_lib.History(size=2, log=data.append)
+        history.add(get_record(rss=1), now=1, wall_time=101)
+        history.write()
+        self.assertEqual(json.loads(data[0]), {"history": {
+            "time": [101], "process/rss": [1]}})
+
+        encode = Mock(return_value="dummy-record")
+        history = history_lib.History(log=data.append, encode=encode)
+        history.write()
+        self.assertEqual(data[-1], "dummy-record")
+
+    def test_query_while_adding(self):
+        """Ensure a ``History`` can be queried while it is added to."""
+        history = history_lib.History(size=50)
+        done = threading.Event()
+
+        def add():
+            for n in range(2000):
+                history.add({"process": {"stat{}".format(n % 100): n}})
+            done.set()
+
+        thread = threading.Thread(target=add)
+        thread.start()
+        while not done.is_set():
+            history.dump()
+        thread.join()
+        self.assertEqual(len(history.columns), 100)
@@ -0,0 +1,89 @@
+"""Unit tests for the ``lib.limits`` module."""
+
+from unittest import TestCase
+from unittest.mock import patch
+
+import resource
+import subprocess
+
+from psrun.lib import limits
+
+from .records import get_record
+
+
+class TestLimits(TestCase):
+    """Test suite for the ``lib.limits`` module."""
+
+    def test_get_cpu_time(self):
+        """Ensure ``get_cpu_time()`` prefers the cgroup's CPU time."""
+        process = {"cpu_user": 1.0, "cpu_system": 0.5, "cpu_children": 0.25}
+        self.assertEqual(limits.get_cpu_time(get_record(**process)), 1.75)
+        self.assertEqual(
+            limits.get_cpu_time(
+                get_record(cgroup={"cpu_usage": 3.0}, **process)),
+            3.0)
+        self.assertEqual(
+            limits.get_cpu_time(get_record(cgroup={}, **process)), 1.75)
+        self.assertEqual(limits.get_cpu_time({"pid": 10}), 0.0)
+
+    def test_set_cpu_limit(self):
+        """Ensure ``set_cpu_limit()`` sets ``RLIMIT_CPU`` on a process."""
+        p = subprocess.Popen(["sleep", "5"])
+        try:
+            self.assertTrue(limits.set_cpu_limit(p.pid, 2, None))
+            self.assertEqual(
+                resource.prlimit(p.pid, resource.RLIMIT_CPU),
+                (2, resource.RLIM_INFINITY))
+            self.assertTrue(limits.set_cpu_limit(p.pid, 2.5, 1))
+            self.assertEqual(
+                resource.prlimit(p.pid, resource.RLIMIT_CPU), (4, 5))
+            self.assertTrue(limits.set_cpu_limit(p.pid, 2, 1, 0.5))
+            self.assertEqual(
+                resource.prlimit(p.pid, resource.RLIMIT_CPU), (4, 5))
+        finally:
+            p.kill()
+            p.wait()
+        self.assertFalse(limits.set_cpu_limit(p.pid, 2))
+        self.assertFalse(limits.set_cpu_limit(p.pid, None))
+
+    def test_set_cpu_limit_when_unsupported(self):
+        """Ensure ``set_cpu_limit()`` gives up where there is no prlimit."""
+        p = patch("{}.resource.prlimit".format(limits.__name__))
+        with p as prlimit:
+            prlimit.side_effect = AttributeError
+            self.assertFalse(limits.set_cpu_limit(10, 2))
+
+    def test_cpu_timeout(self):
+        """Ensure a ``Watchdog`` stops a tree that uses up its budget."""
+        watchdog = limits.Watchdog(cpu_timeout=2, now=0)
+        self.assertIsNone(watchdog.check(get_record(cpu_user=1.0), now=1))
+        self.assertIsNone(watchdog.check(None, now=2))
+        self.assertEqual(
+            watchdog.check(get_record(cpu_user=2.5), now=3),
+            "Used more than 2 CPU secs")
+
+    def test_idle_timeout(self):
+        """Ensure a ``Watchdog`` stops a tree that does nothing for long."""
+        watchdog = limits.Watchdog(idle_timeout=5, now=0)
+        self.assertIsNone(watchdog.check(get_record(), now=1))
+        self.assertIsNone(watchdog.check(get_record(), now=6))
+        self.assertEqual(
+            watchdog.check(get_record(), now=6.5),
+            "Idle for more than 5 secs")
+
+    def test_idle_timeout_with_activity(self):
+        """Ensure a ``Watchdog`` sees CPU use, writes and output."""
+        watchdog = limits.Watchdog(idle_timeout=5, now=0)
+        records = [
+            (get_record(), 0), (get_record(cpu_user=0.1), 0),
+            (get_record(cpu_user=0.1, io_write_count=1), 0),
+            (get_record(cpu_user=0.1, io_write_count=1), 3)]
+        for i, (data, output) in enumerate(records):
+            self.assertIsNone(watchdog.check(data, output, now=i * 4))
+        self.assertEqual(watchdog.active_at, 12)
+
+    def test_watchdog_without_limits(self):
+        """Ensure a ``Watchdog`` without limits never stops a tree."""
+        watchdog = limits.Watchdog()
+        self.assertIsNone(watchdog.check(get_record(cpu_user=100.0)))
+        self.assertIsNone(watchdog.check(get_record(cpu_user=100.0)))
@@ -24,6 +24,13 @@ class TestMain(TestCase):
         self.assertTrue(log.called)
         self.assertIsNone(result)
 
+    def test_report_final_details_with_details(self):
+        """Ensure ``report_final_details()`` logs any extra details."""
+        data = []
+        details = {"Dropped stdout": "1 lines, 2 bytes"}
+        main.report_final_details(data.append, 0, 10, details)
+        self.assertEqual(data[-1], "-- Dropped stdout: 1 lines, 2 bytes")
+
     def test_report_error(self):
         """Ensure ``report_error()`` logs something."""
         log = Mock()
@@ -45,14 +52,54 @@ class TestMain(TestCase):
 
         p = patch("{}.proc.execute".format(main.__name__))
         with p as proc_execute:
-            proc_execute.return_value = (exit_code, running_time)
+            proc_execute.return_value = (exit_code, running_time, {})
 
             main.run(
                 cmd, timeout, shutdown, runner_log, ps_log,
                 stdout_log, stderr_log)
 
             proc_execute.assert_called_once_with(
-                cmd, stdout_log, stderr_log, ps_log, timeout, shutdown)
+                cmd, stdout_log, stderr_log, ps_log, timeout, shutdown,
+                None, None, None, 0, "block", None, None, None, None, None,
+                None, None, None)
+
+    def test_run_removes_cgroup(self):
+        """Ensure ``run()`` removes the cgroup, even if the run fails."""
+        cgroup = Mock()
+        p = patch("{}.proc.execute".format(main.__name__))
+        with p as proc_execute:
+            proc_execute.side_effect = exceptions.ProcTimeout("dummy-error")
+            main.run(
+                "cmd", 1, 1, Mock(), Mock(), Mock(), Mock(), cgroup=cgroup)
+            cgroup.remove.assert_called_once_with()
+
+    def test_run_writes_summary(self):
+        """Ensure ``run()`` writes the summary, even if the run fails."""
+        summary = Mock()
+        p = patch("{}.proc.execute".format(main.__name__))
+        with p as proc_execute:
+            proc_execute.return_value = (0, 1, {})
+            main.run(
+                "cmd", None, None, Mock(), Mock(), Mock(), Mock(),
+                summary=summary)
+            self.assertEqual(summary.write.call_count, 1)
+
+            proc_execute.side_effect = exceptions.ProcTimeout
+            main.run(
+                "cmd", None, None, Mock(), Mock(), Mock(), Mock(),
+                summary=summary)
+            self.assertEqual(summary.write.call_count, 2)
+
+    def test_run_writes_history(self):
+        """Ensure ``run()`` writes the history, even if the run fails."""
+        history = Mock()
+        p = patch("{}.proc.execute".format(main.__name__))
+        with p as proc_execute:
+            proc_execute.side_effect = exceptions.ProcTimeout
+            main.run(
+                "cmd", None, None, Mock(), Mock(), Mock(), Mock(),
+                history=history)
+        history.write.assert_called_once_with()
 
     def test_run_handles_errors(self):
         """Ensure ``run()`` reports errors."""
@@ -63,7 +110,9 @@ class TestMain(TestCase):
         cmd = "cmd -al"
         timeout = "dummy-timeout"
         shutdown = "dummy-shutdown"
-        errors = [exceptions.ProcTimeout, exceptions.PermissionDenied]
+        errors = [
+            exceptions.ProcTimeout, exceptions.ProcMaxRss,
+            exceptions.PermissionDenied]
 
         p1 = patch("{}.proc.execute".format(main.__name__))
         p2 = patch("{}.report_error".format(main.__name__))
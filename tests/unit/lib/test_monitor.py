@@ -1,11 +1,19 @@
 """Unit tests for the ``lib.monitor`` module."""
 
 from unittest import TestCase
-from unittest.mock import patch, Mock
+from unittest.mock import patch, MagicMock, Mock
 
+import io
 import json
+import os
+import subprocess
 
+import psutil
+import time
+
+from psrun.lib import constants
 from psrun.lib import monitor
+from psrun.lib import procfs
 
 
 class TestMonitor(TestCase):
@@ -28,7 +36,6 @@ class TestMonitor(TestCase):
             sin="sin", sout="sout")
 
         expected_data = {
-            "all_pids": pids,
             "cpu_count": "dummy-cpu-count",
             "cpu_freq": {"current": "current", "max": "max", "min": "min"},
             "cpu_freq_per_cpu": [
@@ -43,7 +50,10 @@ class TestMonitor(TestCase):
                 {"idle": "idle", "system": "system", "user": "user"},
                 {"idle": "idle", "system": "system", "user": "user"}],
             "pid": pid,
-            "swap_memory": None,
+            "process": {"pids": [pid], "num_procs": 1},
+            "swap_memory": {
+                "total": "total", "used": "used", "free": "free",
+                "percent": "percent", "sin": "sin", "sout": "sout"},
             "virtual_memory": {
                 "available": "available", "free": "free", "total": "total",
                 "used": "used"}
@@ -54,7 +64,9 @@ class TestMonitor(TestCase):
         log = data.append
 
         p1 = patch("{}.psutil".format(monitor.__name__))
-        with p1 as psutil:
+        p2 = patch("{}.process_tree_info".format(monitor.__name__))
+        with p1 as psutil, p2 as process_tree_info:
+            process_tree_info.return_value = {"pids": [pid], "num_procs": 1}
 
             psutil.pids = Mock()
             psutil.pids.return_value = pids
@@ -69,9 +81,7 @@ class TestMonitor(TestCase):
             psutil.cpu_stats.return_value = cpu_stats
 
             psutil.cpu_freq = Mock()
-            psutil.cpu_freq.side_effect = [
-                cpu_freq, [cpu_freq, cpu_freq],
-                cpu_freq, [cpu_freq, cpu_freq]]
+            psutil.cpu_freq.side_effect = [cpu_freq, [cpu_freq, cpu_freq]]
 
             psutil.virtual_memory = Mock()
             psutil.virtual_memory.return_value = virtual_memory
@@ -82,3 +92,397 @@ class TestMonitor(TestCase):
             monitor.collect(log, pid)
 
             self.assertEqual(data[0], expected)
+            self.assertFalse(psutil.pids.called)
+
+    def test_collect_with_sampler(self):
+        """Ensure ``collect()`` reports what the sampler collects."""
+        data = []
+        sampler = Mock()
+        sampler.sample.return_value = {"cpu_count": 4}
+        p = patch("{}.process_tree_info".format(monitor.__name__))
+        with p as process_tree_info:
+            process_tree_info.return_value = {}
+            monitor.collect(data.append, 10, {}, None, sampler)
+        self.assertEqual(json.loads(data[0]), {
+            "pid": 10, "process": {}, "cpu_count": 4})
+
+    def test_collect_with_cgroup(self):
+        """Ensure ``collect()`` reports the cgroup's stats, if any."""
+        data = []
+        cgroup = Mock()
+        cgroup.stats.return_value = {"num_procs": 3}
+        sampler = Mock()
+        sampler.sample.return_value = {}
+        p = patch("{}.process_tree_info".format(monitor.__name__))
+        with p as process_tree_info:
+            process_tree_info.return_value = {}
+            monitor.collect(
+                data.append, 10, {}, None, sampler, None, None, cgroup)
+        self.assertEqual(json.loads(data[0]), {
+            "pid": 10, "process": {}, "cgroup": {"num_procs": 3}})
+
+    def test_collect_with_summary(self):
+        """Ensure ``collect()`` adds stats to a summary."""
+        data = []
+        summary = Mock(samples=True)
+        sampler = Mock()
+        sampler.sample.return_value = {"cpu_count": 4}
+        p = patch("{}.process_tree_info".format(monitor.__name__))
+        with p as process_tree_info:
+            process_tree_info.return_value = {}
+            monitor.collect(data.append, 10, {}, None, sampler, summary)
+            self.assertEqual(len(data), 1)
+            summary.add.assert_called_once_with(json.loads(data[0]))
+
+            summary.samples = False
+            monitor.collect(data.append, 10, {}, None, sampler, summary)
+            self.assertEqual(len(data), 1)
+            self.assertEqual(summary.add.call_count, 2)
+
+    def test_collect_with_history(self):
+        """Ensure ``collect()`` adds stats to a history."""
+        data = []
+        history = Mock()
+        sampler = Mock()
+        sampler.sample.return_value = {"cpu_count": 4}
+        p = patch("{}.process_tree_info".format(monitor.__name__))
+        with p as process_tree_info:
+            process_tree_info.return_value = {}
+            monitor.collect(
+                data.append, 10, {}, None, sampler, history=history)
+        history.add.assert_called_once_with(json.loads(data[0]))
+
+    def test_get_collectors(self):
+        """Ensure ``get_collectors()`` defaults to the enabled collectors."""
+        result = monitor.get_collectors()
+        expected = [
+            name for name, c in monitor.COLLECTORS.items() if c.enabled]
+        self.assertEqual(list(result.keys()), expected)
+        self.assertNotIn("all_pids", result)
+        self.assertEqual(set(result.values()), {0})
+
+    def test_get_collectors_with_spec(self):
+        """Ensure ``get_collectors()`` applies a spec to the defaults."""
+        spec = "all_pids, cpu_freq_per_cpu=5,-cpu_stats,-all_pids,,"
+        result = monitor.get_collectors(spec)
+        self.assertEqual(result["cpu_freq_per_cpu"], 5)
+        self.assertNotIn("cpu_stats", result)
+        self.assertNotIn("all_pids", result)
+        self.assertEqual(result["cpu_times"], 0)
+
+    def test_get_collectors_with_bad_spec(self):
+        """Ensure ``get_collectors()`` rejects bad specs."""
+        specs = [
+            "bogus", "cpu_times=x", "cpu_times=-1", "cpu_times=0",
+            "cpu_times=nan", "cpu_times=inf"]
+        for spec in specs:
+            with self.assertRaises(ValueError):
+                monitor.get_collectors(spec)
+
+    def test_sampler(self):
+        """Ensure a ``Sampler`` collects each stat at its own rate."""
+        funcs = {
+            "static": Mock(side_effect=["s1", "s2"]),
+            "fast": Mock(side_effect=["f1", "f2", "f3"]),
+            "slow": Mock(side_effect=["w1", "w2"])}
+        registry = {
+            "static": monitor.Collector(funcs["static"], True, True),
+            "fast": monitor.Collector(funcs["fast"], True, False),
+            "slow": monitor.Collector(funcs["slow"], True, False)}
+        collectors = {"static": 0, "fast": 0, "slow": 10}
+
+        p = patch.dict(monitor.COLLECTORS, registry)
+        with p:
+            sampler = monitor.Sampler(collectors)
+            self.assertEqual(
+                sampler.sample(100),
+                {"static": "s1", "fast": "f1", "slow": "w1"})
+            self.assertEqual(
+                sampler.sample(105),
+                {"static": "s1", "fast": "f2", "slow": "w1"})
+            self.assertEqual(
+                sampler.sample(110),
+                {"static": "s1", "fast": "f3", "slow": "w2"})
+        self.assertEqual(funcs["static"].call_count, 1)
+
+    def test_sampler_with_interval(self):
+        """Ensure a ``Sampler`` with an interval reuses its stats."""
+        func = Mock(side_effect=["f1", "f2"])
+        registry = {"fast": monitor.Collector(func, True, False)}
+
+        p = patch.dict(monitor.COLLECTORS, registry)
+        with p:
+            sampler = monitor.Sampler({"fast": 0}, interval=1)
+            self.assertEqual(sampler.sample(100), {"fast": "f1"})
+            self.assertEqual(sampler.sample(100.5), {"fast": "f1"})
+            self.assertEqual(sampler.sample(101), {"fast": "f2"})
+
+    def test_shared_sampler(self):
+        """Ensure a ``SharedSampler`` shares snapshots while subscribed."""
+        func = Mock(side_effect=["f1", "f2", "f3", "f4"])
+        registry = {"fast": monitor.Collector(func, True, False)}
+
+        p = patch.dict(monitor.COLLECTORS, registry)
+        with p:
+            sampler = monitor.SharedSampler({"fast": 0}, interval=60)
+            with patch.object(sampler, "close") as close, sampler:
+                with sampler:
+                    self.assertEqual(sampler.subscribers, 2)
+                    self.assertEqual(sampler.sample(), {"fast": "f1"})
+                    self.assertEqual(sampler.sample(), {"fast": "f1"})
+                self.assertFalse(sampler.stopped.is_set())
+                close.assert_not_called()
+            self.assertTrue(sampler.stopped.is_set())
+            self.assertFalse(sampler.thread.is_alive())
+            close.assert_called_once_with()
+            self.assertEqual(func.call_count, 1)
+
+            later = time.monotonic() + 60
+            self.assertEqual(sampler.sample(later), {"fast": "f2"})
+
+    def test_shared_sampler_refreshes(self):
+        """Ensure a ``SharedSampler`` takes snapshots in the background."""
+        func = Mock(return_value="f")
+        registry = {"fast": monitor.Collector(func, True, False)}
+
+        p = patch.dict(monitor.COLLECTORS, registry)
+        with p:
+            with monitor.SharedSampler({"fast": 0}, interval=0.01):
+                time.sleep(0.2)
+        self.assertGreater(func.call_count, 2)
+
+    def test_shared_sampler_with_errors(self):
+        """Ensure a ``SharedSampler`` raises errors from its snapshots."""
+        func = Mock(side_effect=[OSError("dummy-error"), "f2"])
+        registry = {"fast": monitor.Collector(func, True, False)}
+
+        p = patch.dict(monitor.COLLECTORS, registry)
+        with p:
+            sampler = monitor.SharedSampler({"fast": 0}, interval=60)
+            with sampler:
+                with self.assertRaises(OSError):
+                    sampler.sample()
+                sampler.refresh()
+                self.assertEqual(sampler.sample(), {"fast": "f2"})
+
+    def test_shared_sampler_defaults(self):
+        """Ensure a ``SharedSampler`` uses the default sample interval."""
+        sampler = monitor.SharedSampler()
+        self.assertEqual(sampler.interval, constants.SAMPLE_INTERVAL)
+
+    def test_all_pids(self):
+        """Ensure ``all_pids()`` lists the processes on the system."""
+        self.assertIn(os.getpid(), monitor.all_pids())
+
+    def test_get_reader(self):
+        """Ensure ``get_reader()`` picks the backend."""
+        self.assertIsNone(monitor.get_reader())
+        self.assertIsNone(monitor.get_reader("psutil"))
+
+        p = patch("{}.procfs.is_supported".format(monitor.__name__))
+        with p as is_supported:
+            is_supported.return_value = True
+            self.assertIsInstance(
+                monitor.get_reader("procfs"), procfs.Reader)
+            self.assertIsInstance(monitor.get_reader("auto"), procfs.Reader)
+
+            is_supported.return_value = False
+            self.assertIsNone(monitor.get_reader("auto"))
+            with self.assertRaises(ValueError):
+                monitor.get_reader("procfs")
+
+        with self.assertRaises(ValueError):
+            monitor.get_reader("dummy")
+
+    def test_get_funcs(self):
+        """Ensure ``get_funcs()`` picks the backend for each collector."""
+        result = monitor.get_funcs()
+        self.assertEqual(list(result), list(monitor.COLLECTORS))
+        self.assertEqual(result["cpu_times"], monitor.cpu_times)
+
+        result = monitor.get_funcs(procfs.Reader())
+        self.assertEqual(result["cpu_count"], monitor.cpu_count)
+        self.assertEqual(result["cpu_times"].__name__, "cpu_times")
+        self.assertNotEqual(result["cpu_times"], monitor.cpu_times)
+
+    def test_sampler_with_procfs(self):
+        """Ensure a ``Sampler`` can read the stats from /proc."""
+        sampler = monitor.Sampler(backend="auto")
+        result = sampler.sample()
+        self.assertEqual(
+            list(result.keys()), list(monitor.get_collectors().keys()))
+        self.assertEqual(
+            set(result["virtual_memory"]), set(monitor.virtual_memory()))
+        self.assertNotEqual(sampler.reader.files, {})
+        self.assertIsNone(sampler.reader.lengths)
+        sampler.close()
+        self.assertEqual(sampler.reader.files, {})
+        sampler.close()
+
+    def test_sampler_reads_each_file_once(self):
+        """Ensure a ``Sampler`` reads each /proc file once per sample."""
+        sampler = monitor.Sampler(backend="auto")
+        p = patch.object(
+            procfs.File, "read", autospec=True, side_effect=procfs.File.read)
+        with p as read:
+            sampler.sample()
+        paths = [call[0][0].file.name for call in read.call_args_list]
+        self.assertEqual(len(paths), len(set(paths)))
+        sampler.close()
+
+    def test_sampler_close_without_a_reader(self):
+        """Ensure ``close()`` is harmless with the psutil backend."""
+        sampler = monitor.Sampler()
+        sampler.close()
+        self.assertIsNone(sampler.reader)
+
+    def test_sampler_defaults(self):
+        """Ensure a ``Sampler`` uses the default collectors and clock."""
+        sampler = monitor.Sampler()
+        result = sampler.sample()
+        self.assertEqual(
+            list(result.keys()), list(monitor.get_collectors().keys()))
+
+    def test_collect_with_encoder(self):
+        """Ensure ``collect()`` serializes with the given encoder."""
+        data = []
+        encode = Mock(return_value="dummy-record")
+        p1 = patch("{}.psutil".format(monitor.__name__))
+        p2 = patch("{}.process_tree_info".format(monitor.__name__))
+        with p1, p2:
+            monitor.collect(data.append, 10, {}, encode)
+        self.assertEqual(data, ["dummy-record"])
+        self.assertEqual(encode.call_args[0][0]["pid"], 10)
+
+    def test_process_info(self):
+        """Ensure ``process_info()`` reports on a process."""
+        proc = psutil.Process(os.getpid())
+        result = monitor.process_info(proc)
+        self.assertGreater(result["rss"], 0)
+        self.assertGreater(result["vms"], 0)
+        self.assertGreaterEqual(result["num_threads"], 1)
+        self.assertGreaterEqual(result["num_fds"], 1)
+        for key in ["cpu_user", "cpu_system", "cpu_children", "cpu_percent",
+                    "ctx_switches_voluntary", "ctx_switches_involuntary"]:
+            self.assertIn(key, result)
+
+    def test_memory_info_without_uss(self):
+        """Ensure ``memory_info()`` falls back when USS is denied."""
+        proc = Mock()
+        proc.memory_full_info.side_effect = psutil.AccessDenied
+        proc.memory_info.return_value = Mock(rss=1, vms=2)
+        result = monitor.memory_info(proc)
+        self.assertEqual(result, {"rss": 1, "vms": 2})
+
+    def test_io_counters_when_unavailable(self):
+        """Ensure ``io_counters()`` is empty when we cannot read them."""
+        proc = Mock()
+        proc.io_counters.side_effect = psutil.AccessDenied
+        self.assertEqual(monitor.io_counters(proc), {})
+
+    def test_io_counters(self):
+        """Ensure ``io_counters()`` reports I/O counters."""
+        proc = Mock()
+        proc.io_counters.return_value = Mock(
+            read_count=1, write_count=2, read_bytes=3, write_bytes=4)
+        result = monitor.io_counters(proc)
+        self.assertEqual(result, {
+            "io_read_count": 1, "io_write_count": 2,
+            "io_read_bytes": 3, "io_write_bytes": 4})
+
+    def test_get_tree(self):
+        """Ensure ``get_tree()`` finds descendants and caches them."""
+        child = subprocess.Popen(["sleep", "5"])
+        try:
+            procs = {}
+            tree = monitor.get_tree(os.getpid(), procs)
+            pids = [p.pid for p in tree]
+            self.assertEqual(pids[0], os.getpid())
+            self.assertIn(child.pid, pids)
+            self.assertEqual(sorted(procs.keys()), sorted(pids))
+
+            cached = procs[child.pid]
+            monitor.get_tree(os.getpid(), procs)
+            self.assertIs(procs[child.pid], cached)
+        finally:
+            child.kill()
+            child.wait()
+
+        monitor.get_tree(os.getpid(), procs)
+        self.assertNotIn(child.pid, procs)
+
+    def test_get_tree_when_gone(self):
+        """Ensure ``get_tree()`` is empty when the process is gone."""
+        child = subprocess.Popen(["true"])
+        child.wait()
+        self.assertEqual(monitor.get_tree(child.pid, {}), [])
+
+        cached = Mock()
+        cached.children.side_effect = psutil.NoSuchProcess(child.pid)
+        procs = {child.pid: cached}
+        self.assertEqual(monitor.get_tree(child.pid, procs), [])
+        self.assertEqual(procs, {})
+
+    def test_get_tree_with_psutil(self):
+        """Ensure ``get_tree()`` falls back to psutil without /proc."""
+        p = patch("{}.HAS_PROC_CHILDREN".format(monitor.__name__), False)
+        with p:
+            self.test_get_tree()
+            self.test_get_tree_when_gone()
+
+    def test_read_children(self):
+        """Ensure ``read_children()`` lists a process's children."""
+        child = subprocess.Popen(["sleep", "5"])
+        try:
+            self.assertIn(child.pid, monitor.read_children(os.getpid()))
+            self.assertEqual(monitor.read_children(child.pid), [])
+        finally:
+            child.kill()
+            child.wait()
+
+        with self.assertRaises(psutil.NoSuchProcess):
+            monitor.read_children(child.pid)
+
+    def test_read_children_of_exited_threads(self):
+        """Ensure ``read_children()`` skips threads that are gone."""
+        p1 = patch("{}.os.listdir".format(monitor.__name__))
+        p2 = patch("builtins.open")
+        with p1 as listdir, p2 as open_:
+            listdir.return_value = ["10", "11"]
+            open_.side_effect = [
+                FileNotFoundError, io.StringIO("12 13\n")]
+            self.assertEqual(monitor.read_children(10), [12, 13])
+
+    def test_scan_tree(self):
+        """Ensure ``scan_tree()`` keeps cached objects only if still valid."""
+        cached = MagicMock(pid=10)
+        cached.__eq__.return_value = True
+        stale = MagicMock(pid=12)
+        stale.__eq__.return_value = False
+        p1 = patch("{}.read_children".format(monitor.__name__))
+        p2 = patch("{}.psutil.Process".format(monitor.__name__))
+        with p1 as read_children, p2 as process:
+            read_children.side_effect = [
+                [11, 12], psutil.NoSuchProcess(11), []]
+            process.side_effect = lambda pid: Mock(pid=pid)
+            result = monitor.scan_tree(10, {10: cached, 12: stale})
+
+        self.assertEqual(list(result), [10, 12])
+        self.assertIs(result[10], cached)
+        self.assertIsNot(result[12], stale)
+        self.assertEqual(result[12].pid, 12)
+
+    def test_process_tree_info(self):
+        """Ensure ``process_tree_info()`` sums over the tree."""
+        procs = [Mock(pid=1), Mock(pid=2), Mock(pid=3)]
+        infos = [{"rss": 1, "uss": 2}, {"rss": 3}, psutil.NoSuchProcess(3)]
+
+        p1 = patch("{}.get_tree".format(monitor.__name__))
+        p2 = patch("{}.process_info".format(monitor.__name__))
+        with p1 as get_tree, p2 as process_info:
+            get_tree.return_value = procs
+            process_info.side_effect = infos
+            result = monitor.process_tree_info(1, {})
+
+        self.assertEqual(result, {
+            "pids": [1, 2], "num_procs": 2, "rss": 4, "uss": 2})
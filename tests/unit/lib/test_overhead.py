@@ -0,0 +1,49 @@
+"""Unit tests for the ``lib.overhead`` module."""
+
+from unittest import TestCase
+from unittest.mock import patch
+
+from psrun.lib import overhead as overhead_lib
+
+
+class TestOverhead(TestCase):
+    """Test suite for the ``lib.overhead`` module."""
+
+    def test_to_ms(self):
+        """Ensure ``to_ms()`` converts secs to whole milliseconds."""
+        self.assertEqual(overhead_lib.to_ms(1.2345), 1234)
+
+    def test_overhead(self):
+        """Ensure an ``Overhead`` reports the work it kept track of."""
+        p1 = patch("{}.time.process_time".format(overhead_lib.__name__))
+        p2 = patch("{}.time.perf_counter".format(overhead_lib.__name__))
+        with p1 as process_time, p2 as perf_counter:
+            process_time.side_effect = [10, 10.5]
+            perf_counter.side_effect = [1, 1.25, 2, 2.5]
+
+            overhead = overhead_lib.Overhead()
+            for _ in range(2):
+                with overhead.timer("Sampling"):
+                    pass
+            overhead.count("stdout", 2, 20)
+            overhead.count("stdout", 1, 10)
+            result = overhead.get_details()
+
+        self.assertEqual(list(result.items()), [
+            ("Psrun CPU time", "500ms"),
+            ("Sampling", "750ms (2 times)"),
+            ("Forwarded stdout", "3 lines, 30 bytes")])
+
+    def test_get_details_without_cpu_time(self):
+        """Ensure ``get_details()`` can leave out psrun's CPU time."""
+        overhead = overhead_lib.Overhead(cpu_time=False)
+        overhead.count("stdout", 1, 10)
+        self.assertEqual(list(overhead.get_details()), ["Forwarded stdout"])
+
+    def test_timer_with_errors(self):
+        """Ensure ``timer()`` counts work that fails."""
+        overhead = overhead_lib.Overhead()
+        with self.assertRaises(ValueError):
+            with overhead.timer("Sampling"):
+                raise ValueError()
+        self.assertEqual(overhead.calls["Sampling"], 1)
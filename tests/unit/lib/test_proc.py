@@ -1,13 +1,31 @@
 """Unit tests for the ``lib.proc`` module."""
 
 from unittest import TestCase
-from unittest.mock import call, patch, Mock
+from unittest.mock import ANY, call, patch, MagicMock, Mock
 
 from queue import Queue
 import io
-
+import os
+import selectors
+import socket
+import subprocess
+import tempfile
+import time
+
+from psrun.lib import cgroup as cgroup_lib
 from psrun.lib import exceptions
 from psrun.lib import proc
+from psrun.lib import stream
+
+
+def patch_reap(exit_codes):
+    """Patch ``proc.reap()`` to set each exit code in turn."""
+    exit_codes = iter(exit_codes)
+
+    def reap(p):
+        p.returncode = next(exit_codes)
+
+    return patch("{}.reap".format(proc.__name__), side_effect=reap)
 
 
 class TestProc(TestCase):
@@ -21,7 +39,8 @@ class TestProc(TestCase):
         p = patch("{}.monitor.collect".format(proc.__name__))
         with p as collect:
             proc.try_monitor(log, pid)
-            collect.assert_called_once_with(log, pid)
+            collect.assert_called_once_with(
+                log, pid, None, None, None, None, None, None)
 
     def test_try_monitor_with_errors(self):
         """Ensure ``try_monitor()`` logs errors."""
@@ -49,8 +68,29 @@ class TestProc(TestCase):
             buf.put(line)
             expected.append(line.decode("utf8").rstrip())
 
-        proc.read_buffer(buf, log)
+        result = proc.read_buffer(buf, log)
         self.assertEqual(output, expected)
+        self.assertEqual(result, (3, 21))
+
+    def test_read_buffer_with_bad_utf8(self):
+        """Ensure ``read_buffer()`` replaces bytes that are not UTF-8."""
+        output = []
+        buf = Queue()
+        buf.put(b"bad \xff byte\n")
+        result = proc.read_buffer(buf, output.append)
+        self.assertEqual(output, ["bad \ufffd byte"])
+        self.assertEqual(result, (1, 11))
+
+    def test_read_buffers(self):
+        """Ensure ``read_buffers()`` counts and times what it reads."""
+        output = []
+        buf = Queue()
+        buf.put(b"line 1\n")
+        overhead = MagicMock()
+        proc.read_buffers([("stdout", buf, output.append)], overhead)
+        self.assertEqual(output, ["line 1"])
+        overhead.timer.assert_called_once_with("Reading output")
+        overhead.count.assert_called_once_with("stdout", 1, 7)
 
     def test_start(self):
         """Ensure ``start()`` starts a process."""
@@ -62,6 +102,31 @@ class TestProc(TestCase):
             result = proc.start(["dummy", "command"])
             self.assertEqual(result, proc_object)
 
+    def test_start_with_redirects(self):
+        """Ensure ``start()`` gives the process where to write output."""
+        p = patch("{}.subprocess.Popen".format(proc.__name__))
+        with p as popen:
+            proc.start("dummy command", 5, 6)
+            popen.assert_called_once_with(
+                "dummy command", shell=True, stdout=5, stderr=6)
+
+    def test_start_in_a_cgroup(self):
+        """Ensure ``start()`` can start a process in a cgroup."""
+        cgroup = Mock()
+        cgroup.wrap.return_value = ["dummy", "args"]
+        p = patch("{}.subprocess.Popen".format(proc.__name__))
+        with p as popen:
+            proc.start("dummy command", 5, 6, cgroup)
+            cgroup.wrap.assert_called_once_with("dummy command")
+            popen.assert_called_once_with(
+                ["dummy", "args"], stdout=5, stderr=6)
+
+    def test_get_target(self):
+        """Ensure ``get_target()`` only gives redirects their own fd."""
+        self.assertEqual(proc.get_target(stream.Redirect(5)), 5)
+        self.assertEqual(proc.get_target(5), subprocess.PIPE)
+        self.assertEqual(proc.get_target(print), subprocess.PIPE)
+
     def test_start_when_permission_denied(self):
         """Ensure ``start()`` raises when permission is denied."""
         p = patch("{}.subprocess.Popen".format(proc.__name__))
@@ -74,35 +139,361 @@ class TestProc(TestCase):
     def test_stop(self):
         """Ensure ``stop()`` terminates a process."""
         shutdown = None
-        term_code = 15
+        term_code = -15
 
         p = Mock()
-        p.poll = Mock()
-        p.terminate = Mock()
-        p.kill = Mock()
-
-        p.poll.return_value = term_code
+        p.wait.return_value = term_code
 
-        proc.stop(p, shutdown)
+        result = proc.stop(p, shutdown)
 
+        self.assertEqual(result, term_code)
         self.assertTrue(p.terminate.called)
         self.assertFalse(p.kill.called)
+        p.wait.assert_called_once_with(None)
 
     def test_stop_and_kill(self):
         """Ensure ``stop()`` kills a process after a time."""
         shutdown = 0.1
 
         p = Mock()
-        p.poll = Mock()
-        p.terminate = Mock()
-        p.kill = Mock()
-
-        p.poll.return_value = None
+        p.wait.side_effect = [subprocess.TimeoutExpired("cmd", 0.1), -9]
 
-        proc.stop(p, shutdown)
+        result = proc.stop(p, shutdown)
 
+        self.assertEqual(result, -9)
         self.assertTrue(p.terminate.called)
         self.assertTrue(p.kill.called)
+        p.wait.assert_any_call(0.1)
+
+    def test_stop_a_real_process(self):
+        """Ensure ``stop()`` kills a process that ignores SIGTERM in time."""
+        p = subprocess.Popen(["sh", "-c", "trap '' TERM; sleep 5"])
+        time.sleep(0.1)
+        start = time.monotonic()
+        result = proc.stop(p, 0.2)
+        self.assertEqual(result, -9)
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_reap(self):
+        """Ensure ``reap()`` reaps a process, with its resource usage."""
+        p = subprocess.Popen(["sh", "-c", "exit 3"])
+        rusage = None
+        while rusage is None:
+            rusage = proc.reap(p)
+        self.assertEqual(p.returncode, 3)
+        self.assertEqual(p.poll(), 3)
+        self.assertGreaterEqual(rusage.ru_maxrss, 0)
+
+    def test_reap_when_running(self):
+        """Ensure ``reap()`` leaves running processes alone."""
+        p = subprocess.Popen(["sleep", "5"])
+        self.assertIsNone(proc.reap(p))
+        self.assertIsNone(p.returncode)
+        p.kill()
+        p.wait()
+        self.assertIsNone(proc.reap(p))
+        self.assertEqual(p.returncode, -9)
+
+    def test_reap_when_reaped_some_other_way(self):
+        """Ensure ``reap()`` sets an exit code for processes it missed."""
+        p = subprocess.Popen(["sh", "-c", "exit 3"])
+        os.waitpid(p.pid, 0)
+        self.assertIsNone(proc.reap(p))
+        self.assertEqual(p.returncode, 0)
+
+    def test_get_rusage_details(self):
+        """Ensure ``get_rusage_details()`` reports resource usage."""
+        rusage = Mock(
+            ru_utime=1.5, ru_stime=0.25, ru_maxrss=2048, ru_majflt=1,
+            ru_minflt=100, ru_nvcsw=5, ru_nivcsw=6)
+        result = proc.get_rusage_details(rusage)
+        self.assertEqual(list(result.items()), [
+            ("Child CPU time", "1500ms user, 250ms system"),
+            ("Child page faults", "1 major, 100 minor"),
+            ("Child context switches", "5 voluntary, 6 involuntary")])
+        self.assertEqual(proc.get_rusage_details(None), {})
+
+    def test_get_cgroup_details(self):
+        """Ensure ``get_cgroup_details()`` reports what a cgroup used."""
+        cgroup = Mock(errors={"pids": "dummy-error"})
+        cgroup.stats.return_value = {
+            "cpu_user": 1.5, "cpu_system": 0.25, "memory_peak": 2097152,
+            "io_read_bytes": 100, "io_write_bytes": 200}
+        result = proc.get_cgroup_details(cgroup)
+        self.assertEqual(list(result.items()), [
+            ("Cgroup CPU time", "1500ms user, 250ms system"),
+            ("Cgroup peak memory", "2048 KiB"),
+            ("Cgroup I/O", "100 bytes read, 200 bytes written"),
+            ("Cgroup pids controller", "dummy-error")])
+
+        cgroup.stats.return_value = {}
+        cgroup.errors = {}
+        self.assertEqual(proc.get_cgroup_details(cgroup), {})
+        self.assertEqual(proc.get_cgroup_details(None), {})
+
+    def test_execute_in_a_cgroup(self):
+        """Ensure ``execute()`` runs a process in a cgroup, and reports it.
+        """
+        ps_data = []
+        with tempfile.TemporaryDirectory() as path:
+            with open(os.path.join(path, "cpu.stat"), "w") as f:
+                f.write("usage_usec 3\nuser_usec 2000\nsystem_usec 1000\n")
+            cgroup = cgroup_lib.Cgroup(path)
+            self.addCleanup(cgroup.remove)
+            _, _, details = proc.execute(
+                "echo out", Mock(), Mock(), ps_data.append, None, None,
+                cgroup=cgroup)
+            with open(os.path.join(path, "cgroup.procs")) as f:
+                self.assertEqual(f.read(), "0\n")
+        self.assertEqual(details["Cgroup CPU time"], "2ms user, 1ms system")
+        self.assertIn('"cgroup": {"cpu_system": 0.001', ps_data[-1])
+
+    def test_execute_when_cannot_join_the_cgroup(self):
+        """Ensure ``execute()`` raises if the process is not in its cgroup.
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            cgroup = cgroup_lib.Cgroup(os.path.join(tmp, "missing"))
+            with self.assertRaises(exceptions.CgroupUnavailable):
+                proc.execute(
+                    "echo out", Mock(), Mock(), Mock(), None, None,
+                    cgroup=cgroup)
+
+    def test_timing(self):
+        """Ensure ``stop_timing()`` measures in ms, to the microsecond."""
+        p = patch("{}.time.perf_counter_ns".format(proc.__name__))
+        with p as perf_counter_ns:
+            perf_counter_ns.side_effect = [1000000000, 1001234567]
+            start_time = proc.start_timing()
+            self.assertEqual(proc.stop_timing(start_time), 1.235)
+
+    def test_format_cmd(self):
+        """Ensure ``format_cmd()`` formats strings and lists of args."""
+        self.assertEqual(proc.format_cmd("ls -la"), "ls -la")
+        self.assertEqual(proc.format_cmd(["ls", "-la"]), "ls -la")
+
+    def test_execute_reports_rusage(self):
+        """Ensure ``execute()`` reports the process's resource usage."""
+        _, _, details = proc.execute(
+            "true", Mock(), Mock(), Mock(), None, None)
+        self.assertIn("Child CPU time", details)
+        self.assertNotIn("Child max RSS", details)
+
+    def test_open_exit_fd(self):
+        """Ensure ``open_exit_fd()`` opens a pidfd for a process."""
+        p = Mock(pid=10)
+        patch_os = patch("{}.os".format(proc.__name__))
+        with patch_os as os:
+            os.pidfd_open.return_value = 3
+            result = proc.open_exit_fd(p)
+            self.assertEqual(result, 3)
+            os.pidfd_open.assert_called_once_with(10)
+
+    def test_open_exit_fd_when_unsupported(self):
+        """Ensure ``open_exit_fd()`` returns ``None`` without pidfds."""
+        p = Mock(pid=10)
+        errors = [AttributeError, OSError]
+        patch_os = patch("{}.os".format(proc.__name__))
+        with patch_os as os:
+            os.pidfd_open.side_effect = errors
+            for _ in errors:
+                self.assertIsNone(proc.open_exit_fd(p))
+
+    def test_get_notifier(self):
+        """Ensure ``get_notifier()`` returns a function that sends a byte."""
+        sock = Mock()
+        notify = proc.get_notifier(sock)
+        notify()
+        sock.send.assert_called_once_with(b"\0")
+
+    def test_get_notifier_ignores_errors(self):
+        """Ensure notifiers ignore full or closed sockets."""
+        sock = Mock()
+        sock.send.side_effect = [BlockingIOError, OSError]
+        notify = proc.get_notifier(sock)
+        notify()
+        notify()
+        self.assertEqual(sock.send.call_count, 2)
+
+    def test_drain(self):
+        """Ensure ``drain()`` empties a socket."""
+        receiver, sender = socket.socketpair()
+        receiver.setblocking(False)
+        sender.send(b"\0\0\0")
+        proc.drain(receiver)
+        with self.assertRaises(BlockingIOError):
+            receiver.recv(1)
+        receiver.close()
+        sender.close()
+
+    def test_drain_at_eof(self):
+        """Ensure ``drain()`` stops when the other end is closed."""
+        receiver, sender = socket.socketpair()
+        receiver.setblocking(False)
+        sender.send(b"\0")
+        sender.close()
+        proc.drain(receiver)
+        receiver.close()
+
+    def test_watch_and_wait(self):
+        """Ensure ``wait()`` wakes up when output arrives."""
+        p = Mock(pid=10, stdout=io.BytesIO(b"line\n"), stderr=io.BytesIO())
+
+        patch_exit_fd = patch("{}.open_exit_fd".format(proc.__name__))
+        with patch_exit_fd as open_exit_fd:
+            open_exit_fd.return_value = None
+            selector, exit_fd, buffers = proc.watch(p, "out", "err")
+
+        (_, stdout_buf, out), (_, stderr_buf, err) = buffers
+        self.assertEqual((out, err), ("out", "err"))
+        self.assertEqual(stdout_buf.get(timeout=1), b"line\n")
+        self.assertIsNone(exit_fd)
+
+        proc.wait(selector, 1)
+        keys = selector.get_map().values()
+        receiver = [key.fileobj for key in keys if key.data][0]
+        with self.assertRaises(BlockingIOError):
+            receiver.recv(1)
+
+        proc.unwatch(selector, exit_fd)
+        self.assertEqual(receiver.fileno(), -1)
+
+    def test_watch_with_exit_fd(self):
+        """Ensure ``watch()`` selects on the exit fd, if there is one."""
+        p = Mock(pid=10, stdout=io.BytesIO(), stderr=io.BytesIO())
+        exit_r, exit_w = socket.socketpair()
+
+        patch_exit_fd = patch("{}.open_exit_fd".format(proc.__name__))
+        patch_os = patch("{}.os".format(proc.__name__))
+        with patch_exit_fd as open_exit_fd, patch_os as os:
+            open_exit_fd.return_value = exit_r.fileno()
+            selector, exit_fd, _ = proc.watch(p, Mock(), Mock())
+
+            exit_w.send(b"\0")
+            proc.wait(selector, 1)
+            events = selector.select(1)
+            fds = [key.fd for key, _ in events]
+            self.assertIn(exit_r.fileno(), fds)
+
+            proc.unwatch(selector, exit_fd)
+            os.close.assert_called_once_with(exit_r.fileno())
+
+        exit_r.close()
+        exit_w.close()
+
+    def test_wait_times_out(self):
+        """Ensure ``wait()`` returns when nothing happens."""
+        selector = selectors.DefaultSelector()
+        proc.wait(selector, 0.01)
+        selector.close()
+
+    def test_get_details(self):
+        """Ensure ``get_details()`` reports buffering and dropped lines."""
+        dropping = stream.Buffer(1, stream.DROP_NEWEST)
+        dropping.dropped_lines = 2
+        dropping.dropped_bytes = 20
+        blocking = stream.Buffer(1, stream.BLOCK)
+        blocking.put_line(b"line\n")
+        buffers = [("stdout", blocking, None), ("stderr", dropping, None)]
+        result = proc.get_details(buffers)
+        self.assertEqual(result, {
+            "Max buffered stdout": "1 lines",
+            "Max buffered stderr": "0 lines",
+            "Dropped stderr": "2 lines, 20 bytes"})
+
+    def test_get_details_with_overhead(self):
+        """Ensure ``get_details()`` reports psrun's overhead first."""
+        overhead = Mock()
+        overhead.get_details.return_value = {"Psrun CPU time": "1ms"}
+        result = proc.get_details([], overhead)
+        self.assertEqual(result, {"Psrun CPU time": "1ms"})
+
+    def test_execute_with_bounded_buffers(self):
+        """Ensure ``execute()`` reports dropped lines."""
+        lines = b"".join(b"line %d\n" % i for i in range(100))
+        p = Mock(pid=10, stdout=io.BytesIO(lines), stderr=io.BytesIO())
+        p.returncode = 0
+        stdout_data = []
+
+        p1 = patch("{}.start".format(proc.__name__))
+        p2 = patch(
+            "{}.try_monitor".format(proc.__name__), return_value=None)
+        p3 = patch("{}.open_exit_fd".format(proc.__name__))
+        with p1 as start, p2, p3 as open_exit_fd:
+            start.return_value = p
+            open_exit_fd.return_value = None
+
+            _, _, details = proc.execute(
+                ["some-cmd"], stdout_data.append, Mock(), Mock(), None, None,
+                buffer_size=10, buffer_policy=stream.DROP_OLDEST)
+
+        self.assertEqual(stdout_data[-1], "line 99")
+        kept = "".join("{}\n".format(line) for line in stdout_data)
+        dropped = "{} lines, {} bytes".format(
+            100 - len(stdout_data), len(lines) - len(kept))
+        self.assertEqual(details["Dropped stdout"], dropped)
+
+    def test_execute_with_blocking_buffers(self):
+        """Ensure ``execute()`` reads all output through small buffers."""
+        lines = b"".join(b"line %d\n" % i for i in range(100))
+        p = Mock(pid=10, stdout=io.BytesIO(lines), stderr=io.BytesIO())
+        p.returncode = 0
+        stdout_data = []
+
+        p1 = patch("{}.start".format(proc.__name__))
+        p2 = patch(
+            "{}.try_monitor".format(proc.__name__), return_value=None)
+        p3 = patch("{}.open_exit_fd".format(proc.__name__))
+        with p1 as start, p2, p3 as open_exit_fd:
+            start.return_value = p
+            open_exit_fd.return_value = None
+
+            _, _, details = proc.execute(
+                ["some-cmd"], stdout_data.append, Mock(), Mock(), None, None,
+                buffer_size=2, buffer_policy=stream.BLOCK)
+
+        self.assertEqual(len(stdout_data), 100)
+        self.assertEqual(details["Max buffered stdout"], "2 lines")
+        self.assertNotIn("Dropped stdout", details)
+
+    def test_wait_for_eof(self):
+        """Ensure ``wait_for_eof()`` waits for the streams to close."""
+        selector = Mock()
+        streams = [Mock(closed=True), Mock(closed=False)]
+        selector.select.side_effect = lambda t: setattr(
+            streams[1], "closed", True) or []
+        proc.wait_for_eof(selector, streams)
+        self.assertEqual(selector.select.call_count, 1)
+
+    def test_wait_for_eof_gives_up(self):
+        """Ensure ``wait_for_eof()`` gives up if the streams stay open."""
+        selector = Mock()
+        selector.select.return_value = []
+        streams = [Mock(closed=False)]
+        p = patch("{}.constants.EOF_TIMEOUT".format(proc.__name__), 0.01)
+        with p:
+            proc.wait_for_eof(selector, streams)
+        self.assertTrue(selector.select.called)
+
+    def test_execute_waits_for_eof_without_spinning(self):
+        """Ensure ``execute()`` blocks while a child holds the pipes open."""
+        start = time.process_time()
+        proc.execute(
+            "sleep 0.5 & echo out", Mock(), Mock(), Mock(), None, None)
+        self.assertLess(time.process_time() - start, 0.25)
+
+    def test_get_wait_time(self):
+        """Ensure ``get_wait_time()`` blocks until the next event."""
+        result = proc.get_wait_time(10, 15, None, 3)
+        self.assertEqual(result, 5)
+
+        result = proc.get_wait_time(10, 15, 12, 3)
+        self.assertEqual(result, 2)
+
+        result = proc.get_wait_time(10, 15, 12, None)
+        self.assertAlmostEqual(result, proc.constants.POLL_DELAY)
+
+        result = proc.get_wait_time(10, 8, None, 3)
+        self.assertEqual(result, 0)
 
     def test_execute(self):
         """Ensure ``execute()`` runs a process."""
@@ -131,23 +522,35 @@ class TestProc(TestCase):
         p.stdout = stdout
         p.stderr = stderr
 
-        p.poll = Mock()
-        p.poll.side_effect = [None, 0, 0]
+        p.returncode = None
 
         p1 = patch("{}.start".format(proc.__name__))
         p2 = patch("{}.try_monitor".format(proc.__name__))
-        with p1 as start, p2 as try_monitor:
+        p3 = patch("{}.open_exit_fd".format(proc.__name__))
+        p4 = patch_reap([None, 0])
+        with p1 as start, p2 as try_monitor, p3 as open_exit_fd, p4:
             start.return_value = p
+            open_exit_fd.return_value = None
+            try_monitor.return_value = {"pid": pid, "process": {"rss": 2048}}
 
             args = [
                 ["some-cmd"], stdout_log, stderr_log, ps_log,
                 timeout, shutdown]
-            exit_code, running_time = proc.execute(*args)
+            exit_code, running_time, details = proc.execute(*args)
 
-            calls = [call(ps_log, pid), call(ps_log, pid)]
+            calls = [
+                call(ps_log, pid, ANY, None, ANY, None, None, None),
+                call(ps_log, pid, ANY, None, ANY, None, None, None)]
             try_monitor.assert_has_calls(calls)
 
             self.assertEqual(exit_code, 0)
+            self.assertEqual(
+                details["Forwarded stdout"], "3 lines, 27 bytes")
+            self.assertEqual(
+                details["Forwarded stderr"], "3 lines, 27 bytes")
+            self.assertTrue(details["Sampling"].endswith("(2 times)"))
+            self.assertIn("Psrun CPU time", details)
+            self.assertEqual(details["Max sampled RSS"], "2 KiB")
             self.assertEqual(stdout_data, stdout_expected)
             self.assertEqual(stderr_data, stderr_expected)
 
@@ -172,16 +575,194 @@ class TestProc(TestCase):
         p.stdout = stdout
         p.stderr = stderr
 
-        p.poll = Mock()
-        p.poll.side_effect = [None, None, 15, 15]
+        p.returncode = None
 
         p1 = patch("{}.start".format(proc.__name__))
-        p2 = patch("{}.try_monitor".format(proc.__name__))
-        with p1 as start, p2:
+        p2 = patch(
+            "{}.try_monitor".format(proc.__name__), return_value=None)
+        p3 = patch("{}.open_exit_fd".format(proc.__name__))
+        p4 = patch("{}.reap".format(proc.__name__), return_value=None)
+        with p1 as start, p2, p3 as open_exit_fd, p4:
             start.return_value = p
+            open_exit_fd.return_value = None
 
             args = [
                 ["some-cmd"], stdout_log, stderr_log, ps_log,
                 timeout, shutdown]
             with self.assertRaises(exceptions.ProcTimeout):
                 proc.execute(*args)
+
+    def test_get_rss(self):
+        """Ensure ``get_rss()`` gets the RSS of the process tree, if any."""
+        self.assertEqual(
+            proc.get_rss({"pid": 10, "process": {"rss": 100}}), 100)
+        self.assertIsNone(proc.get_rss({"pid": 10}))
+        self.assertIsNone(proc.get_rss(None))
+
+    def test_check_rss(self):
+        """Ensure ``check_rss()`` raises only when over the max."""
+        proc.check_rss(100, None, ["ls"])
+        proc.check_rss(None, 100, ["ls"])
+        proc.check_rss(100, 100, ["ls"])
+        with self.assertRaises(exceptions.ProcMaxRss) as context:
+            proc.check_rss(101, 100, ["ls", "-la"])
+        self.assertEqual(
+            str(context.exception),
+            "Used 101 bytes of RSS, over the max of 100: ls -la")
+
+    def test_execute_with_max_rss(self):
+        """Ensure ``execute()`` stops a process that uses too much RSS."""
+        p = Mock(pid=10, stdout=io.BytesIO(), stderr=io.BytesIO())
+        p.returncode = None
+
+        p1 = patch("{}.start".format(proc.__name__))
+        p2 = patch("{}.try_monitor".format(proc.__name__))
+        p3 = patch("{}.open_exit_fd".format(proc.__name__))
+        p4 = patch("{}.reap".format(proc.__name__), return_value=None)
+        with p1 as start, p2 as try_monitor, p3 as open_exit_fd, p4:
+            start.return_value = p
+            open_exit_fd.return_value = None
+            try_monitor.return_value = {"pid": 10, "process": {"rss": 2048}}
+
+            with self.assertRaises(exceptions.ProcMaxRss):
+                proc.execute(
+                    ["some-cmd"], Mock(), Mock(), Mock(), None, 0.1,
+                    max_rss=1024)
+            p.terminate.assert_called_once_with()
+
+    def test_execute_with_idle_timeout(self):
+        """Ensure ``execute()`` stops a process that stalls."""
+        p = Mock(pid=10, stdout=io.BytesIO(), stderr=io.BytesIO())
+        p.returncode = None
+
+        p1 = patch("{}.start".format(proc.__name__))
+        p2 = patch("{}.try_monitor".format(proc.__name__))
+        p3 = patch("{}.open_exit_fd".format(proc.__name__))
+        p4 = patch("{}.reap".format(proc.__name__), return_value=None)
+        with p1 as start, p2 as try_monitor, p3 as open_exit_fd, p4:
+            start.return_value = p
+            open_exit_fd.return_value = None
+            try_monitor.return_value = {"pid": 10, "process": {}}
+
+            with self.assertRaises(exceptions.ProcTimeout) as context:
+                proc.execute(
+                    ["some-cmd"], Mock(), Mock(), Mock(), 5, 0.1,
+                    sample_interval=0.01, idle_timeout=0.05)
+            self.assertEqual(
+                str(context.exception),
+                "Idle for more than 0.05 secs: some-cmd")
+            p.terminate.assert_called_once_with()
+
+    def test_execute_sets_cpu_limit(self):
+        """Ensure ``execute()`` has the kernel enforce the CPU budget too."""
+        p = patch("{}.limits.set_cpu_limit".format(proc.__name__))
+        with p as set_cpu_limit:
+            proc.execute(
+                "true", Mock(), Mock(), Mock(), None, 2,
+                sample_interval=0.5, cpu_timeout=10)
+            set_cpu_limit.assert_called_once_with(ANY, 10, 2, 0.5)
+            set_cpu_limit.reset_mock()
+            proc.execute(
+                "true", Mock(), Mock(), Mock(), None, 2,
+                sample_interval=0.5, max_sample_interval=8, cpu_timeout=10)
+            set_cpu_limit.assert_called_once_with(ANY, 10, 2, 5)
+
+    def test_execute_with_sample_interval(self):
+        """Ensure ``execute()`` samples at its own rate, with a sampler."""
+        p = Mock(pid=10, stdout=io.BytesIO(b"out\n"), stderr=io.BytesIO())
+        p.returncode = None
+        stdout_data = []
+
+        p1 = patch("{}.start".format(proc.__name__))
+        p2 = patch(
+            "{}.try_monitor".format(proc.__name__), return_value=None)
+        p3 = patch("{}.open_exit_fd".format(proc.__name__))
+        p4 = patch_reap([None, None, None, 0])
+        with p1 as start, p2 as try_monitor, p3 as open_exit_fd, p4:
+            start.return_value = p
+            open_exit_fd.return_value = None
+
+            sampler = Mock()
+            proc.execute(
+                ["some-cmd"], stdout_data.append, Mock(), Mock(), None, None,
+                sample_interval=10, sampler=sampler)
+
+            self.assertEqual(try_monitor.call_count, 2)
+            for args, _ in try_monitor.call_args_list:
+                self.assertIs(args[4], sampler)
+            self.assertEqual(stdout_data, ["out"])
+
+    def test_execute_with_adaptive_interval(self):
+        """Ensure ``execute()`` samples a steady process less often."""
+        ps_data = []
+        proc.execute(
+            "sleep 0.5", Mock(), Mock(), ps_data.append, None, None,
+            sample_interval=0.01, max_sample_interval=0.16)
+        self.assertGreater(len(ps_data), 4)
+        self.assertLess(len(ps_data), 15)
+
+    def test_get_max_sample_interval(self):
+        """Ensure ``get_max_sample_interval()`` keeps up with the limits."""
+        self.assertIsNone(proc.get_max_sample_interval(1, None, 100, 5, 5))
+        self.assertEqual(proc.get_max_sample_interval(1, 30), 30)
+        self.assertEqual(proc.get_max_sample_interval(1, 30, max_rss=100), 1)
+        self.assertEqual(
+            proc.get_max_sample_interval(1, 30, cpu_timeout=20), 10)
+        self.assertEqual(
+            proc.get_max_sample_interval(
+                1, 30, cpu_timeout=20, idle_timeout=8), 4)
+
+    def test_execute_with_adaptive_interval_and_max_rss(self):
+        """Ensure ``execute()`` does not back off while checking the RSS."""
+        ps_data = []
+        proc.execute(
+            "sleep 0.5", Mock(), Mock(), ps_data.append, None, None,
+            sample_interval=0.01, max_sample_interval=0.16,
+            max_rss=2 ** 40)
+        self.assertGreater(len(ps_data), 15)
+
+    def test_execute_in_direct_mode(self):
+        """Ensure ``execute()`` lets processes write to fds themselves."""
+        with tempfile.TemporaryFile() as dest:
+            redirect = stream.Redirect(dest.fileno())
+            p = patch("{}.stream.read".format(proc.__name__))
+            with p as read:
+                exit_code, _, details = proc.execute(
+                    "echo out; echo err >&2", redirect, redirect, Mock(),
+                    None, None, sample_interval=10)
+                read.assert_not_called()
+
+            dest.seek(0)
+            self.assertEqual(dest.read(), b"out\nerr\n")
+        self.assertEqual(exit_code, 0)
+        self.assertNotIn("Forwarded stdout", details)
+        self.assertNotIn("Max buffered stdout", details)
+
+    def test_execute_in_raw_mode(self):
+        """Ensure ``execute()`` copies raw bytes to file descriptors."""
+        stdout_r, stdout_w = os.pipe()
+        os.write(stdout_w, b"raw \xff bytes")
+        os.close(stdout_w)
+        dest_r, dest_w = os.pipe()
+        stderr_data = []
+
+        p = Mock(pid=10, stderr=io.BytesIO(b"err\n"))
+        p.stdout = os.fdopen(stdout_r, "rb")
+        p.returncode = None
+
+        p1 = patch("{}.start".format(proc.__name__))
+        p2 = patch(
+            "{}.try_monitor".format(proc.__name__), return_value=None)
+        p3 = patch("{}.open_exit_fd".format(proc.__name__))
+        p4 = patch_reap([None, 0])
+        with p1 as start, p2, p3 as open_exit_fd, p4:
+            start.return_value = p
+            open_exit_fd.return_value = None
+
+            proc.execute(
+                ["some-cmd"], dest_w, stderr_data.append, Mock(), None, None)
+
+        os.close(dest_w)
+        with os.fdopen(dest_r, "rb") as dest:
+            self.assertEqual(dest.read(), b"raw \xff bytes")
+        self.assertEqual(stderr_data, ["err"])
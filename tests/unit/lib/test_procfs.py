@@ -0,0 +1,216 @@
+"""Unit tests for the ``lib.procfs`` module."""
+
+from unittest import TestCase
+from unittest.mock import patch
+
+import os
+import tempfile
+
+from psrun.lib import procfs
+
+STAT = b"""cpu  200 0 100 1000 5 0 1 0 0 0
+cpu0 100 0 50 500 3 0 1 0 0 0
+cpu1 100 0 50 500 2 0 0 0 0 0
+intr 3000 1 2 3
+ctxt 4000
+btime 1700000000
+softirq 5000 6 7
+"""
+
+MEMINFO = b"""MemTotal:       1000 kB
+MemFree:         400 kB
+MemAvailable:    600 kB
+SwapCached:        0 kB
+SwapTotal:       200 kB
+SwapFree:        150 kB
+"""
+
+VMSTAT = b"""nr_free_pages 100
+pswpin 3
+pswpout 4
+"""
+
+CPUINFO = b"""processor\t: 0
+cpu MHz\t\t: 2000.000
+cpu cores\t: 2
+
+processor\t: 1
+cpu MHz\t\t: 3000.000
+cpu cores\t: 2
+"""
+
+
+class TestProcfs(TestCase):
+    """Test suite for the ``lib.procfs`` module."""
+
+    def setUp(self):
+        """Write fake /proc files, and point the module at them."""
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        files = {
+            "STAT": STAT, "MEMINFO": MEMINFO, "VMSTAT": VMSTAT,
+            "CPUINFO": CPUINFO}
+        for name, contents in files.items():
+            path = self.write(name.lower(), contents)
+            p = patch.object(procfs, name, path)
+            p.start()
+            self.addCleanup(p.stop)
+        p = patch.object(
+            procfs, "CPUFREQ", os.path.join(self.tmp, "policy[0-9]*"))
+        p.start()
+        self.addCleanup(p.stop)
+
+        self.reader = procfs.Reader()
+        self.reader.clock_ticks = 100
+        self.addCleanup(self.reader.close)
+
+    def write(self, name, contents):
+        """Write a file in the temp dir, and get its path."""
+        path = os.path.join(self.tmp, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(contents)
+        return path
+
+    def test_is_supported(self):
+        """Ensure ``is_supported()`` checks for the files it needs."""
+        self.assertTrue(procfs.is_supported())
+        self.write("meminfo", b"MemTotal:       1000 kB\n")
+        self.assertFalse(procfs.is_supported())
+        with patch.object(procfs, "MEMINFO", "/dummy/path"):
+            self.assertFalse(procfs.is_supported())
+
+    def test_find_line(self):
+        """Ensure ``find_line()`` only matches keys at the start of lines."""
+        buffer = bytearray(b"a key 1\nkey 2\nkey 3")
+        fields, end = procfs.find_line(buffer, len(buffer), b"key")
+        self.assertEqual(fields, [b"key", b"2"])
+        fields, end = procfs.find_line(buffer, len(buffer), b"key", end)
+        self.assertEqual(fields, [b"key", b"3"])
+        fields, end = procfs.find_line(buffer, len(buffer), b"key", end)
+        self.assertIsNone(fields)
+        self.assertEqual(
+            procfs.get_field(buffer, len(buffer), b"other", 0), 0)
+
+    def test_read_again(self):
+        """Ensure a ``File`` sees what changed, and grows to fit it all."""
+        path = self.write("file", b"1")
+        f = procfs.File(path)
+        self.assertEqual(f.buffer[:f.read()], b"1")
+
+        self.write("file", b"2" * (procfs.BUFFER_SIZE * 3))
+        length = f.read()
+        self.assertEqual(length, procfs.BUFFER_SIZE * 3)
+        self.assertEqual(len(f.buffer), procfs.BUFFER_SIZE * 4)
+        f.close()
+        self.assertTrue(f.file.closed)
+
+    def test_reader_keeps_files_open(self):
+        """Ensure a ``Reader`` opens each file once."""
+        self.reader.cpu_times()
+        self.reader.cpu_stats()
+        self.assertEqual(list(self.reader.files), [procfs.STAT])
+
+    def test_reader_close(self):
+        """Ensure ``close()`` closes a ``Reader``'s files, until reread."""
+        self.reader.cpu_times()
+        f = self.reader.files[procfs.STAT]
+        self.reader.close()
+        self.assertTrue(f.file.closed)
+        self.assertEqual(self.reader.files, {})
+        self.reader.cpu_times()
+        self.assertEqual(list(self.reader.files), [procfs.STAT])
+
+    def test_reader_sample(self):
+        """Ensure a ``Reader`` reads each file once per ``sample()``."""
+        p = patch.object(
+            procfs.File, "read", autospec=True, side_effect=procfs.File.read)
+        with p as read:
+            with self.reader.sample():
+                self.reader.cpu_times()
+                self.reader.cpu_times_per_cpu()
+                self.reader.cpu_stats()
+                self.reader.virtual_memory()
+                self.reader.swap_memory()
+            self.assertEqual(read.call_count, 3)
+
+            self.write("stat", STAT.replace(b"ctxt 4000", b"ctxt 4001"))
+            with self.reader.sample():
+                self.assertEqual(
+                    self.reader.cpu_stats()["ctx_switches"], 4001)
+                self.reader.close()
+                self.assertEqual(
+                    self.reader.cpu_stats()["ctx_switches"], 4001)
+            self.assertEqual(read.call_count, 5)
+
+            self.reader.cpu_times()
+            self.reader.cpu_times()
+            self.assertEqual(read.call_count, 7)
+
+    def test_cpu_times(self):
+        """Ensure ``cpu_times()`` reads /proc/stat, in secs."""
+        self.assertEqual(
+            self.reader.cpu_times(),
+            {"user": 2.0, "system": 1.0, "idle": 10.0})
+        self.assertEqual(self.reader.cpu_times_per_cpu(), [
+            {"user": 1.0, "system": 0.5, "idle": 5.0},
+            {"user": 1.0, "system": 0.5, "idle": 5.0}])
+        self.assertGreater(procfs.Reader().clock_ticks, 0)
+
+    def test_cpu_stats(self):
+        """Ensure ``cpu_stats()`` reads the totals from /proc/stat."""
+        self.assertEqual(self.reader.cpu_stats(), {
+            "ctx_switches": 4000, "interrupts": 3000,
+            "soft_interrupts": 5000, "syscalls": 0})
+
+    def test_cpu_freq_from_cpuinfo(self):
+        """Ensure ``cpu_freq()`` falls back to /proc/cpuinfo."""
+        self.assertEqual(self.reader.cpu_freq_per_cpu(), [
+            {"current": 2000.0, "min": 0.0, "max": 0.0},
+            {"current": 3000.0, "min": 0.0, "max": 0.0}])
+        self.assertEqual(
+            self.reader.cpu_freq(),
+            {"current": 2500.0, "min": 0.0, "max": 0.0})
+
+    def test_cpu_freq_from_sysfs(self):
+        """Ensure ``cpu_freq()`` reads the cpufreq policies, in order."""
+        for n in [0, 1, 10]:
+            for name, khz in [("cur", 2000), ("min", 1000), ("max", 4000)]:
+                self.write(
+                    "policy{}/scaling_{}_freq".format(n, name),
+                    "{}\n".format(khz * (n + 1)).encode("utf-8"))
+        self.assertEqual(self.reader.cpu_freq_per_cpu(), [
+            {"current": 2.0, "min": 1.0, "max": 4.0},
+            {"current": 4.0, "min": 2.0, "max": 8.0},
+            {"current": 22.0, "min": 11.0, "max": 44.0}])
+        self.assertEqual(
+            self.reader.cpu_freq(),
+            {"current": 28 / 3, "min": 14 / 3, "max": 56 / 3})
+
+    def test_cpu_freq_from_nowhere(self):
+        """Ensure ``cpu_freq()`` gives zeros if it finds no frequencies."""
+        self.write("cpuinfo", b"processor\t: 0\n")
+        self.assertEqual(self.reader.cpu_freq_per_cpu(), [])
+        self.assertEqual(
+            self.reader.cpu_freq(),
+            {"current": 0.0, "min": 0.0, "max": 0.0})
+
+    def test_virtual_memory(self):
+        """Ensure ``virtual_memory()`` reads /proc/meminfo, in bytes."""
+        self.assertEqual(self.reader.virtual_memory(), {
+            "total": 1024000, "available": 614400, "used": 409600,
+            "free": 409600})
+
+    def test_swap_memory(self):
+        """Ensure ``swap_memory()`` reads /proc/meminfo and /proc/vmstat."""
+        self.assertEqual(self.reader.swap_memory(), {
+            "total": 204800, "used": 51200, "free": 153600,
+            "percent": 25.0, "sin": 3 * 4096, "sout": 4 * 4096})
+
+        self.write("meminfo", MEMINFO.replace(b"200 kB", b"0 kB").replace(
+            b"150 kB", b"0 kB"))
+        self.write("vmstat", b"nr_free_pages 100\n")
+        self.assertEqual(self.reader.swap_memory(), {
+            "total": 0, "used": 0, "free": 0, "percent": 0.0, "sin": 0,
+            "sout": 0})
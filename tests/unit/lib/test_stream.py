@@ -1,8 +1,13 @@
 """Unit tests for the ``lib.stream`` module."""
 
 from unittest import TestCase
-from queue import Queue
+from unittest.mock import Mock, patch
+from queue import Full, Queue
+from threading import Event
+import errno
 import io
+import os
+import tempfile
 
 from psrun.lib import stream as stream_lib
 
@@ -34,3 +39,228 @@ class TestStream(TestCase):
         for line in lines:
             self.assertEqual(line, result.get())
         self.assertTrue(result.empty())
+
+    def test_read_with_notify(self):
+        """Ensure ``read()`` notifies for each line, and at the end."""
+        lines = [b"line 1\n", b"line 2\n"]
+        stream = io.BytesIO(b"".join(lines))
+        done = Event()
+        calls = []
+
+        def notify():
+            calls.append(None)
+            if len(calls) == len(lines) + 1:
+                done.set()
+
+        result = stream_lib.read(stream, notify)
+        self.assertTrue(done.wait(1))
+        for line in lines:
+            self.assertEqual(line, result.get())
+
+    def test_write_all(self):
+        """Ensure ``write_all()`` retries partial writes."""
+        p = patch("{}.os.write".format(stream_lib.__name__))
+        with p as write:
+            write.side_effect = [2, 3]
+            stream_lib.write_all(1, memoryview(b"hello"))
+            self.assertEqual(write.call_count, 2)
+            self.assertEqual(bytes(write.call_args[0][1]), b"llo")
+
+    def test_copy_chunks(self):
+        """Ensure ``copy_chunks()`` copies raw bytes, and closes the stream."""
+        data = b"line 1\nnot utf8: \xff\xfe\npartial line"
+        src_r, src_w = os.pipe()
+        dest_r, dest_w = os.pipe()
+        os.write(src_w, data)
+        os.close(src_w)
+        stream = os.fdopen(src_r, "rb")
+        notify = Mock()
+
+        result = stream_lib.copy_chunks(stream, dest_w, notify, chunk_size=4)
+        os.close(dest_w)
+        with os.fdopen(dest_r, "rb") as dest:
+            self.assertEqual(dest.read(), data)
+        self.assertEqual(result, len(data))
+        self.assertTrue(stream.closed)
+        self.assertTrue(notify.called)
+
+    def test_copy_chunks_discards_when_writes_fail(self):
+        """Ensure ``copy_chunks()`` keeps reading if writes fail."""
+        src_r, src_w = os.pipe()
+        os.write(src_w, b"x" * 10)
+        os.close(src_w)
+        stream = os.fdopen(src_r, "rb")
+
+        p = patch("{}.write_all".format(stream_lib.__name__))
+        with p as write_all:
+            write_all.side_effect = BrokenPipeError
+            result = stream_lib.copy_chunks(stream, 99, chunk_size=4)
+            self.assertEqual(write_all.call_count, 1)
+        self.assertEqual(result, 10)
+
+    def test_copy_chunks_to_a_file(self):
+        """Ensure ``copy_chunks()`` splices only into files it may."""
+        for flags, splice in [(0, True), (0, False), (os.O_APPEND, False)]:
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, "out.log")
+                fd = os.open(path, os.O_WRONLY | os.O_CREAT | flags)
+                os.write(fd, b"start\n")
+                src_r, src_w = os.pipe()
+                os.write(src_w, b"dummy bytes")
+                os.close(src_w)
+
+                fds = {fd} if splice else set()
+                p1 = patch.object(stream_lib, "SPLICE_FDS", fds)
+                p2 = patch(
+                    "{}.splice_chunks".format(stream_lib.__name__),
+                    wraps=stream_lib.splice_chunks)
+                with p1, p2 as splice_chunks:
+                    result = stream_lib.copy_chunks(
+                        os.fdopen(src_r, "rb"), fd)
+                    self.assertEqual(splice_chunks.called, splice)
+                os.close(fd)
+                with open(path, "rb") as f:
+                    self.assertEqual(f.read(), b"start\ndummy bytes")
+                self.assertEqual(result, 11)
+
+    def test_can_splice(self):
+        """Ensure ``can_splice()`` allows pipes, and files it is told of."""
+        r, w = os.pipe()
+        with tempfile.TemporaryFile() as f:
+            self.assertTrue(stream_lib.can_splice(w))
+            self.assertFalse(stream_lib.can_splice(f.fileno()))
+            with patch.object(stream_lib, "SPLICE_FDS", {f.fileno()}):
+                self.assertTrue(stream_lib.can_splice(f.fileno()))
+        os.close(r)
+        os.close(w)
+        self.assertFalse(stream_lib.can_splice(w))
+
+    def test_copy_chunks_discards_when_splicing_fails(self):
+        """Ensure ``copy_chunks()`` keeps reading if splicing fails."""
+        src_r, src_w = os.pipe()
+        os.write(src_w, b"x" * 10)
+        os.close(src_w)
+        stream = os.fdopen(src_r, "rb")
+
+        p1 = patch("{}.splice_chunks".format(stream_lib.__name__))
+        p2 = patch("{}.write_all".format(stream_lib.__name__))
+        p3 = patch.object(stream_lib, "SPLICE_FDS", {99})
+        with p1 as splice_chunks, p2 as write_all, p3:
+            splice_chunks.side_effect = BrokenPipeError
+            result = stream_lib.copy_chunks(stream, 99)
+            self.assertFalse(write_all.called)
+        self.assertEqual(result, 10)
+        self.assertTrue(stream.closed)
+
+    def test_copy_chunks_without_a_fd(self):
+        """Ensure ``copy_chunks()`` discards everything without a fd."""
+        src_r, src_w = os.pipe()
+        os.write(src_w, b"x" * 10)
+        os.close(src_w)
+        result = stream_lib.copy_chunks(os.fdopen(src_r, "rb"), None)
+        self.assertEqual(result, 10)
+
+    def test_splice_chunks(self):
+        """Ensure ``splice_chunks()`` moves bytes from a pipe to a fd."""
+        src_r, src_w = os.pipe()
+        dest_r, dest_w = os.pipe()
+        os.write(src_w, b"dummy bytes")
+        os.close(src_w)
+
+        result = stream_lib.splice_chunks(src_r, dest_w, 4)
+        self.assertEqual(result, 11)
+        self.assertEqual(os.read(dest_r, 100), b"dummy bytes")
+        for fd in [src_r, dest_r, dest_w]:
+            os.close(fd)
+
+    def test_splice_chunks_when_unsupported(self):
+        """Ensure ``splice_chunks()`` moves nothing if it cannot splice."""
+        src_r, src_w = os.pipe()
+        os.write(src_w, b"dummy bytes")
+        os.close(src_w)
+
+        with patch.object(stream_lib.os, "splice", None):
+            self.assertIsNone(stream_lib.splice_chunks(src_r, 99, 4))
+        self.assertIsNone(stream_lib.splice_chunks(src_r, 99, 4))
+        self.assertEqual(os.read(src_r, 100), b"dummy bytes")
+        os.close(src_r)
+
+    def test_splice_chunks_when_writes_fail(self):
+        """Ensure ``splice_chunks()`` raises if writes fail part way."""
+        p = patch.object(stream_lib.os, "splice")
+        with p as splice:
+            splice.side_effect = [4, BrokenPipeError(errno.EPIPE, "dummy")]
+            with self.assertRaises(BrokenPipeError):
+                stream_lib.splice_chunks(3, 4, 4)
+
+            splice.side_effect = [BrokenPipeError(errno.EPIPE, "dummy")]
+            with self.assertRaises(BrokenPipeError):
+                stream_lib.splice_chunks(3, 4, 4)
+
+    def test_forward(self):
+        """Ensure ``forward()`` copies raw bytes in a thread."""
+        src_r, src_w = os.pipe()
+        dest_r, dest_w = os.pipe()
+        os.write(src_w, b"dummy bytes")
+        os.close(src_w)
+
+        thread = stream_lib.forward(os.fdopen(src_r, "rb"), dest_w)
+        thread.join(1)
+        os.close(dest_w)
+        with os.fdopen(dest_r, "rb") as dest:
+            self.assertEqual(dest.read(), b"dummy bytes")
+
+    def test_buffer_blocks(self):
+        """Ensure a blocking ``Buffer`` waits for room."""
+        buf = stream_lib.Buffer(1, stream_lib.BLOCK)
+        buf.put_line(b"one\n")
+        with self.assertRaises(Full):
+            buf.put(b"two\n", timeout=0.01)
+        self.assertEqual(buf.dropped_lines, 0)
+
+    def test_buffer_drops_oldest(self):
+        """Ensure a ``DROP_OLDEST`` buffer drops the oldest lines."""
+        buf = stream_lib.Buffer(2, stream_lib.DROP_OLDEST)
+        for line in [b"one\n", b"two\n", b"three\n"]:
+            buf.put_line(line)
+        self.assertEqual(stream_lib.pop(buf), b"two\n")
+        self.assertEqual(stream_lib.pop(buf), b"three\n")
+        self.assertEqual(buf.dropped_lines, 1)
+        self.assertEqual(buf.dropped_bytes, 4)
+
+    def test_buffer_drops_oldest_when_emptied(self):
+        """Ensure a ``DROP_OLDEST`` buffer copes with a racing reader."""
+        buf = stream_lib.Buffer(1, stream_lib.DROP_OLDEST)
+        buf.put_line(b"one\n")
+        p = patch("{}.pop".format(stream_lib.__name__))
+        with p as pop:
+            pop.side_effect = lambda q: q.get_nowait() and None
+            buf.put_line(b"two\n")
+        self.assertEqual(buf.dropped_lines, 0)
+        self.assertEqual(stream_lib.pop(buf), b"two\n")
+
+    def test_buffer_high_water(self):
+        """Ensure a ``Buffer`` tracks the most lines it has held."""
+        buf = stream_lib.Buffer()
+        for line in [b"one\n", b"two\n"]:
+            buf.put_line(line)
+        stream_lib.pop(buf)
+        buf.put_line(b"three\n")
+        self.assertEqual(buf.high_water, 2)
+
+    def test_buffer_drops_newest(self):
+        """Ensure a ``DROP_NEWEST`` buffer drops the newest lines."""
+        buf = stream_lib.Buffer(2, stream_lib.DROP_NEWEST)
+        for line in [b"one\n", b"two\n", b"three\n"]:
+            buf.put_line(line)
+        self.assertEqual(stream_lib.pop(buf), b"one\n")
+        self.assertEqual(stream_lib.pop(buf), b"two\n")
+        self.assertEqual(buf.dropped_lines, 1)
+        self.assertEqual(buf.dropped_bytes, 6)
+
+    def test_read_with_a_bounded_buffer(self):
+        """Ensure ``read()`` creates a bounded buffer."""
+        result = stream_lib.read(
+            io.BytesIO(), None, 5, stream_lib.DROP_NEWEST)
+        self.assertEqual(result.maxsize, 5)
+        self.assertEqual(result.policy, stream_lib.DROP_NEWEST)
@@ -0,0 +1,111 @@
+"""Unit tests for the ``lib.summary`` module."""
+
+from unittest import TestCase
+from unittest.mock import Mock
+
+import json
+import random
+
+from psrun.lib import summary as summary_lib
+
+
+class TestSummary(TestCase):
+    """Test suite for the ``lib.summary`` module."""
+
+    def test_quantile(self):
+        """Ensure a ``Quantile`` estimates quantiles of a stream."""
+        rand = random.Random(1)
+        numbers = [rand.expovariate(1) for _ in range(10000)]
+        quantiles = [summary_lib.Quantile(p) for p in (0.5, 0.95, 0.99)]
+        for x in numbers:
+            for quantile in quantiles:
+                quantile.add(x)
+
+        numbers.sort()
+        for quantile in quantiles:
+            expected = numbers[int(quantile.p * len(numbers))]
+            self.assertAlmostEqual(quantile.value(), expected, delta=0.05)
+
+    def test_quantile_of_a_few_numbers(self):
+        """Ensure a ``Quantile`` is exact until it has five numbers."""
+        quantile = summary_lib.Quantile(0.5)
+        self.assertIsNone(quantile.value())
+        for x in [3, 1, 2]:
+            quantile.add(x)
+        self.assertEqual(quantile.value(), 2)
+
+        quantile = summary_lib.Quantile(0.99)
+        for x in [3, 1, 2]:
+            quantile.add(x)
+        self.assertEqual(quantile.value(), 3)
+
+    def test_quantile_of_a_sorted_stream(self):
+        """Ensure a ``Quantile`` copes with numbers that only go up."""
+        quantile = summary_lib.Quantile(0.5)
+        for x in range(1001):
+            quantile.add(x)
+        self.assertAlmostEqual(quantile.value(), 500, delta=5)
+        self.assertEqual(quantile.heights[0], 0)
+        self.assertEqual(quantile.heights[4], 1000)
+
+    def test_quantile_of_a_constant_stream(self):
+        """Ensure a ``Quantile`` copes with numbers that never change."""
+        quantile = summary_lib.Quantile(0.95)
+        for _ in range(100):
+            quantile.add(7)
+        self.assertEqual(quantile.value(), 7)
+
+    def test_metric(self):
+        """Ensure a ``Metric`` summarizes a stream of numbers."""
+        metric = summary_lib.Metric()
+        for x in [4, 2, 6]:
+            metric.add(x)
+        self.assertEqual(list(metric.get_summary().items()), [
+            ("count", 3), ("min", 2), ("max", 6), ("mean", 4),
+            ("p50", 4), ("p95", 6), ("p99", 6)])
+
+    def test_metric_without_numbers(self):
+        """Ensure an empty ``Metric`` has nothing to report."""
+        metric = summary_lib.Metric(percentiles=[90])
+        self.assertEqual(dict(metric.get_summary()), {
+            "count": 0, "min": None, "max": None, "mean": None,
+            "p90": None})
+
+    def test_summary(self):
+        """Ensure a ``Summary`` summarizes each numeric stat."""
+        data = []
+        summary = summary_lib.Summary(data.append)
+        for rss in [10, 30]:
+            summary.add({
+                "pid": 10, "all_pids": [1, 2],
+                "process": {"rss": rss, "pids": [10], "busy": True},
+                "cpu_times_per_cpu": [{"user": 1.5}]}, now=0)
+        self.assertEqual(data, [])
+
+        summary.write()
+        record = json.loads(data[0])
+        self.assertEqual(record["samples"], 2)
+        self.assertEqual(
+            sorted(record["summary"]),
+            ["cpu_times_per_cpu/0/user", "process/rss"])
+        self.assertEqual(record["summary"]["process/rss"]["mean"], 20)
+        self.assertEqual(record["summary"]["process/rss"]["max"], 30)
+
+    def test_summary_with_interval(self):
+        """Ensure a ``Summary`` writes itself every ``interval`` secs."""
+        encode = Mock(return_value="dummy-record")
+        data = []
+        summary = summary_lib.Summary(data.append, encode, interval=5)
+        summary.written = 100
+
+        summary.add({"process": {"rss": 1}}, now=104)
+        self.assertEqual(data, [])
+        summary.add({"process": {"rss": 2}}, now=105)
+        self.assertEqual(data, ["dummy-record"])
+        self.assertEqual(summary.written, 105)
+        summary.add({"process": {"rss": 3}}, now=109)
+        self.assertEqual(len(data), 1)
+
+        written = encode.call_args[0][0]
+        self.assertEqual(written["samples"], 2)
+        self.assertEqual(written["summary"]["process/rss"]["count"], 2)